@@ -0,0 +1,99 @@
+"""
+Compares the offer workbook reader backends on real offer files.
+
+Usage: python -m benchmarks.bench_readers "N:/.../Ofertas recibidas SVH/2024" --limit 200
+
+Without paths it reads generated offer files (see benchmarks.generate_offers):
+    python -m benchmarks.bench_readers --generate 200
+"""
+import argparse
+import glob
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.generate_offers import generate_offers
+from benchmarks.suite import DATA_DIR, offers_dir
+from conf.functions import load_json_config
+from conf.readers import READER_BACKENDS
+from conf.settings import cell_address_file, sap_mapping_file
+from update_offers import extract_cell_values
+
+console = Console()
+
+
+def measure(file: str, reader: str, search_strings: dict, columns_dict: dict):
+    """
+    Returns the parse time (seconds) and the peak Python memory (MiB) of one file.
+    Time and memory are measured in separate runs, as tracemalloc slows parsing down.
+    """
+    start = time.perf_counter()
+    extract_cell_values(file, search_strings, columns_dict, reader=reader)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    extract_cell_values(file, search_strings, columns_dict, reader=reader)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2**20
+
+
+def main(paths: list[str], limit: int | None = None, generate: int = 100):
+    if not paths:
+        with console.status(f"Generating {generate} offer workbooks..."):
+            generated = generate_offers(offers_dir(DATA_DIR, generate), generate)
+        paths = [p.as_posix() for p in generated]
+    files = []
+    for p in paths:
+        if Path(p).is_dir():
+            files.extend(glob.iglob(Path(p).as_posix() + "/**/[!~$]*.xlsx", recursive=True))
+        else:
+            files.append(p)
+    files = sorted(files)[:limit]
+    if not files:
+        console.print("No files to benchmark.")
+        return
+
+    search_strings = load_json_config(cell_address_file)
+    columns_dict = load_json_config(sap_mapping_file)
+
+    table = Table(title=f"Reader backends over {len(files)} file(s)")
+    for column in ["Backend", "Median time (s)", "Total time (s)", "Median peak (MiB)", "Max peak (MiB)"]:
+        table.add_column(column)
+
+    for reader in READER_BACKENDS:
+        times, peaks = [], []
+        with console.status(f"Reading files with the '{reader}' backend..."):
+            for file in files:
+                elapsed, peak = measure(file, reader, search_strings, columns_dict)
+                times.append(elapsed)
+                peaks.append(peak)
+        table.add_row(
+            reader,
+            f"{statistics.median(times):0.3f}",
+            f"{sum(times):0.2f}",
+            f"{statistics.median(peaks):0.1f}",
+            f"{max(peaks):0.1f}",
+        )
+
+    console.print(table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "paths", nargs="*", help="Offer files or folders to read. Default: generated files"
+    )
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of files")
+    parser.add_argument(
+        "--generate",
+        type=int,
+        default=100,
+        help="Offer files to generate when no paths are given. Default: 100",
+    )
+    args = parser.parse_args()
+    main(args.paths, args.limit, args.generate)
@@ -0,0 +1,232 @@
+"""
+Generates synthetic offer workbooks for the benchmarks.
+
+The FICHA sheet carries every label of conf/cell_addresses.json at a random position,
+with its value at the offset the label defines. The SAP/Oferta sheet has a table whose
+headers are taken from conf/sap_columns_mapping.json. Files are laid out like the offers
+folder (year/yyyymmdd/file.xlsx) and each one is seeded by its index, so a folder of
+1000 files holds the same first 100 files as a folder of 100.
+
+Usage: python -m benchmarks.generate_offers ./_bench/offers_100 --files 100
+"""
+import argparse
+import datetime
+import random
+from pathlib import Path
+
+import duckdb
+import openpyxl
+import pyarrow as pa
+
+from conf.functions import LabelMatcher, load_json_config
+from conf.settings import cell_address_file, sap_mapping_file
+
+BENCH_YEAR = 2023
+
+# Texto de las etiquetas cuya expresion regular no se reconoce a si misma
+LABEL_SAMPLES = {
+    "offer_id": "Núm. OFERTA",
+    "offer_date": "FECHA RECEPCIÓN OFERTA",
+    "offer_price": "OFERTA",
+    "appraisal_price": "TASACIÓN (€)",
+    "buyer_meeting": "Reunión Comprador",
+    "servihabitat_opinion": "OPINIÓN SERVIHABITAT SVH",
+}
+FILLER_TEXTS = [
+    "Observaciones",
+    "Comentarios del comercial",
+    "Ver anexo",
+    "Pendiente de revisar",
+    "Información adicional",
+]
+TEXT_VALUES = ["SI", "NO", "Pendiente", "N/A", "-", "Ver observaciones"]
+ASSET_TYPES = ["Suelo", "Vivienda", "Local", "Garaje", "Trastero", "Nave"]
+
+
+def label_layout(search_strings: dict) -> list[tuple[str, list[tuple[str, int, int]]]]:
+    """
+    Groups the labels by pattern: labels that share a pattern (e.g. "ORIGEN OFERTA")
+    read their values around the same cell. Returns (label text, [(label, dy, dx)]).
+    """
+    matcher = LabelMatcher.from_config(search_strings)
+    groups: dict[str, tuple[str, list]] = {}
+    for label, [regex, offset_y, offset_x] in search_strings.items():
+        if regex not in groups:
+            text = LABEL_SAMPLES.get(label, regex)
+            # La etiqueta tiene que llevar a su patron y no a uno anterior
+            first = next((a for a in matcher.anchors if a[0].match(text)), (None, None))
+            if first[0] is None or first[0].pattern != regex:
+                raise ValueError(
+                    f"The sample text {text!r} does not select the pattern of {label}, add it to LABEL_SAMPLES"
+                )
+            groups[regex] = (text, [])
+        groups[regex][1].append((label, offset_y, offset_x))
+    for text in FILLER_TEXTS:
+        if matcher.prefilter.match(text):
+            raise ValueError(f"The filler text {text!r} matches a label pattern")
+    return list(groups.values())
+
+
+def label_value(label: str, rnd: random.Random, offer_date: datetime.date):
+    # Los valores imitan lo que se encuentra en las fichas, formatos sucios incluidos
+    if label == "offer_id":
+        offer_id = rnd.randint(5000000, 5999999)
+        return rnd.choice([offer_id, str(offer_id), f"Nº {offer_id}"])
+    if label == "offer_date":
+        return rnd.choice(
+            [
+                datetime.datetime.combine(offer_date, datetime.time()),
+                offer_date.strftime("%d/%m/%Y"),
+                offer_date.strftime("%d.%m.%Y"),
+            ]
+        )
+    if label.endswith("_price"):
+        price = rnd.randint(20, 5000) * 1000
+        return rnd.choice([price, float(price), f"{price:,} €".replace(",", ".")])
+    if label.endswith("_area"):
+        return round(rnd.uniform(50, 50000), 2)
+    if label == "contract_deposit":
+        return rnd.choice(["-", "10%", rnd.randint(1, 30) * 1000])
+    return rnd.choice(
+        TEXT_VALUES + [f"{label.replace('_', ' ')} {rnd.randint(1, 999)}"]
+    )
+
+
+def write_offer_workbook(
+    path: Path,
+    rnd: random.Random,
+    layout: list,
+    columns_dict: dict,
+    offer_date: datetime.date,
+    max_units: int = 40,
+):
+    workbook = openpyxl.Workbook()
+    ficha = workbook.active
+    ficha.title = rnd.choice(["FICHA", "Ficha oferta", "FICHA OFERTA"])
+
+    # Cada etiqueta ocupa un bloque de cuatro filas, en orden y columna aleatorios
+    blocks = rnd.sample(layout, len(layout))
+    row = rnd.randint(2, 6)
+    for text, targets in blocks:
+        col = rnd.randint(1, 6)
+        # Las etiquetas con valor encima (dy > 0) dejan sitio por arriba
+        label_row = row + max(0, *(dy for _, dy, _ in targets))
+        ficha.cell(row=label_row, column=col, value=text)
+        for label, offset_y, offset_x in targets:
+            ficha.cell(
+                row=label_row - offset_y,
+                column=col + offset_x,
+                value=label_value(label, rnd, offer_date),
+            )
+        if rnd.random() < 0.3:
+            ficha.cell(row=label_row, column=col + 5, value=rnd.choice(FILLER_TEXTS))
+        row = label_row + 4
+
+    # Una cabecera por columna de destino, con cualquiera de sus nombres
+    aliases: dict[str, list[str]] = {}
+    for header, column in columns_dict.items():
+        aliases.setdefault(column, []).append(header)
+    headers = [rnd.choice(names) for names in aliases.values()]
+    headers.insert(rnd.randint(0, len(headers)), "SUPERFICIE")
+
+    detail = workbook.create_sheet(rnd.choice(["SAP", "Oferta", "Datos SAP"]))
+    detail.append(headers)
+    commercialdev = f"{rnd.randint(1, 9999):05d}"
+    jointdev = rnd.choice([None, f"{rnd.randint(1, 999):05d}"])
+    for unit in range(rnd.randint(1, max_units)):
+        values = {
+            "unique_urs": f"{rnd.randint(1000, 999999):08d}",
+            "commercialdev": commercialdev,
+            "jointdev": jointdev,
+            "asset_type": rnd.choice(ASSET_TYPES),
+            "address": f"Calle {rnd.randint(1, 200)}, {unit + 1}",
+            "asset_location": rnd.choice(["Madrid", "Valencia", "Sevilla", "Málaga"]),
+        }
+        detail.append(
+            [
+                (
+                    round(rnd.uniform(30, 500), 1)
+                    if header == "SUPERFICIE"
+                    else values.get(columns_dict[header])
+                )
+                for header in headers
+            ]
+        )
+    workbook.save(path)
+
+
+def generate_offers(
+    directory: Path, files: int, year: int = BENCH_YEAR, seed: int = 0
+) -> list[Path]:
+    """
+    Writes files offer workbooks under directory/year. Files already there are kept,
+    so a folder is only generated once.
+    """
+    layout = label_layout(load_json_config(cell_address_file))
+    columns_dict = load_json_config(sap_mapping_file)
+    first_day = datetime.date(year, 1, 1)
+
+    paths = []
+    for i in range(files):
+        rnd = random.Random(seed * 1_000_003 + i)
+        offer_date = first_day + datetime.timedelta(days=rnd.randrange(365))
+        day = offer_date.strftime("%Y%m%d")
+        path = Path(directory) / str(year) / day / f"{day}_OF_{i:05d}.xlsx"
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            write_offer_workbook(path, rnd, layout, columns_dict, offer_date)
+        paths.append(path)
+    return paths
+
+
+def report_table(rows: int, seed: int = 0) -> pa.Table:
+    """
+    Table shaped like the offers report (ids, dates, prices, text and list columns),
+    for the writer benchmarks.
+    """
+    with duckdb.connect() as db:
+        db.execute(f"select setseed({1 / (seed + 2)})")
+        return db.sql(
+            f"""
+            select
+                i as unique_id,
+                'OF_' || i || '.xlsx' as file_name,
+                cast(5000000 + i as varchar) as offer_id,
+                date '{BENCH_YEAR}-01-01' + cast(i % 365 as integer) as offer_date,
+                round(random() * 5e6, 2) as offer_price,
+                round(random() * 6e6, 2) as appraisal_price,
+                round(random() * 6e6, 2) as sap_price,
+                round(random() * 6e6, 2) as web_price,
+                date '{BENCH_YEAR}-01-01' + cast(i % 300 as integer) as buyer_meeting,
+                ['SI', 'NO', 'Pendiente'][1 + i % 3] as segment,
+                'Delegado ' || (i % 40) as delegate,
+                round(random() * 50000, 1) as land_area,
+                round(random() * 20000, 1) as buildable_area,
+                round(random() * 1e6, 2) as contract_deposit,
+                ['Residencial', 'Terciario', 'Industrial'][1 + i % 3] as main_use,
+                'Cliente ' || (i % 5000) as client_name,
+                'B' || lpad(cast(i % 99999999 as varchar), 8, '0') as client_tax_id,
+                'cliente' || (i % 5000) || '@example.com' as client_email,
+                'Calle ' || (i % 200) || ', ' || (i % 50) as client_address,
+                current_localtimestamp() - to_days(cast(i % 30 as integer)) as updated_at,
+                [cast(1000 + i * 3 + j as varchar) for j in range(1 + i % 5)] as unique_urs,
+                lpad(cast(i % 9999 as varchar), 5, '0') as commercialdev,
+                ['Suelo', 'Vivienda', 'Local', 'Garaje'][1 + i % 4] as asset_type,
+                repeat('Condiciones de la oferta ', 1 + i % 4) as conditions_details,
+                ['Aceptar', 'Rechazar', 'Negociar'][1 + i % 3] as servihabitat_recommendation,
+                ['Web', 'API', 'Comercial'][1 + i % 3] as offer_lead_type,
+                {BENCH_YEAR} as year
+            from range({rows}) t(i)
+            """
+        ).to_arrow_table()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", type=Path, help="Folder to write the offers to")
+    parser.add_argument("--files", type=int, default=100, help="Number of workbooks")
+    parser.add_argument("--year", type=int, default=BENCH_YEAR, help="Year folder")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the contents")
+    args = parser.parse_args()
+    paths = generate_offers(args.directory, args.files, args.year, args.seed)
+    print(f"{len(paths)} offer workbook(s) in {args.directory / str(args.year)}")
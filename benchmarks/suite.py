@@ -0,0 +1,521 @@
+"""
+Benchmarks of the offers hot paths on generated offer workbooks: reading the files,
+discovering them, loading them through fix_offers.sql and writing the reports.
+
+Each case runs in a fresh process, so its peak memory is its own. Results are appended
+as JSON lines to the results file, one line per case, and two runs can be compared.
+
+Usage:
+    python -m benchmarks.suite run --files 100 1000 --rows 10000 --only extract load
+    python -m benchmarks.suite runs
+    python -m benchmarks.suite compare [BASE_RUN] [NEW_RUN]
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.generate_offers import BENCH_YEAR, generate_offers, report_table
+from conf.settings import DEFAULT_WORKERS, READER_BACKEND, READER_BACKENDS
+from conf.tracing import peak_rss_mb
+
+console = Console()
+
+BENCHMARKS = ("extract", "discovery", "load", "write")
+FILE_SIZES = (100, 1000, 10000)
+ROW_SIZES = (10000, 200000)
+WRITERS = ("openpyxl", "xlsxwriter")
+# Ficheros leidos uno a uno para comparar los lectores
+READER_SAMPLE = 100
+DATA_DIR = Path(tempfile.gettempdir()) / "ws_benchmarks"
+RESULTS_FILE = Path(__file__).parent / "results.jsonl"
+# Cambios por debajo de este margen se consideran ruido
+NOISE = 0.10
+
+
+def offers_dir(data_dir: Path, files: int) -> Path:
+    return data_dir / f"offers_{files}"
+
+
+def offer_files(data_dir: Path, files: int) -> list[str]:
+    return [p.as_posix() for p in generate_offers(offers_dir(data_dir, files), files)]
+
+
+# Cada caso prepara sus datos y devuelve la funcion que se cronometra
+
+
+def setup_extract_cell_values(data_dir: Path, files: int, reader: str):
+    from conf.functions import load_json_config
+    from conf.settings import cell_address_file, sap_mapping_file
+    from update_offers import extract_cell_values
+
+    sample = offer_files(data_dir, files)
+    search_strings = load_json_config(cell_address_file)
+    columns_dict = load_json_config(sap_mapping_file)
+
+    def run():
+        for file in sample:
+            extract_cell_values(file, search_strings, columns_dict, reader)
+
+    return run
+
+
+def setup_extract_files(data_dir: Path, files: int, reader: str, workers: int):
+    from conf.functions import LabelMatcher, load_json_config
+    from conf.settings import cell_address_file, sap_mapping_file
+    from update_offers import extract_files
+
+    paths = offer_files(data_dir, files)
+    matcher = LabelMatcher.from_config(load_json_config(cell_address_file))
+    columns_dict = load_json_config(sap_mapping_file)
+    return lambda: extract_files(
+        paths, matcher, columns_dict, workers=workers, reader=reader
+    )
+
+
+def setup_find_files(data_dir: Path, files: int, mode: str):
+    from conf.functions import find_files_included
+
+    directory = offers_dir(data_dir, files)
+    offer_files(data_dir, files)
+    db_file = data_dir / f"discovery_{files}.db"
+
+    def run():
+        if mode == "snapshots cold" and db_file.exists():
+            db_file.unlink()
+        find_files_included(
+            directory,
+            str(BENCH_YEAR),
+            db_file.as_posix(),
+            use_snapshots=mode != "glob",
+        )
+
+    if mode == "snapshots warm":
+        run()
+    return run
+
+
+def setup_create_ddb_table(data_dir: Path, files: int):
+    import pandas as pd
+
+    from conf.functions import LabelMatcher, create_ddb_table, load_json_config
+    from conf.offers_store import OFFERS_TABLE
+    from conf.settings import cell_address_file, sap_mapping_file
+    from update_offers import extract_files
+
+    # Se leen unas pocas fichas y se repiten hasta el tamanio pedido
+    sample = offer_files(data_dir, min(files, READER_SAMPLE))
+    records = extract_files(
+        sample,
+        LabelMatcher.from_config(load_json_config(cell_address_file)),
+        load_json_config(sap_mapping_file),
+    )
+    rows = []
+    for i in range(files):
+        record = dict(records[i % len(records)])
+        record["full_path"] = f"{record['full_path']}.{i}"
+        rows.append(record)
+    df = pd.DataFrame(rows)
+    df["year"] = BENCH_YEAR
+    db_file = (data_dir / f"load_{files}.db").as_posix()
+
+    return lambda: create_ddb_table(
+        df,
+        db_file,
+        query_file="./queries/fix_offers.sql",
+        table_name=OFFERS_TABLE,
+        table_schema="ws",
+    )
+
+
+def setup_write_offers(data_dir: Path, rows: int, writer: str):
+    import copy
+
+    from conf.functions import create_style, write_offers
+    from conf.settings import offersconf, styles_file
+
+    table = report_table(rows)
+    style_specs = create_style(styles_file)
+    output_file = data_dir / "out" / f"write_offers_{writer}_{rows}.xlsx"
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    return lambda: write_offers(
+        output_file, copy.copy(offersconf), style_specs, table, writer=writer
+    )
+
+
+def setup_write_output(data_dir: Path, rows: int, writer: str):
+    from conf.functions import create_style
+    from conf.settings import styles_file
+    from conf.writers import write_output
+    from update_stock import stock_styles
+
+    table = report_table(rows)
+    style_specs = create_style(styles_file)
+    output_file = data_dir / "out" / f"write_output_{writer}_{rows}.xlsx"
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    return lambda: write_output(
+        output_file,
+        {"Wholesale": table},
+        style_specs,
+        stock_styles(rows),
+        6,
+        "Benchmark",
+        writer=writer,
+    )
+
+
+def run_case(setup, kwargs: dict, repeat: int) -> tuple[list[float], float | None]:
+    """
+    Runs in a fresh process: prepares the case, then times it repeat times with the
+    output of the code under test silenced.
+    """
+    # Los scripts usan rutas relativas (./queries, ./conf)
+    os.chdir(Path(__file__).parent.parent)
+    with contextlib.redirect_stdout(io.StringIO()):
+        target = setup(**kwargs)
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            target()
+            seconds.append(time.perf_counter() - start)
+    return seconds, peak_rss_mb()
+
+
+def plan_cases(
+    only: list[str], files: list[int], rows: list[int], workers: int
+) -> list[tuple[str, str, int, object, dict]]:
+    """
+    (benchmark, case, size, setup, setup kwargs) of every case to run.
+    """
+    cases = []
+    if "extract" in only:
+        sample = min(min(files), READER_SAMPLE)
+        for reader in READER_BACKENDS:
+            cases.append(
+                (
+                    "extract_cell_values",
+                    reader,
+                    sample,
+                    setup_extract_cell_values,
+                    {"files": sample, "reader": reader},
+                )
+            )
+        for size in files:
+            cases.append(
+                (
+                    "extract_files",
+                    f"{READER_BACKEND} x{workers}",
+                    size,
+                    setup_extract_files,
+                    {"files": size, "reader": READER_BACKEND, "workers": workers},
+                )
+            )
+    if "discovery" in only:
+        for size in files:
+            for mode in ("glob", "snapshots cold", "snapshots warm"):
+                cases.append(
+                    (
+                        "find_files_included",
+                        mode,
+                        size,
+                        setup_find_files,
+                        {"files": size, "mode": mode},
+                    )
+                )
+    if "load" in only:
+        for size in files:
+            cases.append(
+                (
+                    "create_ddb_table",
+                    "fix_offers.sql",
+                    size,
+                    setup_create_ddb_table,
+                    {"files": size},
+                )
+            )
+    if "write" in only:
+        for size in rows:
+            for writer in WRITERS:
+                cases.append(
+                    (
+                        "write_offers",
+                        writer,
+                        size,
+                        setup_write_offers,
+                        {"rows": size, "writer": writer},
+                    )
+                )
+                cases.append(
+                    (
+                        "write_output",
+                        writer,
+                        size,
+                        setup_write_output,
+                        {"rows": size, "writer": writer},
+                    )
+                )
+    return cases
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(
+    only: list[str],
+    files: list[int],
+    rows: list[int],
+    repeat: int = 1,
+    workers: int = DEFAULT_WORKERS,
+    data_dir: Path = DATA_DIR,
+    results_file: Path = RESULTS_FILE,
+    label: str | None = None,
+):
+    data_dir = Path(data_dir).absolute()
+    data_dir.mkdir(parents=True, exist_ok=True)
+    header = {
+        "run_id": uuid.uuid4().hex[:12],
+        "label": label,
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+    }
+
+    # Los ficheros se generan antes, para no cronometrar la generacion
+    if {"extract", "discovery", "load"} & set(only):
+        for size in files:
+            with console.status(f"Generating {size} offer workbooks in {data_dir}..."):
+                offer_files(data_dir, size)
+
+    table = Table(title=f"Benchmark run {header['run_id']}")
+    for column in ("Benchmark", "Case", "Size", "Median s", "Best s", "Peak MB"):
+        table.add_column(
+            column, justify="left" if column in ("Benchmark", "Case") else "right"
+        )
+
+    cases = plan_cases(only, files, rows, workers)
+    for idx, (benchmark, case, size, setup, kwargs) in enumerate(cases, start=1):
+        with console.status(f"[{idx}/{len(cases)}] {benchmark} {case} ({size:,})..."):
+            # Proceso nuevo por caso: spawn, porque Polars y DuckDB no admiten fork
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                seconds, peak = pool.submit(
+                    run_case, setup, {"data_dir": data_dir, **kwargs}, repeat
+                ).result()
+        result = {
+            **header,
+            "benchmark": benchmark,
+            "case": case,
+            "size": size,
+            "repeat": repeat,
+            "seconds": seconds,
+            "median": statistics.median(seconds),
+            "best": min(seconds),
+            "peak_rss_mb": peak,
+        }
+        with open(results_file, "a", encoding="utf8") as f:
+            f.write(json.dumps(result) + "\n")
+        table.add_row(
+            benchmark,
+            case,
+            f"{size:,}",
+            f"{result['median']:.3f}",
+            f"{result['best']:.3f}",
+            "" if peak is None else f"{peak:.0f}",
+        )
+    console.print(table)
+    console.print(f"Results appended to {results_file}")
+
+
+def load_results(results_file: Path) -> dict[str, list[dict]]:
+    runs: dict[str, list[dict]] = {}
+    if not Path(results_file).exists():
+        return runs
+    with open(results_file, encoding="utf8") as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                runs.setdefault(result["run_id"], []).append(result)
+    return runs
+
+
+def find_run(runs: dict[str, list[dict]], key: str) -> str:
+    # Un run se busca por el principio de su id o por su etiqueta
+    matches = [
+        run_id
+        for run_id, results in runs.items()
+        if run_id.startswith(key) or results[0].get("label") == key
+    ]
+    if not matches:
+        raise ValueError(f"No benchmark run matches {key}")
+    return matches[-1]
+
+
+def list_runs(results_file: Path = RESULTS_FILE):
+    table = Table(title="Benchmark runs")
+    for column in ("Run", "Label", "Started", "Commit", "Cases"):
+        table.add_column(column)
+    for run_id, results in load_results(results_file).items():
+        first = results[0]
+        table.add_row(
+            run_id,
+            first.get("label") or "",
+            first["started_at"],
+            first.get("commit") or "",
+            str(len(results)),
+        )
+    console.print(table)
+
+
+def compare(
+    base: str | None = None, new: str | None = None, results_file: Path = RESULTS_FILE
+):
+    """
+    Compares the median time of the cases two runs have in common. By default the
+    last run is compared against the one before it.
+    """
+    runs = load_results(results_file)
+    run_ids = list(runs)
+    if len(run_ids) < 2 and not (base and new):
+        console.print("At least two benchmark runs are needed to compare.")
+        return
+    base_id = find_run(runs, base) if base else run_ids[-2]
+    new_id = find_run(runs, new) if new else run_ids[-1]
+
+    def by_case(run_id):
+        return {(r["benchmark"], r["case"], r["size"]): r for r in runs[run_id]}
+
+    base_results, new_results = by_case(base_id), by_case(new_id)
+    table = Table(title=f"Benchmark {base_id} -> {new_id}")
+    for column in ("Benchmark", "Case", "Size", "Base s", "New s", "Change"):
+        table.add_column(
+            column, justify="left" if column in ("Benchmark", "Case") else "right"
+        )
+    for key, result in new_results.items():
+        if key not in base_results:
+            continue
+        before, after = base_results[key]["median"], result["median"]
+        ratio = after / before if before else float("inf")
+        color = (
+            "red" if ratio > 1 + NOISE else "green" if ratio < 1 - NOISE else "white"
+        )
+        table.add_row(
+            key[0],
+            key[1],
+            f"{key[2]:,}",
+            f"{before:.3f}",
+            f"{after:.3f}",
+            f"[{color}]{ratio - 1:+.0%}[/{color}]",
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    # Opcion comun a todos los subcomandos
+    results_option = argparse.ArgumentParser(add_help=False)
+    results_option.add_argument(
+        "--results",
+        type=Path,
+        default=RESULTS_FILE,
+        help=f"JSON lines file with the results. Default: {RESULTS_FILE}",
+    )
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser(
+        "run", parents=[results_option], help="Run the benchmarks"
+    )
+    run_parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=BENCHMARKS,
+        default=list(BENCHMARKS),
+        help="Benchmarks to run. Default: all",
+    )
+    run_parser.add_argument(
+        "--files",
+        nargs="+",
+        type=int,
+        default=list(FILE_SIZES),
+        help=f"Number of offer files. Default: {' '.join(map(str, FILE_SIZES))}",
+    )
+    run_parser.add_argument(
+        "--rows",
+        nargs="+",
+        type=int,
+        default=list(ROW_SIZES),
+        help=f"Rows of the written reports. Default: {' '.join(map(str, ROW_SIZES))}",
+    )
+    run_parser.add_argument(
+        "--repeat", type=int, default=1, help="Timed runs per case. Default: 1"
+    )
+    run_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Processes used to read the offer files. Default: {DEFAULT_WORKERS}",
+    )
+    run_parser.add_argument(
+        "--data-dir",
+        type=Path,
+        default=DATA_DIR,
+        help=f"Folder for the generated files. Default: {DATA_DIR}",
+    )
+    run_parser.add_argument("--label", help="Name to find the run by when comparing")
+
+    compare_parser = commands.add_parser(
+        "compare", parents=[results_option], help="Compare two runs"
+    )
+    compare_parser.add_argument(
+        "base", nargs="?", help="Run id or label. Default: the run before the last"
+    )
+    compare_parser.add_argument(
+        "new", nargs="?", help="Run id or label. Default: the last run"
+    )
+
+    commands.add_parser("runs", parents=[results_option], help="List the stored runs")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(
+            args.only,
+            sorted(args.files),
+            sorted(args.rows),
+            args.repeat,
+            args.workers,
+            args.data_dir,
+            args.results,
+            args.label,
+        )
+    elif args.command == "compare":
+        compare(args.base, args.new, args.results)
+    else:
+        list_runs(args.results)
@@ -0,0 +1,251 @@
+import argparse
+import datetime
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+from rich.console import Console
+from rich.table import Table
+
+from conf.dag import Stage, file_fingerprint, fingerprint, run_stages
+from conf.functions import create_style, query_offers, stream_query, write_offers
+from conf.manifest import MANIFEST_TABLE
+from conf.offers_store import partition_key
+from conf.parquet_sync import parquet_sources, sync_parquet
+from conf.settings import DEFAULT_WORKERS, DIR_PARQUET, EXPORT_BATCH_ROWS
+from conf.settings import offersconf, pipeconf, stockconf
+from conf.settings import styles_file
+from conf.tracing import record_span, span, timed_call, trace_run
+
+console = Console()
+
+STOCK_QUERIES = [
+    "./queries/city_province_map.sql",
+    "./queries/ur_channel_dim.sql",
+    "./queries/stock_data.sql",
+]
+REPORTS = ("offers", "stock", "pipe")
+
+
+def write_report(report: str, output_file: Path, table: pa.Table):
+    """
+    Writes one report workbook. Runs in a worker process: the Arrow table arrives pickled
+    and the modules of each report are imported here.
+    """
+    if report == "offers":
+        write_offers(output_file, offersconf, create_style(styles_file), table)
+    elif report == "stock":
+        from update_stock import write_stock_report
+
+        write_stock_report(output_file, table)
+    elif report == "pipe":
+        from update_pipe import write_pipe_report
+
+        write_pipe_report(output_file, table)
+    else:
+        raise ValueError(f"Unknown report {report}")
+
+
+def write_streamed_report(
+    report: str, output_file: Path, parquet_file: Path, batch_size: int
+):
+    """
+    Writes one report from a Parquet export of its rows, read back in batches of
+    batch_size rows, so neither process holds the whole result. Runs in a worker
+    process; the database file stays with the parent, which keeps writing to it.
+    """
+    with duckdb.connect() as db:
+        # Leer el Parquet otra vez es barato: no se copia a una tabla temporal
+        table = stream_query(
+            db,
+            f"select * from read_parquet('{parquet_file.as_posix()}')",
+            batch_size,
+            materialize=False,
+        )
+        write_report(report, output_file, table)
+
+
+def export_query(db_file: str, query: str, parquet_file: Path) -> int:
+    # DuckDB escribe el Parquet por partes: el resultado no se materializa en memoria
+    with duckdb.connect(db_file) as db:
+        db.execute(f"copy ({query}) to '{parquet_file.as_posix()}' (format parquet)")
+        return db.execute(
+            f"select count(*) from read_parquet('{parquet_file.as_posix()}')"
+        ).fetchone()[0]
+
+
+def query_table(db_file: str, query: str) -> pa.Table:
+    # Conexion propia por hilo: las consultas de los informes se ejecutan a la vez
+    with duckdb.connect(db_file) as db:
+        return db.sql(query).to_arrow_table()
+
+
+def build_stages(
+    year: int, workers: int, processes: ProcessPoolExecutor
+) -> list[Stage]:
+    from update_offers import update_offer_table
+    from update_pipe import (
+        PIPE_REPORT_QUERY,
+        build_pipe_table,
+        latest_pipe_file,
+        read_pipe_file,
+    )
+    from update_stock import STOCK_EXPORT_QUERY, build_stock_table
+
+    db_file = offersconf.db_file
+
+    def parquet_inputs() -> str:
+        if not DIR_PARQUET.is_dir():
+            return "unavailable"
+        return file_fingerprint(*parquet_sources(DIR_PARQUET).values())
+
+    def run_parquet_sync():
+        if not DIR_PARQUET.is_dir():
+            console.print(f"Parquet folder {DIR_PARQUET} is not reachable, keeping the loaded tables.")
+            return
+        failed = [
+            r.table_name for r in sync_parquet(DIR_PARQUET, db_file) if r.action == "failed"
+        ]
+        if failed:
+            raise RuntimeError(f"Could not sync {', '.join(failed)}")
+
+    def run_offers_ingest():
+        update_offer_table(year, workers=workers)
+
+    def offers_result() -> str:
+        with duckdb.connect(db_file) as db:
+            rows = db.execute(
+                f"""select full_path, content_hash, result_version
+                from {offersconf.db_schema}.{MANIFEST_TABLE}
+                where table_name = ? order by full_path""",
+                [partition_key(year)],
+            ).fetchall()
+        return fingerprint(*rows)
+
+    def run_stock_table():
+        with duckdb.connect(stockconf.db_file) as db:
+            build_stock_table(db)
+
+    def run_pipe_table():
+        build_pipe_table(read_pipe_file(latest_pipe_file()))
+
+    def report(name: str, query, output_file: Path):
+        def run():
+            console.print(f"Querying data for the {name} report...")
+            with span("report_query", detail=name) as measured:
+                table = query() if callable(query) else query_table(db_file, query)
+                measured.rows = table.num_rows
+            _, seconds = processes.submit(
+                timed_call, write_report, name, output_file, table
+            ).result()
+            record_span("write_workbook", seconds, detail=name, rows=table.num_rows)
+
+        return run
+
+    def streamed_report(name: str, query: str, output_file: Path):
+        def run():
+            console.print(f"Exporting data for the {name} report...")
+            handle, parquet_file = tempfile.mkstemp(suffix=".parquet")
+            os.close(handle)
+            parquet_file = Path(parquet_file)
+            try:
+                with span("report_query", detail=name) as measured:
+                    measured.rows = export_query(db_file, query, parquet_file)
+                _, seconds = processes.submit(
+                    timed_call,
+                    write_streamed_report,
+                    name,
+                    output_file,
+                    parquet_file,
+                    EXPORT_BATCH_ROWS,
+                ).result()
+            finally:
+                parquet_file.unlink(missing_ok=True)
+            record_span("write_workbook", seconds, detail=name, rows=measured.rows)
+
+        return run
+
+    return [
+        Stage("parquet_sync", run_parquet_sync, inputs=parquet_inputs),
+        Stage("offers_ingest", run_offers_ingest, result=offers_result),
+        Stage(
+            "stock_table",
+            run_stock_table,
+            deps=("parquet_sync",),
+            inputs=lambda: file_fingerprint(*STOCK_QUERIES),
+        ),
+        Stage(
+            "pipe_table",
+            run_pipe_table,
+            deps=("parquet_sync",),
+            inputs=lambda: file_fingerprint(
+                latest_pipe_file(), "./queries/pipe_aggregates.sql"
+            ),
+        ),
+        Stage(
+            "offers_report",
+            report("offers", lambda: query_offers(offersconf), offersconf.get_output_path()),
+            deps=("parquet_sync", "offers_ingest"),
+            inputs=lambda: file_fingerprint("./queries/write_offers.sql"),
+            outputs=lambda: [offersconf.get_output_path()],
+            writes_db=False,
+        ),
+        Stage(
+            "stock_report",
+            streamed_report("stock", STOCK_EXPORT_QUERY, stockconf.get_output_path()),
+            deps=("stock_table",),
+            inputs=lambda: fingerprint(STOCK_EXPORT_QUERY),
+            outputs=lambda: [stockconf.get_output_path()],
+            writes_db=False,
+        ),
+        Stage(
+            "pipe_report",
+            report("pipe", PIPE_REPORT_QUERY, pipeconf.get_output_path()),
+            deps=("pipe_table",),
+            inputs=lambda: fingerprint(PIPE_REPORT_QUERY),
+            outputs=lambda: [pipeconf.get_output_path()],
+            writes_db=False,
+        ),
+    ]
+
+
+def main(year: int, workers: int = DEFAULT_WORKERS, force: bool = False):
+    with trace_run("build", offersconf.db_file):
+        with ProcessPoolExecutor(max_workers=len(REPORTS)) as processes:
+            runs = run_stages(
+                build_stages(year, workers, processes), offersconf.db_file, force=force
+            )
+
+    summary = Table(title="Build")
+    for column in ("Stage", "Status", "Seconds"):
+        summary.add_column(column)
+    for run in runs:
+        summary.add_row(run.name, run.status, f"{run.seconds:.1f}")
+    console.print(summary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--year",
+        type=int,
+        default=datetime.datetime.now().year,
+        help="Year of the offers to scan",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Number of processes used to read the offer files. Default: {DEFAULT_WORKERS}",
+    )
+    parser.add_argument(
+        "--force",
+        default=False,
+        action="store_true",
+        help="Run every stage even if its inputs did not change",
+    )
+    args = parser.parse_args()
+    main(args.year, args.workers, args.force)
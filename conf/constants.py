@@ -0,0 +1,3 @@
+# Version del formato de extraccion de las fichas de oferta. Cambiarla obliga a
+# releer todos los ficheros en la siguiente ejecucion.
+EXTRACTION_VERSION = 1
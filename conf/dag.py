@@ -0,0 +1,182 @@
+import contextvars
+import hashlib
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+import duckdb
+from rich.console import Console
+
+from conf.tracing import span
+
+console = Console()
+
+STATE_TABLE = "build_state"
+
+
+@dataclass
+class Stage:
+    """
+    One step of the build. inputs returns a fingerprint of what the stage reads; when it
+    matches the one saved after the last successful run (together with the fingerprints
+    of its dependencies) and all its outputs exist, the stage is skipped. Stages without
+    inputs are incremental on their own and always run. result, when given, returns the
+    fingerprint passed on to the dependents after the run, otherwise the input one is used.
+    Stages that write to the database run one at a time.
+    """
+
+    name: str
+    run: Callable[[], object]
+    deps: tuple[str, ...] = ()
+    inputs: Callable[[], str] | None = None
+    result: Callable[[], str] | None = None
+    outputs: Callable[[], list[Path]] = field(default=list)
+    writes_db: bool = True
+
+
+@dataclass
+class StageRun:
+    name: str
+    # "built", "skipped", "failed" o "blocked" (fallo una dependencia)
+    status: str
+    fingerprint: str | None = None
+    seconds: float = 0.0
+    error: str | None = None
+
+
+def fingerprint(*parts: object) -> str:
+    return hashlib.sha1(repr(parts).encode("utf8")).hexdigest()
+
+
+def file_fingerprint(*files: Path) -> str:
+    """
+    Fingerprint of files by path, size and mtime (missing files count as None).
+    """
+    stats = []
+    for file in files:
+        file = Path(file)
+        if file.exists():
+            stat = file.stat()
+            stats.append((file.as_posix(), stat.st_size, stat.st_mtime))
+        else:
+            stats.append((file.as_posix(), None))
+    return fingerprint(*stats)
+
+
+def ensure_build_state(db):
+    db.execute(
+        f"""
+        create table if not exists {STATE_TABLE} (
+            stage varchar primary key,
+            fingerprint varchar,
+            result varchar,
+            seconds double,
+            finished_at timestamp
+        )
+        """
+    )
+
+
+def load_build_state(db_file: str) -> dict[str, tuple[str, str]]:
+    with duckdb.connect(db_file) as db:
+        ensure_build_state(db)
+        return {
+            row[0]: row[1:]
+            for row in db.execute(
+                f"select stage, fingerprint, result from {STATE_TABLE}"
+            ).fetchall()
+        }
+
+
+def check_stages(stages: list[Stage]):
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        missing = set(stage.deps) - names
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stage(s): {missing}")
+    # Orden topologico solo para detectar ciclos
+    done, pending = set(), list(stages)
+    while pending:
+        ready = [s for s in pending if set(s.deps) <= done]
+        if not ready:
+            raise ValueError(f"Cycle between stages: {[s.name for s in pending]}")
+        done.update(s.name for s in ready)
+        pending = [s for s in pending if s.name not in done]
+
+
+def run_stages(
+    stages: list[Stage], db_file: str, force: bool = False, max_threads: int | None = None
+) -> list[StageRun]:
+    """
+    Runs the stages as soon as their dependencies finish, each on its own thread.
+    A connection stays open for the whole build so every stage shares the same
+    DuckDB instance. The fingerprint of each stage that ran is saved in build_state.
+    """
+    check_stages(stages)
+    previous = load_build_state(db_file)
+    db_lock = threading.Lock()
+    results: dict[str, str] = {}
+    runs: dict[str, StageRun] = {}
+
+    def run_stage(stage: Stage) -> StageRun:
+        with db_lock if stage.writes_db else nullcontext():
+            start = time.perf_counter()
+            upstream = [results[dep] for dep in stage.deps]
+            own_inputs = stage.inputs() if stage.inputs else None
+            stage_fingerprint = fingerprint(stage.name, own_inputs, *upstream)
+            known = previous.get(stage.name)
+            if (
+                not force
+                and own_inputs is not None
+                and known
+                and known[0] == stage_fingerprint
+                and all(Path(p).exists() for p in stage.outputs())
+            ):
+                results[stage.name] = known[1]
+                return StageRun(stage.name, "skipped", stage_fingerprint)
+
+            console.print(f"[bold]Running stage {stage.name}...")
+            with span(stage.name):
+                stage.run()
+            result = stage.result() if stage.result else stage_fingerprint
+            seconds = time.perf_counter() - start
+            with duckdb.connect(db_file) as db:
+                db.execute(
+                    f"insert or replace into {STATE_TABLE} values (?, ?, ?, ?, current_localtimestamp())",
+                    [stage.name, stage_fingerprint, result, seconds],
+                )
+            results[stage.name] = result
+            return StageRun(stage.name, "built", stage_fingerprint, seconds)
+
+    with duckdb.connect(db_file):
+        with ThreadPoolExecutor(max_workers=max_threads or len(stages)) as executor:
+            pending = {stage.name: stage for stage in stages}
+            running = {}
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if not set(stage.deps) <= runs.keys():
+                        continue
+                    del pending[name]
+                    if any(runs[dep].status in ("failed", "blocked") for dep in stage.deps):
+                        runs[name] = StageRun(name, "blocked")
+                    else:
+                        # Cada etapa hereda el run de tracing del hilo que la lanza
+                        context = contextvars.copy_context()
+                        running[executor.submit(context.run, run_stage, stage)] = name
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        runs[name] = future.result()
+                    except Exception as e:
+                        console.print(f"[red]Stage {name} failed: {e}")
+                        runs[name] = StageRun(name, "failed", error=str(e))
+
+    return [runs[stage.name] for stage in stages]
+
@@ -0,0 +1,121 @@
+import fnmatch
+import os
+from dataclasses import dataclass, field
+
+import duckdb
+
+SNAPSHOT_TABLE = "dir_snapshots"
+
+# Mismo patron que el glob original: sin ficheros temporales de Excel (~$)
+OFFER_FILE_PATTERN = "[!~$]*.xlsx"
+
+
+@dataclass
+class DirectoryListing:
+    mtime: float
+    files: list[str] = field(default_factory=list)
+    subdirs: list[str] = field(default_factory=list)
+
+
+def ensure_snapshots(db, schema: str):
+    db.execute(f"create schema if not exists {schema}")
+    db.execute(
+        f"""
+        create table if not exists {schema}.{SNAPSHOT_TABLE} (
+            root varchar,
+            dir_path varchar,
+            dir_mtime double,
+            files varchar[],
+            subdirs varchar[],
+            primary key (root, dir_path)
+        )
+        """
+    )
+
+
+def load_snapshot(db_file: str, schema: str, root: str) -> dict[str, DirectoryListing]:
+    with duckdb.connect(db_file) as db:
+        ensure_snapshots(db, schema)
+        rows = db.execute(
+            f"select dir_path, dir_mtime, files, subdirs from {schema}.{SNAPSHOT_TABLE} where root = ?",
+            [root],
+        ).fetchall()
+    return {path: DirectoryListing(mtime, files, subdirs) for path, mtime, files, subdirs in rows}
+
+
+def save_snapshot(
+    db_file: str, schema: str, root: str, listings: dict[str, DirectoryListing]
+):
+    rows = [
+        (root, path, listing.mtime, listing.files, listing.subdirs)
+        for path, listing in listings.items()
+    ]
+    with duckdb.connect(db_file) as db:
+        ensure_snapshots(db, schema)
+        db.execute(f"delete from {schema}.{SNAPSHOT_TABLE} where root = ?", [root])
+        if rows:
+            db.executemany(
+                f"insert into {schema}.{SNAPSHOT_TABLE} values (?, ?, ?, ?, ?)", rows
+            )
+
+
+def list_directory(path: str, mtime: float, pattern: str) -> DirectoryListing:
+    """
+    Lists a single directory with os.scandir, keeping the files matching the pattern
+    and the subdirectories. Hidden entries are skipped, as glob does.
+    """
+    listing = DirectoryListing(mtime)
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                listing.subdirs.append(entry.name)
+            elif fnmatch.fnmatch(entry.name, pattern):
+                listing.files.append(entry.name)
+    return listing
+
+
+def scan_tree(
+    root: str,
+    snapshot: dict[str, DirectoryListing],
+    pattern: str = OFFER_FILE_PATTERN,
+) -> tuple[list[str], dict[str, DirectoryListing], int]:
+    """
+    Walks a directory tree reusing the stored listing of every directory whose mtime
+    has not changed, so an unchanged tree costs one stat call per directory.
+    Returns the matching files, the new listings and how many directories were read.
+    """
+    files = []
+    listings = {}
+    rescanned = 0
+    pending = [root]
+    while pending:
+        path = pending.pop()
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            continue
+        listing = snapshot.get(path)
+        if listing is None or listing.mtime != mtime:
+            listing = list_directory(path, mtime, pattern)
+            rescanned += 1
+        listings[path] = listing
+        files.extend(os.path.normpath(os.path.join(path, name)) for name in listing.files)
+        pending.extend(os.path.join(path, name) for name in listing.subdirs)
+    return sorted(files), listings, rescanned
+
+
+def discover_files(
+    root: str, db_file: str, schema: str, pattern: str = OFFER_FILE_PATTERN
+) -> tuple[list[str], int]:
+    """
+    Lists the matching files under root using the persisted directory snapshot, and
+    stores the updated snapshot for the next run.
+    """
+    root = os.path.normpath(root)
+    snapshot = load_snapshot(db_file, schema, root)
+    files, listings, rescanned = scan_tree(root, snapshot, pattern)
+    if rescanned or listings.keys() != snapshot.keys():
+        save_snapshot(db_file, schema, root, listings)
+    return files, rescanned
@@ -2,21 +2,34 @@ import datetime
 import glob
 import json
 import re
-import time
 import os
+import uuid
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Tuple
-
-from conf.settings import FileSettings
+from typing import TYPE_CHECKING, Any, List, Tuple
+
+from conf.discovery import discover_files
+from conf.offers_store import OFFERS_TABLE, ensure_offers_store
+from conf.query_cache import bump_table_version, cached_query
+from conf.settings import EXPORT_BATCH_ROWS, FileSettings
+from conf.tracing import span
+from conf.writers import (
+    StreamedTable,
+    apply_styles,
+    column_widths,
+    rows_with_header,
+    write_output_xlsxwriter,
+)
 import duckdb
 import openpyxl
+import pyarrow as pa
 from openpyxl.styles import Alignment, Font, NamedStyle, PatternFill
 from openpyxl.utils import get_column_letter
-from openpyxl.utils.cell import column_index_from_string, coordinate_from_string
-from openpyxl.utils.dataframe import dataframe_to_rows
-from pandas import DataFrame
 from rich.console import Console
 
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
 console = Console()
 
 
@@ -28,19 +41,85 @@ def load_json_config(file):
         return json.load(f)
 
 
+@dataclass
+class LabelMatcher:
+    """
+    Precompiled version of the cell_addresses.json labels, built once per run.
+
+    Each cell is matched against the labels in file order and only the first label
+    that matches is used. When the same label shows up in several cells the last one
+    wins, so the sheet is scanned backwards and the scan stops once every label is set.
+    A repeated pattern (e.g. "ORIGEN OFERTA") is always claimed by its first label.
+    """
+
+    labels: list[str]
+    anchors: list[tuple[re.Pattern, str, int, int]]
+    prefilter: re.Pattern
+
+    @classmethod
+    def from_config(cls, search_strings: dict) -> "LabelMatcher":
+        anchors = []
+        patterns = []
+        for label, [regex, offset_y, offset_x] in search_strings.items():
+            if regex in patterns:
+                continue
+            patterns.append(regex)
+            anchors.append((re.compile(regex, re.IGNORECASE), label, offset_y, offset_x))
+        # Descarta de una vez las celdas que no empiezan por ninguna etiqueta
+        prefilter = re.compile(
+            "|".join(f"(?:{regex})" for regex in patterns), re.IGNORECASE
+        )
+        return cls(list(search_strings.keys()), anchors, prefilter)
+
+    def scan(self, sheet_dict: dict[tuple[int, int], Any]) -> dict[str, Any]:
+        """
+        Returns {label: value} for the labels found in a {(row, col): value} sheet.
+        """
+        found = {}
+        for (cell_row, cell_col), cell_value in reversed(sheet_dict.items()):
+            text = str(cell_value)
+            if not self.prefilter.match(text):
+                continue
+            for pattern, label, offset_y, offset_x in self.anchors:
+                if not pattern.match(text):
+                    continue
+                if label not in found:
+                    target_cell_value = sheet_dict.get(
+                        (cell_row - offset_y, cell_col + offset_x)
+                    )
+                    if target_cell_value is not None:
+                        found[label] = target_cell_value
+                        if len(found) == len(self.anchors):
+                            return found
+                break
+        return found
+
+
 def find_files_included(
     directory: Path,
     include_pattern: str,
     database_file: str,
     only_new_files: bool = False,
+    use_snapshots: bool = True,
+    schema: str = "ws",
 ) -> Tuple[List[str], int]:
-    query = f"""select full_path from ws.ws_offers_{include_pattern};"""
+    """
+    Lists the offer workbooks inside the subfolders of directory matching include_pattern.
+    With use_snapshots, only the folders whose mtime changed since the last run are read again.
+    """
+    query = f"""select full_path from {schema}.{OFFERS_TABLE} where year = {include_pattern};"""
 
     all_files = []
     for subdir in directory.iterdir():
         if subdir.is_dir() and re.search(include_pattern, str(subdir)):
             console.print(f"Scanning offers directory {subdir.as_posix()}...")
-            files = glob.iglob(subdir.as_posix() + "/**/[!~$]*.xlsx", recursive=True)
+            if use_snapshots:
+                files, rescanned = discover_files(str(subdir), database_file, schema)
+                console.print(f"{rescanned} folder(s) changed since the last scan.")
+            else:
+                files = glob.iglob(
+                    subdir.as_posix() + "/**/[!~$]*.xlsx", recursive=True
+                )
             all_files.extend(files)
 
     if only_new_files:
@@ -55,16 +134,6 @@ def find_files_included(
     return [os.path.normpath(f) for f in all_files], len(all_files)
 
 
-def auto_format_cell_width(ws):
-    for letter in range(1, ws.max_column):
-        maximum_value = 0
-        for cell in ws[get_column_letter(letter)]:
-            val_to_check = len(str(cell.value))
-            if val_to_check > maximum_value:
-                maximum_value = val_to_check
-        ws.column_dimensions[get_column_letter(letter)].width = maximum_value + 2
-
-
 def create_style(json_file) -> dict[str, None]:
     # Load styles from JSON file
     with open(json_file) as file:
@@ -108,50 +177,81 @@ def create_style(json_file) -> dict[str, None]:
     return style_dict
 
 
-def apply_styles(ws, style_dict: dict, style_ranges: dict, autofit: bool = True):
-    # Register named styles to the workbook
-    for named_style in style_dict.values():
-        if named_style.name not in ws.parent.named_styles:
-            ws.parent.add_named_style(named_style)
-
-    console.print("Applying named styles...")
-    # Apply other styles
-    for style_name, ranges in style_ranges.items():
-        if style_name in style_dict:  # Check if the style is defined
-            for cell_range in ranges:
-                range_split = cell_range.split(":")
-                min_cell = coordinate_from_string(range_split[0])
-                min_col, min_row = column_index_from_string(min_cell[0]), min_cell[1]
-                if len(range_split) > 1:  # If the range includes more than one cell
-                    max_cell = coordinate_from_string(range_split[1])
-                    max_col, max_row = (
-                        column_index_from_string(max_cell[0]),
-                        max_cell[1],
-                    )
-                else:  # If the range includes only one cell
-                    max_col, max_row = min_col, min_row
-                for row in ws.iter_rows(
-                    min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col
-                ):
-                    for cell in row:
-                        cell.style = style_dict[style_name]
+def strip_sql_comments(query: str) -> str:
+    return re.sub(r"--[^\n]*", "", query).strip()
+
+
+def is_projection_query(query: str) -> bool:
+    """
+    Whether a fix statement is a select projection, instead of an ALTER/UPDATE.
+    """
+    return (
+        re.match(r"(with|select)\b", strip_sql_comments(query), re.IGNORECASE)
+        is not None
+    )
+
+
+def execute_sql_file(db, query_file: str):
+    """
+    Runs every statement of a SQL file, in order, on an open DuckDB connection.
+    """
+    with open(query_file, "r", encoding="utf8") as f:
+        queries = [q for q in f.read().split(";") if strip_sql_comments(q)]
+    for query in queries:
+        db.execute(query)
+
+
+def stream_query(
+    db, query: str, batch_size: int = EXPORT_BATCH_ROWS, materialize: bool = True
+) -> StreamedTable:
+    """
+    Runs query and hands its rows over as Arrow record batches of batch_size rows.
+    The result is stored once in a temp table (DuckDB spills it to disk when needed),
+    and the row count, the longest value of each column (for autofit) and the batches
+    are read from it, so the query runs once and is never materialized in Python.
+    Without materialize the query is read twice instead, which suits a plain file
+    scan. The connection must stay open, and unused, until the batches have
+    been consumed; the temp table is dropped then.
+    """
+    source, rows_query = f"({query})", query
+    if materialize:
+        source = f"stream_{uuid.uuid4().hex}"
+        db.execute(f"create temp table {source} as {query}")
+        rows_query = f"select * from {source}"
+    columns = db.sql(f"select * from {source}").limit(0).columns
+    lengths = ", ".join(
+        f"""max(length(cast("{c.replace('"', '""')}" as varchar)))""" for c in columns
+    )
+    num_rows, *value_lengths = db.execute(
+        f"select count(*), {lengths} from {source}"
+    ).fetchone()
 
-    # Zoom out
-    ws.sheet_view.zoomScale = 75
+    def batches():
+        yield from db.execute(rows_query).fetch_record_batch(batch_size)
+        if materialize:
+            db.execute(f"drop table if exists {source}")
 
-    # Autoadjust width for each column depending on its content
-    if autofit:
-        auto_format_cell_width(ws)
+    return StreamedTable(
+        columns, num_rows, batches(), [length or 0 for length in value_lengths]
+    )
 
 
 def create_ddb_table(
-    df: DataFrame,
+    df: "DataFrame | pa.Table",
     db_file: str,
     table_name: str,
     table_schema: str,
     query_file: str | None = None,
     insert_instead: bool = False,
+    replace_keys: tuple[str, list] | None = None,
+    order_by: str | None = None,
 ):
+    """
+    Loads a DataFrame or an Arrow table into a DuckDB table, after running the fixes
+    in query_file. With insert_instead the rows are appended (the table is created if
+    missing); replace_keys=(column, values) deletes the target rows with those values
+    first, in the same connection. order_by sorts the rows written.
+    """
     console.print(f"Creating table into DuckDB file {db_file}...")
     if not all([table_name, table_schema, db_file]):
         console.print("input the parameters, I cannot run")
@@ -160,16 +260,31 @@ def create_ddb_table(
     with duckdb.connect(db_file) as db:
         temp_view_register = f"{table_name}_temp"
         temp_table_name = "tmpoffers_deleteafter"
+        db.execute(f"create schema if not exists {table_schema}")
         db.register(temp_view_register, df)
-        db.execute(
-            f"create or replace table {temp_table_name} as select * from {temp_view_register}"
-        )
 
         # Read file and split queries
+        queries = []
         if query_file is not None:
-            console.print("Fixing data...")
             with open(query_file, "r", encoding="utf8") as f:
-                queries = f.read().split(";")
+                queries = [q for q in f.read().split(";") if strip_sql_comments(q)]
+
+        if len(queries) == 1 and is_projection_query(queries[0]):
+            # A single select applies every fix in one scan of the registered data
+            console.print("Fixing data in a single pass...")
+            query = (
+                queries[0]
+                .replace("{table_schema}.", "")
+                .replace("{table_name}", temp_view_register)
+            )
+            with span("sql", detail=query_file):
+                db.execute(f"create or replace table {temp_table_name} as {query}")
+        else:
+            db.execute(
+                f"create or replace table {temp_table_name} as select * from {temp_view_register}"
+            )
+            if queries:
+                console.print("Fixing data...")
 
             # Iterate over each query
             for query in queries:
@@ -187,43 +302,72 @@ def create_ddb_table(
                     )
                 # Execute query
                 console.print("Executing query:", query)
-                db.execute(query)
+                with span("sql", detail=query_file):
+                    db.execute(query)
 
+        order_clause = f" order by {order_by}" if order_by else ""
         if insert_instead:
             console.print(
                 f"Inserting values into table {table_name} in {table_schema} from temp data..."
             )
             db.execute(
-                f"insert into {table_schema}.{table_name} by name (select * from {temp_table_name})"
+                f"create table if not exists {table_schema}.{table_name} as select * from {temp_table_name} limit 0"
             )
+            if replace_keys is not None:
+                key_column, key_values = replace_keys
+                db.execute(
+                    f"delete from {table_schema}.{table_name} where list_contains(?, {key_column})",
+                    [list(key_values)],
+                )
+            with span("write_table", f"{table_schema}.{table_name}", rows=len(df)):
+                db.execute(
+                    f"insert into {table_schema}.{table_name} by name (select * from {temp_table_name}{order_clause})"
+                )
             db.execute(f"drop table {temp_table_name}")
+            bump_table_version(db, table_schema, table_name)
             return
 
         console.print(
             f"Creating table {table_name} in {table_schema} from temp data..."
         )
-        db.execute(
-            f"create or replace table {table_schema}.{table_name} as select * from {temp_table_name}"
-        )
+        with span("write_table", f"{table_schema}.{table_name}", rows=len(df)):
+            db.execute(
+                f"create or replace table {table_schema}.{table_name} as select * from {temp_table_name}{order_clause}"
+            )
         db.execute(f"drop table {temp_table_name}")
+        bump_table_version(db, table_schema, table_name)
 
     return
 
 
+def query_offers(config: FileSettings) -> pa.Table:
+    """
+    Runs the offers report query and returns its result as an Arrow table.
+    """
+    ensure_offers_store(config.db_file, config.db_schema)
+    with duckdb.connect(config.db_file) as db:
+        with open("./queries/write_offers.sql", "r", encoding="utf8") as f:
+            query = f.read()
+            # Execute query, or reuse its result if the offers did not change
+            with span("query", detail="write_offers.sql") as measured:
+                table = cached_query(db, query, "write_offers.sql")
+                measured.rows = table.num_rows
+            return table
+
+
 def write_offers(
     output_file: Path,
     config: FileSettings,
     style_specs: dict[str, None],
+    dataframe: pa.Table | None = None,
     **kwargs,
 ):
     """
-    Writes the data to an output Excel workbook.
+    Writes the data to an output Excel workbook. The report query runs here
+    unless its result is passed as dataframe.
     """
-    with duckdb.connect(config.db_file) as db:
-        with open("./queries/write_offers.sql", "r", encoding="utf8") as f:
-            query = f.read()
-            # Execute query
-            dataframe = db.sql(query).pl()
+    if dataframe is None:
+        dataframe = query_offers(config)
     no_of_files, no_of_variables = dataframe.shape
 
     columns_start_at = 1
@@ -256,6 +400,18 @@ def write_offers(
 
     config.areas_to_style = cell_ranges
 
+    if kwargs.get("writer", config.writer) == "xlsxwriter":
+        write_output_xlsxwriter(
+            output_file,
+            {"Offers Data": dataframe},
+            style_specs,
+            config.areas_to_style,
+            config.header_start,
+            config.sheet_name,
+            kwargs.get("autofit", True),
+        )
+        return
+
     workbook = openpyxl.Workbook()
     # Remove the default sheet created and add new sheets as per data keys
     workbook.remove(workbook.active)
@@ -279,31 +435,38 @@ def write_offers(
         value=f"=COUNTA(A{start_row + 1}:A{start_row + total_rows})",
     )
 
-    # Writing data from dataframe to sheet starting from start_row
-    for i, row in enumerate(
-        dataframe_to_rows(dataframe.to_pandas(), index=False, header=True), 1
-    ):
-        for j, cell in enumerate(row, 1):
-            cell = str(tuple(cell)) if isinstance(cell, list) else cell
-            sheet.cell(row=i + start_row - 1, column=j, value=cell)
+    with span("write_sheet", "Offers Data", rows=total_rows):
+        # Writing data from dataframe to sheet starting from start_row
+        for i, row in enumerate(rows_with_header(dataframe), 1):
+            for j, cell in enumerate(row, 1):
+                cell = str(tuple(cell)) if isinstance(cell, list) else cell
+                sheet.cell(row=i + start_row - 1, column=j, value=cell)
 
-    autofit_check = kwargs.get("autofit", True)
-    apply_styles(sheet, style_specs, config.areas_to_style, autofit_check)
+        autofit_check = kwargs.get("autofit", True)
+        widths = column_widths(dataframe) if autofit_check else None
+        apply_styles(sheet, style_specs, config.areas_to_style, autofit_check, widths)
     filters = sheet.auto_filter
     filters.ref = f"A{start_row}:{last_column_as_letter}{total_rows}"
     sheet.freeze_panes = f"B{start_row + 1}"
 
     console.print("Saving output file")
-    workbook.save(output_file)
+    with span("save_workbook"):
+        workbook.save(output_file)
     console.print(f"File saved in: {output_file}")
 
 
 def timing(f):
+    """
+    Runs f as a span named after it (see conf.tracing) and prints its wall time and the
+    CPU time of the whole process meanwhile.
+    """
+
     def wrap(*args, **kwargs):
-        start_time = time.perf_counter()
-        ret = f(*args, **kwargs)
-        end_time = time.perf_counter() - start_time
-        console.print(f"Total time elapsed: {end_time:0.3f} seconds")
+        with span(f.__name__) as measured:
+            ret = f(*args, **kwargs)
+        console.print(
+            f"Total time elapsed: {measured.wall_seconds:0.3f} seconds (process CPU {measured.cpu_seconds:0.3f} s)"
+        )
         return ret
 
     return wrap
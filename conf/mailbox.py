@@ -0,0 +1,226 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from email import policy
+from email.parser import BytesHeaderParser, BytesParser
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Iterator
+
+from rich.console import Console
+
+from conf.settings import MAIL_BACKENDS
+
+console = Console()
+
+INDEX_FILE = ".attachments_index.json"
+
+
+@dataclass
+class MailAttachment:
+    filename: str
+    # Guarda el adjunto en la ruta indicada
+    save: Callable[[Path], None]
+
+
+@dataclass
+class MailMessage:
+    subject: str
+    received: datetime.datetime
+    # Los adjuntos se cargan solo si se piden
+    attachments: Callable[[], list[MailAttachment]]
+
+
+class MailboxBackend(ABC):
+    """
+    Source of mail messages. Filtering by date and subject is done by the backend,
+    as close to the mail store as it allows.
+    """
+
+    @abstractmethod
+    def messages(
+        self, since: datetime.date, subject_contains: str
+    ) -> Iterator[MailMessage]:
+        """
+        Messages received on or after since whose subject contains subject_contains
+        (case insensitive).
+        """
+
+
+class OutlookBackend(MailboxBackend):
+    """
+    Inbox of the local Outlook profile. Date and subject are filtered by Outlook itself
+    with a DASL query, so only the matching items are returned to Python.
+    """
+
+    def __init__(self, folder: int = 6):
+        # win32com solo existe en Windows: se importa al usar este backend
+        import win32com.client
+
+        outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
+        self.inbox = outlook.GetDefaultFolder(folder)  # "6" refers to the inbox
+
+    @staticmethod
+    def dasl_filter(since: datetime.date, subject_contains: str) -> str:
+        # DASL compara las fechas en UTC: la medianoche local de since se pasa a UTC
+        midnight = datetime.datetime.combine(since, datetime.time()).astimezone()
+        date_string = midnight.astimezone(datetime.timezone.utc).strftime(
+            "%m/%d/%Y %I:%M %p"
+        )
+        subject = subject_contains.replace("'", "''")
+        return (
+            f"@SQL=\"urn:schemas:httpmail:datereceived\" >= '{date_string}'"
+            f" AND \"urn:schemas:httpmail:subject\" LIKE '%{subject}%'"
+        )
+
+    def messages(self, since, subject_contains):
+        items = self.inbox.Items.Restrict(self.dasl_filter(since, subject_contains))
+        for message in items:
+            yield MailMessage(
+                message.Subject,
+                message.ReceivedTime,
+                lambda message=message: [
+                    MailAttachment(
+                        attachment.FileName,
+                        lambda path, attachment=attachment: attachment.SaveAsFile(
+                            str(Path(path).absolute())
+                        ),
+                    )
+                    for attachment in message.Attachments
+                ],
+            )
+
+
+class MaildirBackend(MailboxBackend):
+    """
+    Messages stored as files under a folder: a Maildir (cur/new) or any tree of .eml
+    files. Only the headers are parsed to filter, the body is read for the matches.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    def message_files(self) -> Iterator[Path]:
+        for file in sorted(self.directory.rglob("*")):
+            if not file.is_file() or file.name.startswith("."):
+                continue
+            if file.suffix.lower() == ".eml" or file.parent.name in ("cur", "new"):
+                yield file
+
+    @staticmethod
+    def read_headers(file: Path):
+        # Se lee hasta la primera linea en blanco: el resto es el cuerpo
+        lines = []
+        with open(file, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    break
+                lines.append(line)
+        return BytesHeaderParser(policy=policy.default).parsebytes(b"".join(lines))
+
+    @staticmethod
+    def read_attachments(file: Path) -> list[MailAttachment]:
+        with open(file, "rb") as f:
+            message = BytesParser(policy=policy.default).parse(f)
+        attachments = []
+        for part in message.iter_attachments():
+            if part.get_filename():
+                payload = part.get_payload(decode=True) or b""
+                attachments.append(
+                    MailAttachment(
+                        part.get_filename(),
+                        lambda path, payload=payload: Path(path).write_bytes(payload),
+                    )
+                )
+        return attachments
+
+    def messages(self, since, subject_contains):
+        for file in self.message_files():
+            headers = self.read_headers(file)
+            subject = str(headers.get("subject", ""))
+            if subject_contains.lower() not in subject.lower():
+                continue
+            try:
+                received = parsedate_to_datetime(headers["date"])
+            except (TypeError, ValueError):
+                received = datetime.datetime.fromtimestamp(os.path.getmtime(file))
+            if received.date() < since:
+                continue
+            yield MailMessage(
+                subject, received, lambda file=file: self.read_attachments(file)
+            )
+
+
+def file_hash(file: Path, chunk_size: int = 2**20) -> str:
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AttachmentIndex:
+    """
+    Content hashes of the attachments already saved under a folder, persisted as JSON
+    next to them. On the first run it is seeded by hashing the files already there.
+    """
+
+    def __init__(self, base_dir: Path, seed_files: Callable[[], list[Path]]):
+        self.file = Path(base_dir) / INDEX_FILE
+        if self.file.exists():
+            with open(self.file, encoding="utf8") as f:
+                self.hashes = json.load(f)
+        else:
+            console.print("Building the attachment index from the files already saved...")
+            self.hashes = {file_hash(f): Path(f).as_posix() for f in seed_files()}
+            self.save()
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self.hashes
+
+    def add(self, digest: str, file: Path):
+        self.hashes[digest] = Path(file).as_posix()
+
+    def save(self):
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.file, "w", encoding="utf8") as f:
+            json.dump(self.hashes, f, indent=1)
+
+    def save_attachment(self, attachment: MailAttachment, target: Path) -> Path | None:
+        """
+        Saves the attachment to target unless the same content is already indexed.
+        A different file already at target is never overwritten: the attachment is
+        saved next to it with the start of its hash in the name. Returns the path
+        saved to, or None if the content was already there.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            temp_file = Path(tmp) / attachment.filename
+            attachment.save(temp_file)
+            digest = file_hash(temp_file)
+            if digest in self:
+                return None
+            if target.exists() and file_hash(target) != digest:
+                target = target.with_name(f"{target.stem}_{digest[:8]}{target.suffix}")
+            if target.exists() and file_hash(target) == digest:
+                # Ya estaba guardado pero no en el indice
+                self.add(digest, target)
+                return None
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(temp_file, target)
+        self.add(digest, target)
+        return target
+
+
+def get_backend(name: str, maildir: Path | None = None) -> MailboxBackend:
+    if name == "outlook":
+        return OutlookBackend()
+    if name == "maildir":
+        if maildir is None:
+            raise ValueError("The maildir backend needs the folder of the messages")
+        return MaildirBackend(maildir)
+    raise ValueError(f"Unknown mail backend {name}, use one of {MAIL_BACKENDS}")
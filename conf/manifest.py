@@ -0,0 +1,184 @@
+import hashlib
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import duckdb
+
+from conf.constants import EXTRACTION_VERSION
+from conf.staging import stage_file
+
+MANIFEST_TABLE = "offers_manifest"
+
+
+def config_fingerprint(*config_files: Path) -> str:
+    """
+    Hashes the extraction code version together with the JSON configs it depends on.
+    Any change in cell_addresses.json or sap_columns_mapping.json changes the result.
+    """
+    digest = hashlib.sha1(str(EXTRACTION_VERSION).encode())
+    for config_file in config_files:
+        with open(config_file, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def content_hash(file: str, chunk_size: int = 2**20) -> str:
+    """
+    Hashes the bytes of a file, reading it in chunks.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def row_keys(file: str) -> list[str]:
+    """
+    Possible unique_id values (md5 of full_path) stored for a file. Successful reads
+    keep the absolute path and failed reads the posix path.
+    """
+    paths = {os.path.abspath(file), Path(file).as_posix()}
+    return [hashlib.md5(p.encode("utf8")).hexdigest() for p in paths]
+
+
+@dataclass
+class ExtractionPlan:
+    to_extract: list[str] = field(default_factory=list)
+    unchanged: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    # {path: (size, mtime, hash)} for every file whose manifest entry must be written
+    fingerprints: dict[str, tuple[int, float, str]] = field(default_factory=dict)
+    full_rebuild: bool = False
+
+    def stale_keys(self) -> list[str]:
+        return [
+            key for file in self.to_extract + self.removed for key in row_keys(file)
+        ]
+
+
+def ensure_manifest(db, schema: str):
+    db.execute(f"create schema if not exists {schema}")
+    db.execute(
+        f"""
+        create table if not exists {schema}.{MANIFEST_TABLE} (
+            table_name varchar,
+            full_path varchar,
+            file_size bigint,
+            file_mtime double,
+            content_hash varchar,
+            result_version varchar,
+            extracted_at timestamp default current_timestamp,
+            primary key (table_name, full_path)
+        )
+        """
+    )
+
+
+def plan_extraction(
+    db_file: str,
+    schema: str,
+    table_name: str,
+    files: list[str],
+    result_version: str,
+    rebuild: bool = False,
+    detect_removed: bool = True,
+    target_table: str | None = None,
+) -> ExtractionPlan:
+    """
+    Compares the files found on disk against the manifest and decides which ones
+    need to be extracted again. Size and mtime are checked first; the content hash
+    is only computed when they differ, so a file touched but not edited is reused.
+    target_table is the table holding the rows, when it is not named table_name.
+    """
+    plan = ExtractionPlan()
+    with duckdb.connect(db_file) as db:
+        ensure_manifest(db, schema)
+        table_exists = db.execute(
+            "select count(*) from duckdb_tables() where schema_name = ? and table_name = ?",
+            [schema, target_table or table_name],
+        ).fetchone()[0]
+        known = {
+            path: (size, mtime, digest, version)
+            for path, size, mtime, digest, version in db.execute(
+                f"""select full_path, file_size, file_mtime, content_hash, result_version
+                    from {schema}.{MANIFEST_TABLE} where table_name = ?""",
+                [table_name],
+            ).fetchall()
+        }
+
+    if rebuild or not table_exists or not known:
+        plan.full_rebuild = True
+
+    for file in files:
+        stat = os.stat(file)
+        entry = None if plan.full_rebuild else known.get(file)
+        if entry is not None and entry[3] == result_version:
+            size, mtime, digest, _ = entry
+            if (stat.st_size, stat.st_mtime) == (size, mtime):
+                plan.unchanged.append(file)
+                continue
+            if stat.st_size == size:
+                new_digest = content_hash(stage_file(file, stat))
+                if new_digest == digest:
+                    # Solo ha cambiado la fecha: se actualiza el manifiesto sin releer
+                    plan.unchanged.append(file)
+                    plan.fingerprints[file] = (stat.st_size, stat.st_mtime, digest)
+                    continue
+                plan.to_extract.append(file)
+                plan.fingerprints[file] = (stat.st_size, stat.st_mtime, new_digest)
+                continue
+        plan.to_extract.append(file)
+        # La copia local que se hashea es la que leera despues la extraccion
+        plan.fingerprints[file] = (
+            stat.st_size,
+            stat.st_mtime,
+            content_hash(stage_file(file, stat)),
+        )
+
+    if detect_removed and not plan.full_rebuild:
+        current = set(files)
+        plan.removed = [path for path in known if path not in current]
+
+    return plan
+
+
+def save_manifest(
+    db_file: str,
+    schema: str,
+    table_name: str,
+    plan: ExtractionPlan,
+    result_version: str,
+    failed: set[str] | None = None,
+):
+    """
+    Stores the fingerprints of the files in the plan. Files that could not be read
+    are left out so they are retried on the next run.
+    """
+    failed = failed or set()
+    rows = [
+        (table_name, path, size, mtime, digest, result_version)
+        for path, (size, mtime, digest) in plan.fingerprints.items()
+        if path not in failed
+    ]
+    with duckdb.connect(db_file) as db:
+        ensure_manifest(db, schema)
+        if plan.full_rebuild:
+            db.execute(
+                f"delete from {schema}.{MANIFEST_TABLE} where table_name = ?",
+                [table_name],
+            )
+        else:
+            db.execute(
+                f"""delete from {schema}.{MANIFEST_TABLE}
+                    where table_name = ? and list_contains(?, full_path)""",
+                [table_name, list(plan.fingerprints) + plan.removed],
+            )
+        if rows:
+            db.executemany(
+                f"""insert into {schema}.{MANIFEST_TABLE}
+                    (table_name, full_path, file_size, file_mtime, content_hash, result_version)
+                    values (?, ?, ?, ?, ?, ?)""",
+                rows,
+            )
@@ -0,0 +1,63 @@
+import duckdb
+from rich.console import Console
+
+from conf.query_cache import bump_table_version
+
+console = Console()
+
+# Tabla unica de ofertas, particionada por la columna year
+OFFERS_TABLE = "ws_offers"
+# Tablas antiguas, una por anio (ws_offers_2019, ws_offers_2020...)
+LEGACY_TABLE_PATTERN = r"ws_offers_\d{4}"
+
+
+def partition_key(year: int | str) -> str:
+    """
+    Name under which a year of offers is tracked in the manifest. It matches the old
+    per-year table names, so manifests written before the migration stay valid.
+    """
+    return f"{OFFERS_TABLE}_{year}"
+
+
+def legacy_tables(db, schema: str) -> list[tuple[str, int]]:
+    rows = db.execute(
+        """select table_name from duckdb_tables()
+           where schema_name = ? and regexp_full_match(table_name, ?)
+           order by table_name""",
+        [schema, LEGACY_TABLE_PATTERN],
+    ).fetchall()
+    return [(name, int(name.rsplit("_", 1)[1])) for (name,) in rows]
+
+
+def ensure_offers_store(db_file: str, schema: str) -> bool:
+    """
+    Creates the offers store from the old ws_offers_<year> tables the first time it is
+    needed. Rows are sorted by year and offer_date, so the zone maps let queries that
+    filter on either of them skip the rest. The old tables are left untouched.
+    Returns whether the store exists.
+    """
+    with duckdb.connect(db_file) as db:
+        exists = db.execute(
+            "select count(*) from duckdb_tables() where schema_name = ? and table_name = ?",
+            [schema, OFFERS_TABLE],
+        ).fetchone()[0]
+        if exists:
+            return True
+
+        tables = legacy_tables(db, schema)
+        if not tables:
+            return False
+
+        console.print(
+            f"Moving {len(tables)} yearly offer table(s) into {schema}.{OFFERS_TABLE}..."
+        )
+        union = "\nunion all by name\n".join(
+            f"select *, cast({year} as smallint) as year from {schema}.{name}"
+            for name, year in tables
+        )
+        db.execute(
+            f"""create table {schema}.{OFFERS_TABLE} as
+                select * from ({union}) order by year, offer_date"""
+        )
+        bump_table_version(db, schema, OFFERS_TABLE)
+    return True
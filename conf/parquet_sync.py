@@ -0,0 +1,213 @@
+import hashlib
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import duckdb
+from rich.console import Console
+
+from conf.query_cache import bump_table_version
+from conf.staging import stage_file
+
+console = Console()
+
+STATE_TABLE = "parquet_sync_state"
+LOG_TABLE = "parquet_sync_log"
+PARQUET_PATTERN = "*.parquet"
+
+# Columnas del pie del fichero que identifican su contenido sin leer los datos
+FOOTER_COLUMNS = """
+    row_group_id, row_group_num_rows, column_id, path_in_schema, type,
+    stats_min, stats_max, stats_null_count, data_page_offset, total_compressed_size
+"""
+
+
+@dataclass
+class SyncResult:
+    table_name: str
+    file_path: str
+    # "loaded", "unchanged", "touched" (solo ha cambiado la fecha) o "failed"
+    action: str
+    num_rows: int | None = None
+    seconds: float = 0.0
+
+
+def ensure_sync_tables(db):
+    db.execute(
+        f"""
+        create table if not exists {STATE_TABLE} (
+            table_name varchar primary key,
+            file_path varchar,
+            file_size bigint,
+            file_mtime double,
+            num_rows bigint,
+            num_row_groups bigint,
+            footer_hash varchar,
+            synced_at timestamp
+        )
+        """
+    )
+    db.execute(
+        f"""
+        create table if not exists {LOG_TABLE} (
+            synced_at timestamp,
+            table_name varchar,
+            file_path varchar,
+            action varchar,
+            num_rows bigint,
+            seconds double
+        )
+        """
+    )
+
+
+def parquet_sources(directory: Path, tables: list[str] | None = None) -> dict[str, Path]:
+    """
+    Parquet files of the snapshot folder, by the table they load into (the file stem).
+    """
+    sources = {p.stem: p for p in sorted(Path(directory).glob(PARQUET_PATTERN))}
+    if tables is not None:
+        sources = {name: path for name, path in sources.items() if name in tables}
+    return sources
+
+
+def footer_fingerprint(db, file: Path) -> tuple[int, int, str]:
+    """
+    Row count, row group count and a hash of the row group and column chunk metadata,
+    read from the file footer only.
+    """
+    path = file.as_posix()
+    num_rows, num_row_groups = db.execute(
+        "select num_rows, num_row_groups from parquet_file_metadata(?)", [path]
+    ).fetchone()
+    chunks = db.execute(
+        f"select {FOOTER_COLUMNS} from parquet_metadata(?) order by row_group_id, column_id",
+        [path],
+    ).fetchall()
+    digest = hashlib.sha1(repr(chunks).encode("utf8")).hexdigest()
+    return num_rows, num_row_groups, digest
+
+
+def table_exists(db, table_name: str) -> bool:
+    return bool(
+        db.execute(
+            "select count(*) from duckdb_tables() where schema_name = 'main' and table_name = ?",
+            [table_name],
+        ).fetchone()[0]
+    )
+
+
+def sync_parquet(
+    directory: Path,
+    db_file: str,
+    tables: list[str] | None = None,
+    force: bool = False,
+) -> list[SyncResult]:
+    """
+    Loads every Parquet file of directory into the table named after it, but only
+    when the file changed since the last sync. Size and mtime are checked first;
+    when they differ the footer metadata decides whether the content changed.
+    Every run is recorded in the sync log.
+    """
+    results = []
+    with duckdb.connect(db_file) as db:
+        ensure_sync_tables(db)
+        state = {
+            row[0]: row[1:]
+            for row in db.execute(
+                f"select table_name, file_size, file_mtime, footer_hash from {STATE_TABLE}"
+            ).fetchall()
+        }
+
+        for table_name, file in parquet_sources(directory, tables).items():
+            start = time.perf_counter()
+            stat = os.stat(file)
+            known = state.get(table_name)
+            loaded = table_exists(db, table_name)
+            if not force and loaded and known and known[:2] == (stat.st_size, stat.st_mtime):
+                results.append(SyncResult(table_name, file.as_posix(), "unchanged"))
+                continue
+
+            try:
+                num_rows, num_row_groups, footer_hash = footer_fingerprint(db, file)
+                # Same footer: the file was copied or touched, the table is still valid
+                touched = not force and loaded and known and known[2] == footer_hash
+                action = "touched" if touched else "loaded"
+                db.execute("begin transaction")
+                try:
+                    if not touched:
+                        console.print(f"Loading {file.name} into {table_name}...")
+                        db.execute(
+                            f"create or replace table {table_name} as select * from read_parquet(?)",
+                            [stage_file(file, stat).as_posix()],
+                        )
+                        bump_table_version(db, "main", table_name)
+                    db.execute(
+                        f"insert or replace into {STATE_TABLE} values (?, ?, ?, ?, ?, ?, ?, current_localtimestamp())",
+                        [
+                            table_name,
+                            file.as_posix(),
+                            stat.st_size,
+                            stat.st_mtime,
+                            num_rows,
+                            num_row_groups,
+                            footer_hash,
+                        ],
+                    )
+                    db.execute("commit")
+                except Exception:
+                    # Cualquier fallo (tambien al copiar a staging) deshace la transaccion
+                    db.execute("rollback")
+                    raise
+            except (duckdb.Error, OSError) as e:
+                console.print(f"Could not sync {file.name}: {e}")
+                action, num_rows = "failed", None
+
+            results.append(
+                SyncResult(
+                    table_name,
+                    file.as_posix(),
+                    action,
+                    num_rows,
+                    time.perf_counter() - start,
+                )
+            )
+
+        if results:
+            db.executemany(
+                f"insert into {LOG_TABLE} values (current_localtimestamp(), ?, ?, ?, ?, ?)",
+                [
+                    (r.table_name, r.file_path, r.action, r.num_rows, r.seconds)
+                    for r in results
+                ],
+            )
+    return results
+
+
+def stale_tables(
+    directory: Path, db_file: str, tables: list[str] | None = None
+) -> list[str]:
+    """
+    Tables (all of them, or only the given ones) whose Parquet source changed (size or mtime) since
+    the last sync or that were never synced. Only stat calls, nothing is read.
+    Tables without a Parquet file in directory are not checked.
+    """
+    if not Path(directory).is_dir():
+        console.print(f"Parquet folder {directory} is not reachable, skipping the check.")
+        return []
+    sources = parquet_sources(directory, tables)
+    with duckdb.connect(db_file) as db:
+        ensure_sync_tables(db)
+        state = {
+            row[0]: row[1:]
+            for row in db.execute(
+                f"select table_name, file_size, file_mtime from {STATE_TABLE}"
+            ).fetchall()
+        }
+    stale = []
+    for table_name, file in sources.items():
+        stat = os.stat(file)
+        if state.get(table_name) != (stat.st_size, stat.st_mtime):
+            stale.append(table_name)
+    return stale
@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import uuid
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from rich.console import Console
+
+from conf.settings import QUERY_CACHE_DIR, QUERY_CACHE_MAX_BYTES
+from conf.staging import evict_lru
+
+console = Console()
+
+VERSIONS_TABLE = "table_versions"
+
+# Nombres tras FROM/JOIN que no van seguidos de "(" (funciones como unnest o lateral).
+# Los que no son tablas ni vistas (CTEs, extract(year from x)...) se ignoran despues
+TABLE_REFERENCE = re.compile(
+    r"\b(?:from|join)\s+([a-z_][\w.]*)\b(?!\s*\()", re.IGNORECASE
+)
+SQL_COMMENT = re.compile(r"--[^\n]*")
+SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+def ensure_versions_table(db):
+    db.execute(
+        f"""
+        create table if not exists main.{VERSIONS_TABLE} (
+            schema_name varchar,
+            table_name varchar,
+            version varchar,
+            updated_at timestamp,
+            primary key (schema_name, table_name)
+        )
+        """
+    )
+
+
+def set_table_version(db, schema: str, table_name: str, version: str):
+    ensure_versions_table(db)
+    db.execute(
+        f"insert or replace into main.{VERSIONS_TABLE} values (?, ?, ?, current_localtimestamp())",
+        [schema, table_name, version],
+    )
+
+
+def bump_table_version(db, schema: str, table_name: str):
+    """
+    Gives the table a new version, so the cached results that read it are not used
+    again. Called by the code that writes the table.
+    """
+    # Un identificador aleatorio no coincide nunca con el de otra base de datos
+    set_table_version(db, schema, table_name, uuid.uuid4().hex)
+
+
+def forget_table_version(db, schema: str, table_name: str):
+    ensure_versions_table(db)
+    db.execute(
+        f"delete from main.{VERSIONS_TABLE} where schema_name = ? and table_name = ?",
+        [schema, table_name],
+    )
+
+
+def table_version(db, schema: str, table_name: str) -> str | None:
+    ensure_versions_table(db)
+    row = db.execute(
+        f"select version from main.{VERSIONS_TABLE} where schema_name = ? and table_name = ?",
+        [schema, table_name],
+    ).fetchone()
+    return row[0] if row else None
+
+
+def referenced_tables(sql: str) -> set[str]:
+    sql = SQL_STRING.sub("''", SQL_COMMENT.sub("", sql))
+    return {name.lower() for name in TABLE_REFERENCE.findall(sql)}
+
+
+def catalog(db) -> dict[tuple[str, str], tuple[str, bool, str | None]]:
+    """
+    (schema, name) -> (kind, temporary, version or view SQL) for the tables and views
+    of the database.
+    """
+    ensure_versions_table(db)
+    rows = db.execute(
+        f"""
+        select
+            lower(t.schema_name),
+            lower(t.table_name),
+            'table',
+            t.temporary,
+            v.version
+        from duckdb_tables() t
+        left join main.{VERSIONS_TABLE} v
+            on v.schema_name = t.schema_name
+            and v.table_name = t.table_name
+        where t.database_name = current_database() or t.temporary
+        union all
+        select lower(schema_name), lower(view_name), 'view', temporary, sql
+        from duckdb_views()
+        where not internal
+            and (database_name = current_database() or temporary)
+        """
+    ).fetchall()
+    entries = {}
+    for schema, name, kind, temporary, version in rows:
+        # Una tabla temporal tapa a la permanente del mismo nombre
+        if (schema, name) not in entries or temporary:
+            entries[schema, name] = (kind, temporary, version)
+    return entries
+
+
+def table_stamps(
+    db, sql: str, exclude: set[str] = frozenset()
+) -> dict[str, list] | None:
+    """
+    Version of every table the query reads, following the views. Returns None when
+    the query cannot be cached: it reads a temporary table, or a table whose writer
+    does not stamp it (its changes could not be told apart).
+    """
+    entries = catalog(db)
+    stamps = {}
+    pending = list(referenced_tables(sql) - set(exclude))
+    while pending:
+        name = pending.pop()
+        schema, _, table = name.rpartition(".")
+        key = (schema or "main", table)
+        if name in stamps or key not in entries:
+            continue
+        kind, temporary, version = entries[key]
+        if temporary or version is None:
+            return None
+        stamps[name] = [kind, version]
+        if kind == "view":
+            pending.extend(referenced_tables(version) - set(exclude) - stamps.keys())
+    return stamps
+
+
+def query_fingerprint(db, sql: str, exclude: set[str] = frozenset()) -> str | None:
+    stamps = table_stamps(db, sql, exclude)
+    if stamps is None:
+        return None
+    payload = json.dumps([sql.strip(), sorted(stamps.items())], default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class QueryCache:
+    """
+    Query results saved as Parquet files named by their fingerprint. The least
+    recently read files are removed once the folder grows over max_bytes.
+    """
+
+    def __init__(
+        self, directory: Path = QUERY_CACHE_DIR, max_bytes: int = QUERY_CACHE_MAX_BYTES
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.parquet"
+
+    def get(self, key: str) -> Path | None:
+        """
+        Path of the cached result, marked as just used, or None.
+        """
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, write) -> Path:
+        """
+        Saves a result: write(temp_file) writes the Parquet file, which is then moved
+        into place, so a half-written result is never read.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        handle, temp_file = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(handle)
+        try:
+            write(Path(temp_file))
+            os.replace(temp_file, self.path(key))
+        finally:
+            Path(temp_file).unlink(missing_ok=True)
+        evict_lru(self.directory, self.max_bytes, keep=self.path(key))
+        return self.path(key)
+
+
+def cached_query(
+    db, sql: str, name: str = "query", cache: QueryCache | None = None
+) -> pa.Table:
+    """
+    Result of sql as an Arrow table, read from the cache when none of the tables it
+    reads changed since it was saved.
+    """
+    cache = cache or QueryCache()
+    key = query_fingerprint(db, sql)
+    if key is None or cache.max_bytes <= 0:
+        return db.sql(sql).to_arrow_table()
+    cached = cache.get(key)
+    if cached is not None:
+        try:
+            table = pq.read_table(cached)
+            console.print(f"Using the cached result of {name}, its tables did not change.")
+            return table
+        except (OSError, pa.ArrowInvalid) as e:
+            console.print(f"Could not read the cached result of {name}: {e}")
+
+    table = db.sql(sql).to_arrow_table()
+    cache.put(key, lambda file: pq.write_table(table, file))
+    return table
+
+
+def materialize_query(
+    db,
+    sql: str,
+    table_name: str,
+    schema: str = "main",
+    name: str = "query",
+    cache: QueryCache | None = None,
+) -> bool:
+    """
+    create or replace table schema.table_name as sql, skipped when the table already
+    holds the result for the current versions of its inputs and loaded from the cache
+    when the result was computed before. The table version is the query fingerprint,
+    so the queries that read it are cached in turn. Returns whether the query ran.
+    """
+    cache = cache or QueryCache()
+    key = query_fingerprint(db, sql, exclude={table_name, f"{schema}.{table_name}"})
+    target = f"{schema}.{table_name}"
+    if key is None or cache.max_bytes <= 0:
+        db.execute(f"create or replace table {target} as {sql}")
+        bump_table_version(db, schema, table_name)
+        return True
+
+    exists = db.execute(
+        "select count(*) from duckdb_tables() where schema_name = ? and table_name = ?",
+        [schema, table_name],
+    ).fetchone()[0]
+    if exists and table_version(db, schema, table_name) == key:
+        console.print(f"{target} is up to date, {name} was not run.")
+        return False
+
+    cached = cache.get(key)
+    if cached is not None:
+        console.print(f"Loading {target} from the cached result of {name}...")
+        db.execute(
+            f"create or replace table {target} as select * from read_parquet(?)",
+            [cached.as_posix()],
+        )
+        set_table_version(db, schema, table_name, key)
+        return False
+
+    db.execute(f"create or replace table {target} as {sql}")
+    cache.put(
+        key,
+        lambda file: db.execute(
+            f"copy {target} to '{file.as_posix()}' (format parquet)"
+        ),
+    )
+    set_table_version(db, schema, table_name, key)
+    return True
@@ -0,0 +1,77 @@
+from typing import Any
+
+import openpyxl
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.packaging.relationship import get_dependents, get_rels_path
+from openpyxl.xml.constants import IMAGE_NS
+
+from conf.settings import READER_BACKENDS
+from conf.staging import stage_file
+
+
+def open_workbook(file: str, reader: str = "stream"):
+    """
+    Opens an offer workbook with the selected backend. The streaming backend uses
+    openpyxl read-only mode, so only the sheets that are actually iterated get parsed.
+    """
+    if reader not in READER_BACKENDS:
+        raise ValueError(f"Unknown reader backend: {reader}")
+    # Los libros de la unidad de red se leen desde su copia local
+    file = stage_file(file)
+    if reader == "stream":
+        return openpyxl.load_workbook(
+            file, read_only=True, data_only=True, keep_links=False
+        )
+    return openpyxl.load_workbook(file, data_only=True)
+
+
+def sheet_values(sheet) -> dict[tuple[int, int], Any]:
+    """
+    Returns the non-empty cells of a sheet as a {(row, col): value} dictionary.
+    """
+    if getattr(sheet.parent, "read_only", False):
+        # Las dimensiones guardadas en el fichero no siempre son fiables
+        sheet.reset_dimensions()
+    return {
+        (row_idx, col_idx): value
+        for row_idx, row in enumerate(sheet.iter_rows(values_only=True), start=1)
+        for col_idx, value in enumerate(row, start=1)
+        if value is not None
+    }
+
+
+def sheet_rows(sheet) -> list[tuple]:
+    """
+    Reads every row of a sheet as a tuple of values, in a single pass.
+    """
+    if not getattr(sheet.parent, "read_only", False):
+        return list(sheet.iter_rows(values_only=True))
+
+    # Sin dimensiones cada fila trae solo hasta su ultima celda: se rellenan con None
+    sheet.reset_dimensions()
+    rows = list(sheet.iter_rows(values_only=True))
+    width = max((len(row) for row in rows), default=0)
+    return [tuple(row) + (None,) * (width - len(row)) for row in rows]
+
+
+def sheet_has_images(workbook, sheet_name: str) -> bool:
+    """
+    Checks whether a sheet contains pictures. In read-only mode the drawings are not
+    loaded, so the sheet relationships are inspected straight from the archive.
+    """
+    sheet = workbook[sheet_name]
+    if not getattr(workbook, "read_only", False):
+        return bool(sheet._images)
+
+    archive = workbook._archive
+    names = set(archive.namelist())
+    rels_path = get_rels_path(sheet._worksheet_path)
+    if rels_path not in names:
+        return False
+    for drawing in get_dependents(archive, rels_path).find(SpreadsheetDrawing._rel_type):
+        drawing_rels = get_rels_path(drawing.target)
+        if drawing_rels in names and any(
+            get_dependents(archive, drawing_rels).find(IMAGE_NS)
+        ):
+            return True
+    return False
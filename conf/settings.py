@@ -1,6 +1,8 @@
 from pathlib import Path, WindowsPath
 from dataclasses import dataclass
 import datetime
+import os
+import tempfile
 
 # Configuracion de carpetas y directorios
 BASE_DIR = Path().cwd()
@@ -19,6 +21,32 @@ cell_address_file = Path(CONF_DIR / "cell_addresses.json")
 sap_mapping_file = Path(CONF_DIR / "sap_columns_mapping.json")
 styles_file = Path(CONF_DIR / "styles.json")
 
+# Procesos para la extraccion en paralelo: se deja un nucleo libre para la consola
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+# Lector de los ficheros de oferta: "stream" lee solo los valores de las hojas que se
+# consultan, "full" carga el libro completo (estilos, imagenes, etc.)
+READER_BACKEND = "stream"
+READER_BACKENDS = ("full", "stream")
+# Buzones de los que se descargan adjuntos: Outlook o una carpeta Maildir/.eml
+MAIL_BACKENDS = ("outlook", "maildir")
+# Autoajuste de columnas: filas muestreadas por columna (None = todas) y ancho maximo
+AUTOFIT_SAMPLE_ROWS = 20000
+AUTOFIT_MAX_WIDTH = 80
+# Filas por lote de Arrow al exportar tablas grandes directamente al Excel
+EXPORT_BATCH_ROWS = 10000
+# Worker persistente del menu: direccion local y fichero con la clave de las conexiones,
+# aleatoria y legible solo por el usuario (se crea al arrancar el worker)
+WORKER_ADDRESS = ("localhost", 6390)
+WORKER_KEY_FILE = Path.home() / ".ws_worker_key"
+# Copias locales de los ficheros de la unidad de red: carpeta, tamanio maximo y
+# carpetas cuyos ficheros se copian antes de leerlos
+STAGING_DIR = Path(tempfile.gettempdir()) / "ws_staging"
+STAGING_MAX_BYTES = 4 * 2**30
+STAGED_ROOTS = (Path("N:/"),)
+# Resultados de las consultas pesadas en Parquet, por version de sus tablas de origen
+QUERY_CACHE_DIR = STAGING_DIR / "query_results"
+QUERY_CACHE_MAX_BYTES = 2 * 2**30
+
 
 @dataclass
 class FileSettings:
@@ -32,6 +60,8 @@ class FileSettings:
     styles_file: WindowsPath = Path(CONF_DIR) / "styles.json"
     db_file: str = DATABASE_FILE.as_posix()
     db_schema: str = "ws"
+    # Motor de escritura del Excel: "openpyxl" o "xlsxwriter" (memoria constante)
+    writer: str = "openpyxl"
 
     def get_filename(self):
         return (
@@ -51,6 +81,7 @@ stockconf = FileSettings(
     "Wholesale Stock",
     "Strats",
     6,
+    writer="xlsxwriter",
 )
 
 offersconf = FileSettings(
@@ -60,6 +91,7 @@ offersconf = FileSettings(
     "Offers Data",
     "Strats",
     6,
+    writer="xlsxwriter",
 )
 
 pipeconf = FileSettings(
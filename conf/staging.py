@@ -0,0 +1,263 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import duckdb
+from rich.console import Console
+
+from conf.settings import (
+    DATABASE_FILE,
+    STAGED_ROOTS,
+    STAGING_DIR,
+    STAGING_MAX_BYTES,
+    offersconf,
+    pipeconf,
+    stockconf,
+)
+
+console = Console()
+
+
+def file_stamp(path: Path) -> list[int] | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class StagingCache:
+    """
+    Local copies of the files under the network roots, so they are read from local
+    disk. A copy is keyed by the path, mtime and size of the source, so a changed file
+    gets a new copy. The least recently used copies are removed once the folder grows
+    over max_bytes; the mtime of each copy is its last use.
+    """
+
+    def __init__(
+        self,
+        directory: Path = STAGING_DIR,
+        max_bytes: int = STAGING_MAX_BYTES,
+        roots=STAGED_ROOTS,
+    ):
+        self.directory = Path(directory) / "files"
+        self.max_bytes = max_bytes
+        self.roots = [os.path.normcase(os.path.abspath(r)) for r in roots]
+        # Tamanio ocupado: se calcula al primer uso y se suma en cada copia
+        self.used_bytes = None
+        self.hits = self.misses = 0
+
+    def should_stage(self, path: Path) -> bool:
+        path = os.path.normcase(os.path.abspath(path))
+        return any(
+            path.startswith(root.rstrip(os.sep) + os.sep) for root in self.roots
+        )
+
+    def cached_path(self, path: Path, stat: os.stat_result) -> Path:
+        key = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}"
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return self.directory / f"{digest}{Path(path).suffix}"
+
+    def stage(self, path, stat: os.stat_result | None = None) -> Path:
+        """
+        Returns the local copy of path, copying it first if needed. Files outside the
+        network roots, missing or bigger than the whole cache are returned as they are.
+        """
+        path = Path(path)
+        if not self.should_stage(path):
+            return path
+        try:
+            stat = stat or path.stat()
+        except OSError:
+            # El error se da al abrir el fichero original
+            return path
+        if stat.st_size > self.max_bytes:
+            return path
+
+        cached = self.cached_path(path, stat)
+        if cached.exists():
+            os.utime(cached)
+            self.hits += 1
+            return cached
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Copia a un temporal y renombrado: otro proceso nunca ve una copia a medias
+        handle, temp_file = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(handle)
+        try:
+            shutil.copyfile(path, temp_file)
+            os.replace(temp_file, cached)
+        except OSError:
+            Path(temp_file).unlink(missing_ok=True)
+            return path
+        self.misses += 1
+
+        if self.used_bytes is None:
+            self.used_bytes = self.size()
+        else:
+            self.used_bytes += stat.st_size
+        if self.used_bytes > self.max_bytes:
+            self.evict(keep=cached)
+        return cached
+
+    def size(self) -> int:
+        return sum(stat.st_size for stat, _ in folder_entries(self.directory))
+
+    def evict(self, keep: Path | None = None) -> int:
+        removed, self.used_bytes = evict_lru(self.directory, self.max_bytes, keep)
+        return removed
+
+
+def folder_entries(directory: Path) -> list[tuple[os.stat_result, Path]]:
+    """
+    Files of a cache folder with their stat, leaving out the copies still being written.
+    """
+    if not directory.is_dir():
+        return []
+    entries = []
+    for file in directory.iterdir():
+        if file.suffix == ".tmp":
+            continue
+        try:
+            entries.append((file.stat(), file))
+        except FileNotFoundError:
+            # Otro proceso la ha borrado mientras tanto
+            continue
+    return entries
+
+
+def evict_lru(
+    directory: Path, max_bytes: int, keep: Path | None = None
+) -> tuple[int, int]:
+    """
+    Removes the least recently used files of a cache folder (oldest mtime first) until
+    it fits in max_bytes. Returns the number of files removed and the bytes left.
+    """
+    entries = sorted(folder_entries(directory), key=lambda e: e[0].st_mtime)
+    used = sum(stat.st_size for stat, _ in entries)
+    removed = 0
+    for stat, file in entries:
+        if used <= max_bytes:
+            break
+        if file == keep:
+            continue
+        try:
+            file.unlink()
+        except OSError:
+            # Abierta por otro proceso (Windows): se intentara en la siguiente
+            continue
+        used -= stat.st_size
+        removed += 1
+    return removed, used
+
+
+_staging_cache: StagingCache | None = None
+
+
+def staging_cache() -> StagingCache:
+    # Una cache por proceso: los procesos de lectura crean la suya al primer fichero
+    global _staging_cache
+    if _staging_cache is None:
+        _staging_cache = StagingCache()
+    return _staging_cache
+
+
+def stage_file(path, stat: os.stat_result | None = None) -> Path:
+    return staging_cache().stage(path, stat)
+
+
+def publish_replica(local: Path, remote: Path, pulled_stamp: list[int] | None) -> bool:
+    """
+    Copies the local replica over the remote database: first to a temporary file next
+    to it, then renamed in one step, so readers never see a half-written database.
+    Nothing is published if the remote file changed since it was copied.
+    """
+    # Se vuelca el WAL en el fichero para publicar una base de datos completa
+    with duckdb.connect(local.as_posix()) as db:
+        db.execute("checkpoint")
+
+    remote_wal = Path(f"{remote}.wal")
+    if file_stamp(remote) != pulled_stamp or remote_wal.exists():
+        conflict = local.with_name(
+            f"{local.stem}.conflict-{datetime.datetime.now():%Y%m%d%H%M%S}{local.suffix}"
+        )
+        shutil.copyfile(local, conflict)
+        console.print(
+            f"[red]{remote} changed or is in use since the replica was taken, it was not overwritten. "
+            f"The changes of this run are in {conflict}"
+        )
+        return False
+
+    remote.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = remote.with_name(f".{remote.name}.{os.getpid()}.tmp")
+    try:
+        shutil.copyfile(local, temp_file)
+        if file_stamp(remote) != pulled_stamp:
+            raise OSError(f"{remote} changed while the replica was being copied")
+        os.replace(temp_file, remote)
+    except OSError as e:
+        temp_file.unlink(missing_ok=True)
+        console.print(f"[red]Could not publish the replica to {remote}: {e}")
+        return False
+    return True
+
+
+@contextmanager
+def local_replica(
+    db_file: str | None = None, settings=(offersconf, pipeconf, stockconf)
+):
+    """
+    Runs the block against a local copy of the database and publishes it back when the
+    block ends without errors. The db_file of the settings objects points to the copy
+    meanwhile. The copy is kept for the next run and taken again only when the remote
+    database changed; if the block fails, its changes are discarded on the next run.
+    """
+    remote = Path(db_file or DATABASE_FILE)
+    replica_dir = STAGING_DIR / "replica"
+    replica_dir.mkdir(parents=True, exist_ok=True)
+    source_key = hashlib.sha1(remote.as_posix().encode()).hexdigest()[:12]
+    local = replica_dir / f"{remote.stem}_{source_key}{remote.suffix}"
+    marker_file = local.with_suffix(".json")
+    marker = {}
+    if marker_file.exists():
+        with open(marker_file, encoding="utf8") as f:
+            marker = json.load(f)
+
+    remote_stamp = file_stamp(remote)
+    if (
+        marker.get("remote") != remote_stamp
+        or marker.get("local") != file_stamp(local)
+        or remote_stamp is None
+    ):
+        Path(f"{local}.wal").unlink(missing_ok=True)
+        if remote_stamp is None:
+            console.print(f"{remote} does not exist yet, starting from an empty replica.")
+            local.unlink(missing_ok=True)
+        else:
+            console.print(f"Copying {remote} to the local replica...")
+            shutil.copyfile(remote, local)
+        marker = {"remote": remote_stamp, "local": file_stamp(local)}
+        with open(marker_file, "w", encoding="utf8") as f:
+            json.dump(marker, f)
+
+    previous = [(conf, conf.db_file) for conf in settings]
+    for conf in settings:
+        conf.db_file = local.as_posix()
+    try:
+        yield local
+    finally:
+        for conf, db_file in previous:
+            conf.db_file = db_file
+
+    if file_stamp(local) == marker["local"] and not Path(f"{local}.wal").exists():
+        console.print("The local replica did not change, nothing to publish.")
+        return
+    console.print(f"Publishing the local replica to {remote}...")
+    if publish_replica(local, remote, remote_stamp):
+        with open(marker_file, "w", encoding="utf8") as f:
+            json.dump({"remote": file_stamp(remote), "local": file_stamp(local)}, f)
@@ -0,0 +1,282 @@
+import contextvars
+import datetime
+import itertools
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import duckdb
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+METRICS_TABLE = "run_metrics"
+
+try:
+    import resource
+except ImportError:
+    # Windows no tiene resource: psutil, si esta instalado, da el pico de memoria
+    resource = None
+
+
+def peak_rss_mb() -> float | None:
+    """
+    Peak resident memory of this process so far, in MB (None if it cannot be read).
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux lo da en KB, macOS en bytes
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, "peak_wset", memory.rss) / 2**20
+
+
+@dataclass
+class Span:
+    span_id: int
+    parent_id: int | None
+    name: str
+    detail: str | None = None
+    started_at: datetime.datetime = field(default_factory=datetime.datetime.now)
+    wall_seconds: float = 0.0
+    cpu_seconds: float | None = None
+    peak_rss_mb: float | None = None
+    rows: int | None = None
+    files: int | None = None
+
+
+class TraceRun:
+    """
+    Spans recorded during one run of a script. Each thread keeps its own stack of open
+    spans; spans opened in a thread without one hang from the root span of the run.
+    """
+
+    def __init__(self, name: str):
+        self.run_id = uuid.uuid4().hex
+        self.name = name
+        self.spans: list[Span] = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.root: Span | None = None
+
+    def stack(self) -> list[Span]:
+        if not hasattr(self.local, "stack"):
+            self.local.stack = [self.root] if self.root else []
+        return self.local.stack
+
+    def new_span(self, name: str, detail: str | None = None) -> Span:
+        stack = self.stack()
+        parent = stack[-1].span_id if stack else None
+        with self.lock:
+            span = Span(next(self.ids), parent, name, detail)
+            self.spans.append(span)
+        return span
+
+
+# Run activo del contexto: cada hilo del worker lleva el suyo. Los hilos que abre un run
+# (las etapas de conf/dag.py) lo heredan al arrancar con una copia del contexto
+_current_run: contextvars.ContextVar[TraceRun | None] = contextvars.ContextVar(
+    "trace_run", default=None
+)
+
+
+@contextmanager
+def span(
+    name: str,
+    detail: str | None = None,
+    rows: int | None = None,
+    files: int | None = None,
+):
+    """
+    Measures the block as a span of the current run: wall time, CPU time and peak RSS
+    at the end. CPU time and RSS are process-level: they include every thread of the
+    process (DuckDB's, other stages or other worker jobs) and not only this block.
+    Row and file counts can be set on the yielded span. Outside a run the block is
+    measured but nothing is kept.
+    """
+    run = _current_run.get()
+    current = run.new_span(name, detail) if run else Span(0, None, name, detail)
+    current.rows, current.files = rows, files
+    if run:
+        run.stack().append(current)
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield current
+    finally:
+        current.wall_seconds = time.perf_counter() - start_wall
+        current.cpu_seconds = time.process_time() - start_cpu
+        current.peak_rss_mb = peak_rss_mb()
+        if run:
+            run.stack().pop()
+
+
+def record_span(
+    name: str,
+    wall_seconds: float,
+    detail: str | None = None,
+    rows: int | None = None,
+    files: int | None = None,
+):
+    """
+    Adds an already measured span (e.g. a file read in a worker process) under the
+    span currently open.
+    """
+    run = _current_run.get()
+    if run is None:
+        return
+    current = run.new_span(name, detail)
+    current.wall_seconds, current.rows, current.files = wall_seconds, rows, files
+
+
+def timed_call(function, *args, **kwargs):
+    """
+    Runs function and returns its result together with the seconds it took. Meant
+    to be sent to worker processes, whose spans cannot reach the parent run.
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def ensure_metrics_table(db):
+    db.execute(
+        f"""
+        create table if not exists {METRICS_TABLE} (
+            run_id varchar,
+            run_name varchar,
+            span_id integer,
+            parent_id integer,
+            name varchar,
+            detail varchar,
+            started_at timestamp,
+            wall_seconds double,
+            cpu_seconds double,
+            peak_rss_mb double,
+            rows bigint,
+            files bigint
+        )
+        """
+    )
+
+
+def save_run(run: TraceRun, db_file: str):
+    rows = [
+        (
+            run.run_id,
+            run.name,
+            s.span_id,
+            s.parent_id,
+            s.name,
+            s.detail,
+            s.started_at,
+            s.wall_seconds,
+            s.cpu_seconds,
+            s.peak_rss_mb,
+            s.rows,
+            s.files,
+        )
+        for s in run.spans
+    ]
+    with duckdb.connect(db_file) as db:
+        ensure_metrics_table(db)
+        db.executemany(
+            f"insert into {METRICS_TABLE} values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+def summary_table(run: TraceRun) -> Table:
+    """
+    Spans grouped by their path of names, so repeated spans (one per file) add up
+    in a single line.
+    """
+    by_id = {s.span_id: s for s in run.spans}
+
+    def path(s: Span) -> tuple[str, ...]:
+        names = []
+        while s is not None:
+            names.append(s.name)
+            s = by_id.get(s.parent_id)
+        return tuple(reversed(names))
+
+    groups: dict[tuple[str, ...], list[Span]] = {}
+    for s in run.spans:
+        groups.setdefault(path(s), []).append(s)
+    # Cada grupo debajo de su padre, en el orden en que aparecieron
+    first_seen = {names: i for i, names in enumerate(groups)}
+    tree_order = sorted(
+        groups,
+        key=lambda names: [first_seen[names[: i + 1]] for i in range(len(names))],
+    )
+
+    table = Table(title=f"Run {run.name}")
+    for column in (
+        "Stage",
+        "Calls",
+        "Wall s",
+        "Max s",
+        "Process CPU s",
+        "Peak MB",
+        "Rows",
+        "Files",
+    ):
+        table.add_column(column, justify="left" if column == "Stage" else "right")
+
+    def total(values):
+        values = [v for v in values if v is not None]
+        return sum(values) if values else None
+
+    def fmt(value, pattern):
+        return "" if value is None else format(value, pattern)
+
+    for names in tree_order:
+        spans = groups[names]
+        peaks = [s.peak_rss_mb for s in spans if s.peak_rss_mb is not None]
+        table.add_row(
+            "  " * (len(names) - 1) + names[-1],
+            str(len(spans)),
+            f"{sum(s.wall_seconds for s in spans):.2f}",
+            f"{max(s.wall_seconds for s in spans):.2f}",
+            fmt(total(s.cpu_seconds for s in spans), ".2f"),
+            fmt(max(peaks) if peaks else None, ".0f"),
+            fmt(total(s.rows for s in spans), ","),
+            fmt(total(s.files for s in spans), ","),
+        )
+    return table
+
+
+@contextmanager
+def trace_run(name: str, db_file: str | None = None):
+    """
+    Collects the spans opened inside the block under a root span called name. At the
+    end it prints the breakdown and, with db_file, appends the spans to run_metrics.
+    Nested calls (a script run inside the build) join the run already open.
+    """
+    if _current_run.get() is not None:
+        with span(name) as root:
+            yield root
+        return
+
+    run = TraceRun(name)
+    token = _current_run.set(run)
+    try:
+        with span(name) as root:
+            run.root = root
+            yield root
+    finally:
+        _current_run.reset(token)
+        console.print(summary_table(run))
+        if db_file:
+            try:
+                save_run(run, db_file)
+            except duckdb.Error as e:
+                console.print(f"Could not save the run metrics: {e}")
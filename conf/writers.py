@@ -0,0 +1,483 @@
+import bisect
+from copy import copy
+import datetime
+from dataclasses import dataclass
+from itertools import chain
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable
+
+import numpy as np
+import openpyxl
+import pyarrow as pa
+import pyarrow.compute as pc
+import xlsxwriter
+from openpyxl.styles import NamedStyle
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.cell import column_index_from_string, coordinate_from_string
+from openpyxl.utils.dataframe import dataframe_to_rows
+from rich.console import Console
+
+from conf.settings import AUTOFIT_MAX_WIDTH, AUTOFIT_SAMPLE_ROWS
+from conf.tracing import span
+
+if TYPE_CHECKING:
+    # pandas solo se carga en los caminos que reciben un DataFrame
+    from pandas import DataFrame
+
+console = Console()
+
+# "openpyxl" arma el libro en memoria; "xlsxwriter" escribe fila a fila (memoria constante)
+WRITER_BACKENDS = ("openpyxl", "xlsxwriter")
+
+
+def parse_range(cell_range: str) -> tuple[int, int, int, int]:
+    """
+    Converts "A1:C10" (or a single "B3") into (min_row, max_row, min_col, max_col).
+    """
+    range_split = cell_range.split(":")
+    min_cell = coordinate_from_string(range_split[0])
+    min_col, min_row = column_index_from_string(min_cell[0]), min_cell[1]
+    if len(range_split) > 1:  # If the range includes more than one cell
+        max_cell = coordinate_from_string(range_split[1])
+        max_col, max_row = column_index_from_string(max_cell[0]), max_cell[1]
+    else:  # If the range includes only one cell
+        max_col, max_row = min_col, min_row
+    return min_row, max_row, min_col, max_col
+
+
+class StyleBands:
+    """
+    Style ranges compiled into horizontal bands of rows that share the same
+    {column: style name} map. Later styles and later ranges override earlier ones,
+    the same way successive cell.style assignments do.
+    """
+
+    def __init__(self, style_ranges: dict, style_names):
+        rects = [
+            (*parse_range(cell_range), style_name)
+            for style_name, ranges in style_ranges.items()
+            if style_name in style_names
+            for cell_range in ranges
+        ]
+        breaks = sorted(
+            {r[0] for r in rects} | {r[1] + 1 for r in rects}
+        )
+        self.starts = []
+        self.bands = []
+        for first_row, next_row in zip(breaks, breaks[1:]):
+            columns = {}
+            for min_row, max_row, min_col, max_col, style_name in rects:
+                if min_row <= first_row <= max_row:
+                    for col in range(min_col, max_col + 1):
+                        columns[col] = style_name
+            if columns:
+                self.starts.append(first_row)
+                self.bands.append((first_row, next_row - 1, columns))
+
+    @property
+    def max_row(self) -> int:
+        return self.bands[-1][1] if self.bands else 0
+
+    def columns_for(self, row: int) -> dict[int, str]:
+        idx = bisect.bisect_right(self.starts, row) - 1
+        if idx >= 0:
+            first_row, last_row, columns = self.bands[idx]
+            if row <= last_row:
+                return columns
+        return {}
+
+
+def named_style_format(named_style: NamedStyle) -> dict:
+    """
+    Translates an openpyxl NamedStyle (as built by create_style) into XlsxWriter
+    format properties.
+    """
+    font, fill, alignment = named_style.font, named_style.fill, named_style.alignment
+    properties = {
+        "font_name": font.name,
+        "font_size": font.sz,
+        "bold": bool(font.b),
+        "italic": bool(font.i),
+        "num_format": named_style.number_format,
+        "text_wrap": bool(alignment.wrap_text),
+    }
+    if font.color is not None and font.color.rgb:
+        properties["font_color"] = "#" + str(font.color.rgb)[-6:]
+    if fill.fill_type == "solid":
+        properties["pattern"] = 1
+        properties["bg_color"] = "#" + str(fill.fgColor.rgb)[-6:]
+    if alignment.horizontal:
+        properties["align"] = alignment.horizontal
+    if alignment.vertical:
+        properties["valign"] = {"center": "vcenter"}.get(
+            alignment.vertical, alignment.vertical
+        )
+    return properties
+
+
+def cell_value(value):
+    """
+    Cleans a DataFrame value before handing it to XlsxWriter.
+    """
+    if value is None:
+        return None
+    # NaN y NaT (de pandas, subclase de datetime) son distintos de si mismos
+    if isinstance(value, (float, datetime.datetime)) and value != value:
+        return None
+    if isinstance(value, list):
+        return str(tuple(value))
+    return value
+
+
+def render_list_items(items: pa.Array, value_type: pa.DataType) -> pa.Array | None:
+    """
+    Each list element as Python's repr shows it inside a tuple: integers as they are,
+    strings in single quotes, booleans as True/False and nulls as None. Returns None
+    for the types Arrow cannot render the same way (floats, dates...).
+    """
+    if pa.types.is_integer(value_type):
+        text = pc.cast(items, pa.string())
+    elif pa.types.is_boolean(value_type):
+        text = pc.if_else(items, "True", "False")
+    elif pa.types.is_string(value_type) or pa.types.is_large_string(value_type):
+        # repr cambia de comillas o escapa estos caracteres: se deja a Python
+        if pc.any(pc.match_substring_regex(items, r"['\\\x00-\x1f\x7f]")).as_py():
+            return None
+        text = pc.binary_join_element_wise("'", pc.cast(items, pa.string()), "'", "")
+    else:
+        return None
+    return pc.fill_null(text, "None")
+
+
+def render_list_columns(table: pa.Table) -> pa.Table:
+    """
+    Renders the list columns of an Arrow table as the text the reports show for them,
+    the same as cell_value does for a DataFrame: e.g. (1, None) or ('a', 'b'). The
+    elements are rendered in one vectorized step per column when their type allows it.
+    """
+    for i, column_field in enumerate(table.schema):
+        if not (
+            pa.types.is_list(column_field.type)
+            or pa.types.is_large_list(column_field.type)
+        ):
+            continue
+        column = pc.cast(table.column(i), pa.list_(column_field.type.value_type))
+        column = column.combine_chunks()
+        rendered = render_list_items(column.values, column_field.type.value_type)
+        if rendered is None:
+            text = pa.array([cell_value(v) for v in column.to_pylist()], pa.string())
+        else:
+            items = pa.ListArray.from_arrays(
+                column.offsets, rendered, mask=column.is_null()
+            )
+            closing = pc.if_else(
+                pc.equal(pc.list_value_length(items), 1), ",)", ")"
+            )
+            text = pc.binary_join_element_wise(
+                "(", pc.binary_join(items, ", "), closing, ""
+            )
+        table = table.set_column(i, column_field.name, text)
+    return table
+
+
+@dataclass
+class StreamedTable:
+    """
+    Rows arriving as Arrow record batches (e.g. from DuckDB's fetch_record_batch),
+    which can be iterated only once. The row count and the longest value of each
+    column are known beforehand, so the writers never need the whole table in memory.
+    """
+
+    columns: list[str]
+    num_rows: int
+    batches: Iterable[pa.RecordBatch]
+    value_lengths: list[int] | None = None
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.num_rows, len(self.columns)
+
+
+def column_names(data: "DataFrame | pa.Table | StreamedTable") -> list[str]:
+    if isinstance(data, StreamedTable):
+        return data.columns
+    if isinstance(data, pa.Table):
+        return data.column_names
+    return list(data.columns)
+
+
+def arrow_rows(table: pa.Table):
+    for batch in render_list_columns(table).to_batches():
+        yield from zip(*(column.to_pylist() for column in batch.columns))
+
+
+def table_rows(data: "DataFrame | pa.Table | StreamedTable"):
+    """
+    Iterates the rows of a DataFrame, an Arrow table or a StreamedTable as tuples.
+    Arrow data is converted batch by batch, column-wise, with its list columns
+    already rendered.
+    """
+    if isinstance(data, StreamedTable):
+        for batch in data.batches:
+            yield from arrow_rows(pa.Table.from_batches([batch]))
+    elif isinstance(data, pa.Table):
+        yield from arrow_rows(data)
+    else:
+        yield from data.itertuples(index=False, name=None)
+
+
+def rows_with_header(data: "DataFrame | pa.Table | StreamedTable"):
+    """
+    Header and rows for the openpyxl writers.
+    """
+    if isinstance(data, (pa.Table, StreamedTable)):
+        return chain([column_names(data)], table_rows(data))
+    return dataframe_to_rows(data, index=False, header=True)
+
+
+def column_widths(
+    dataframe: "DataFrame | pa.Table | StreamedTable",
+    sample_rows: int | None = AUTOFIT_SAMPLE_ROWS,
+    max_width: int | None = AUTOFIT_MAX_WIDTH,
+) -> list[int]:
+    """
+    Column widths for autofit, computed from the DataFrame instead of the written cells:
+    the longest header or value of each column, plus 2. With sample_rows, longer frames
+    are measured on a fixed random sample of rows; max_width caps the result.
+    """
+    if isinstance(dataframe, StreamedTable):
+        lengths = dataframe.value_lengths or [0] * len(dataframe.columns)
+    elif isinstance(dataframe, pa.Table):
+        table = render_list_columns(dataframe)
+        if sample_rows is not None and table.num_rows > sample_rows:
+            rows = np.random.default_rng(0).choice(table.num_rows, sample_rows, replace=False)
+            table = table.take(np.sort(rows))
+        lengths = [
+            pc.max(pc.utf8_length(pc.cast(column, pa.string()))).as_py() or 0
+            for column in table.columns
+        ]
+    else:
+        if sample_rows is not None and len(dataframe) > sample_rows:
+            dataframe = dataframe.sample(n=sample_rows, random_state=0)
+        lengths = []
+        for column in dataframe.columns:
+            values = dataframe[column].dropna()
+            lengths.append(int(values.astype(str).str.len().max()) if len(values) else 0)
+    widths = []
+    for column, longest in zip(column_names(dataframe), lengths):
+        width = max(longest, len(str(column))) + 2
+        widths.append(min(width, max_width) if max_width is not None else width)
+    return widths
+
+
+def title_block(title: str, start_row: int, total_rows: int) -> dict[int, dict[int, object]]:
+    """
+    Cells written above the table: title, creation date and user, and the row counter.
+    """
+    cells = {
+        1: {1: title},
+        2: {1: "Created on:", 2: datetime.datetime.now()},
+        3: {1: "Created by:", 2: os.environ.get("USERNAME")},
+    }
+    cells.setdefault(start_row - 1, {})[1] = (
+        f"=COUNTA(A{start_row + 1}:A{start_row + total_rows})"
+    )
+    return cells
+
+
+def write_output_xlsxwriter(
+    output_file: Path,
+    data: "dict[str, DataFrame | pa.Table | StreamedTable]",
+    style_specs: dict,
+    style_ranges: dict,
+    start_row: int,
+    title: str,
+    autofit: bool = True,
+):
+    """
+    Writes the data to an output Excel workbook with XlsxWriter in constant memory mode:
+    every row is written once, in order, together with its format.
+    """
+    workbook = xlsxwriter.Workbook(
+        str(output_file),
+        {
+            "constant_memory": True,
+            "strings_to_urls": False,
+            "remove_timezone": True,
+            "default_date_format": "yyyy-mm-dd h:mm:ss",
+        },
+    )
+    formats = {
+        name: workbook.add_format(named_style_format(named_style))
+        for name, named_style in style_specs.items()
+    }
+    bands = StyleBands(style_ranges, formats)
+
+    for sheet_name, dataframe in data.items():
+        sheet = workbook.add_worksheet(sheet_name)
+        total_rows, total_columns = dataframe.shape
+
+        fixed_cells = title_block(title, start_row, total_rows)
+        fixed_cells.setdefault(start_row, {}).update(
+            {j: column for j, column in enumerate(column_names(dataframe), 1)}
+        )
+        data_rows = table_rows(dataframe)
+        last_row = max(start_row + total_rows, bands.max_row, *fixed_cells)
+
+        console.print(f"Writing {total_rows} rows to sheet {sheet_name}...")
+        with span("write_sheet", sheet_name, rows=total_rows):
+            for row in range(1, last_row + 1):
+                cells = dict(fixed_cells.get(row, {}))
+                if start_row < row <= start_row + total_rows:
+                    values = next(data_rows)
+                    cells.update({j: cell_value(v) for j, v in enumerate(values, 1)})
+                styled = bands.columns_for(row)
+                for col in sorted(cells.keys() | styled.keys()):
+                    value = cells.get(col)
+                    cell_format = formats.get(styled.get(col))
+                    if value is None:
+                        if cell_format is not None:
+                            sheet.write_blank(row - 1, col - 1, None, cell_format)
+                        continue
+                    sheet.write(row - 1, col - 1, value, cell_format)
+
+        if autofit:
+            for col, width in enumerate(column_widths(dataframe)):
+                sheet.set_column(col, col, width)
+        sheet.set_zoom(75)
+        last_column = max(total_columns - 1, 0)
+        sheet.autofilter(start_row - 1, 0, start_row + total_rows - 1, last_column)
+        sheet.freeze_panes(start_row, 1)
+
+    console.print("Saving output file")
+    with span("save_workbook"):
+        workbook.close()
+    console.print(f"File saved in: {output_file}")
+
+
+def auto_format_cell_width(ws, widths: list[int] | None = None):
+    """
+    Sets the width of every column. With widths (see column_widths) they
+    are applied directly; otherwise every cell of the sheet is measured.
+    """
+    if widths is not None:
+        for letter, width in enumerate(widths, 1):
+            ws.column_dimensions[get_column_letter(letter)].width = width
+        return
+
+    for letter in range(1, ws.max_column + 1):
+        maximum_value = 0
+        for cell in ws[get_column_letter(letter)]:
+            val_to_check = len(str(cell.value))
+            if val_to_check > maximum_value:
+                maximum_value = val_to_check
+        ws.column_dimensions[get_column_letter(letter)].width = maximum_value + 2
+
+
+def apply_styles(
+    ws,
+    style_dict: dict,
+    style_ranges: dict,
+    autofit: bool = True,
+    widths: list[int] | None = None,
+):
+    """
+    Applies the named styles of style_dict to the cells of style_ranges on an
+    openpyxl sheet, then zooms out and autofits the columns.
+
+    The style is still set cell by cell, once per cell of every range. openpyxl
+    column and row styles (column_dimensions / row_dimensions) only reach cells that
+    are not in the file, and every data cell written before this call is, so they
+    cannot replace the loop. The ranges are compiled into row bands first, so each
+    cell gets a single assignment however many ranges cover it. For large sheets use
+    writer="xlsxwriter", which sets the formats as the rows are written.
+    """
+    # Register named styles to the workbook
+    for named_style in style_dict.values():
+        if named_style.name not in ws.parent.named_styles:
+            ws.parent.add_named_style(named_style)
+
+    console.print("Applying named styles...")
+    # Compile the ranges once: each row band maps its columns to the style that wins
+    # (later styles override earlier ones), so every cell gets a single assignment
+    bands = StyleBands(style_ranges, style_dict)
+    style_arrays = {name: style.as_tuple() for name, style in style_dict.items()}
+    for first_row, last_row, columns in bands.bands:
+        column_arrays = [(col, style_arrays[name]) for col, name in columns.items()]
+        for row in range(first_row, last_row + 1):
+            for col, style_array in column_arrays:
+                ws.cell(row=row, column=col)._style = copy(style_array)
+
+    # Zoom out
+    ws.sheet_view.zoomScale = 75
+
+    # Autoadjust width for each column depending on its content
+    if autofit:
+        auto_format_cell_width(ws, widths)
+
+
+def write_output(
+    output_file: Path,
+    data: "dict[str, DataFrame | pa.Table | StreamedTable]",
+    style_specs: dict,
+    style_ranges: dict,
+    start_row: int,
+    title: str,
+    **kwargs,
+):
+    """
+    Writes the data to an output Excel workbook. Pass writer="xlsxwriter" to stream
+    the rows in constant memory instead of building the workbook with openpyxl.
+    """
+    autofit_check = kwargs.get("autofit", True)
+    if kwargs.get("writer", "openpyxl") == "xlsxwriter":
+        write_output_xlsxwriter(
+            output_file,
+            data,
+            style_specs,
+            style_ranges,
+            start_row,
+            title,
+            autofit_check,
+        )
+        return
+
+    workbook = openpyxl.Workbook()
+    # Remove the default sheet created and add new sheets as per data keys
+    default_sheet = workbook.active
+    workbook.remove(default_sheet)
+    for sheet_name, dataframe in data.items():
+        sheet = workbook.create_sheet(sheet_name)
+        total_rows, total_columns = dataframe.shape
+        last_column_as_letter = get_column_letter(total_columns)
+
+        # Writing workbook creation date, title and description
+        sheet.cell(column=1, row=1, value=title)
+        sheet.cell(column=1, row=2, value="Created on:")
+        sheet.cell(column=2, row=2, value=datetime.datetime.now())
+        sheet.cell(column=1, row=3, value="Created by:")
+        sheet.cell(column=2, row=3, value=os.environ.get("USERNAME"))
+        sheet.cell(
+            column=1,
+            row=(start_row - 1),
+            value=f"=COUNTA(A{start_row + 1}:A{start_row + total_rows})",
+        )
+
+        with span("write_sheet", sheet_name, rows=total_rows):
+            # Writing data from dataframe to sheet starting from start_row
+            for i, row in enumerate(rows_with_header(dataframe), 1):
+                for j, cell in enumerate(row, 1):
+                    cell = str(tuple(cell)) if isinstance(cell, list) else cell
+                    sheet.cell(row=i + start_row - 1, column=j, value=cell)
+
+            widths = column_widths(dataframe) if autofit_check else None
+            apply_styles(sheet, style_specs, style_ranges, autofit_check, widths)
+        filters = sheet.auto_filter
+        filters.ref = f"A{start_row}:{last_column_as_letter}{total_rows}"
+        sheet.freeze_panes = f"B{start_row + 1}"
+
+    console.print("Saving output file")
+    with span("save_workbook"):
+        workbook.save(output_file)
+    console.print(f"File saved in: {output_file}")
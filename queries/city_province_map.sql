@@ -0,0 +1,32 @@
+-- Correspondencia persistente ciudad -> provincia/region (iso3166_provincias).
+-- jaro_similarity solo se calcula para las ciudades de master_tape que aun no estan
+-- en la tabla, el resto se reutiliza tal cual.
+create table if not exists city_province_map as
+select
+    cast(null as varchar) as city,
+    code as province_code,
+    region_code
+from iso3166_provincias
+limit 0;
+
+insert into city_province_map
+select
+    city,
+    best.code as province_code,
+    best.region_code as region_code
+from (
+    select
+        m.city,
+        arg_max(
+            struct_pack(code := p.code, region_code := p.region_code),
+            jaro_similarity(p.province, m.city)
+        ) as best
+    from (
+        select distinct city
+        from master_tape
+        where city is not null
+          and city not in (select city from city_province_map)
+    ) m
+    cross join iso3166_provincias p
+    group by m.city
+);
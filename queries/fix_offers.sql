@@ -1,46 +1,78 @@
-alter table {table_schema}.{table_name} alter column commercialdev set data type varchar;
-alter table {table_schema}.{table_name} alter column jointdev set data type varchar;
-alter table {table_schema}.{table_name} alter column offer_date set data type varchar;
-update {table_schema}.{table_name} set offer_date = regexp_replace(trim(offer_date), '[\.\/]', '-', 'g') where regexp_matches(offer_date, '[\.\/]') = true;
-update {table_schema}.{table_name} set offer_date = strptime(offer_date, '%d-%m-%Y') where regexp_matches(offer_date, '^\d{2}-.');
-update {table_schema}.{table_name} set offer_date = strptime(regexp_extract(full_path, '(2\d{7})', 1), '%Y%m%d') where regexp_matches(offer_date, '^[345789]') or offer_date is null;
-update {table_schema}.{table_name} set offer_date = make_date(2024,month(cast(offer_date as timestamp)),day(cast(offer_date as timestamp))) where year(cast(offer_date as timestamp)) > 2024;
-alter table {table_schema}.{table_name} alter offer_price set data type varchar;
-update {table_schema}.{table_name} set offer_price = nullif(regexp_extract(offer_price, '\d+\.?\d+'), '') where regexp_matches(offer_price, '[a-zA-Z\s]');
-alter table {table_schema}.{table_name} alter appraisal_price set data type varchar;
-update {table_schema}.{table_name} set appraisal_price = nullif(regexp_extract(appraisal_price, '\d+\.?\d+'), '') where regexp_matches(appraisal_price, '[a-zA-Z\s]');
-alter table {table_schema}.{table_name} alter column offer_id set data type varchar;
-alter table {table_schema}.{table_name} alter column web_price set data type varchar;
-alter table {table_schema}.{table_name} alter column sap_price set data type varchar;
-alter table {table_schema}.{table_name} alter column contract_deposit set data type varchar;
-update {table_schema}.{table_name} set web_price = NULL where regexp_matches(web_price, '\D');
-update {table_schema}.{table_name} set sap_price = NULL where regexp_matches(sap_price, '\D');
-alter table {table_schema}.{table_name} alter column unique_urs set data type varchar;
-update {table_schema}.{table_name} set unique_urs = string_to_array(regexp_replace(unique_urs,'[\[\]]', '', 'g'), ',');
-update {table_schema}.{table_name} set commercialdev = string_to_array(regexp_replace(commercialdev,'[\[\]]', '', 'g'), ',');
-update {table_schema}.{table_name} set jointdev = string_to_array(regexp_replace(jointdev,'[\[\]]', '', 'g'), ',');
-update {table_schema}.{table_name} set offer_id = regexp_replace(trim(offer_id), '[\n\t\W]', '', 'g')[:7] where regexp_matches(offer_id, '[\n\t\W]');
-update {table_schema}.{table_name} set offer_id = NULL where len(offer_id) < 6 or regexp_matches(offer_id, '[a-zA-Z]');
-update {table_schema}.{table_name} set contract_deposit = '0' where contract_deposit = '-';
-alter table {table_schema}.{table_name} alter column client_description set data type varchar;
-update {table_schema}.{table_name} set client_description = NULL where client_description = 'NOMBRE';
-update {table_schema}.{table_name} set commercialdev = regexp_replace(jointdev, '-', '');
-update {table_schema}.{table_name} set jointdev = regexp_replace(jointdev, '-', '');
-alter table {table_schema}.{table_name} alter column offer_date set data type timestamp;
-alter table {table_schema}.{table_name} alter column offer_price set data type double;
-alter table {table_schema}.{table_name} alter column appraisal_price set data type double;
-alter table {table_schema}.{table_name} alter column web_price set data type double;
-alter table {table_schema}.{table_name} alter column sap_price set data type double;
-alter table {table_schema}.{table_name} alter column unique_urs set data type int[];
-alter table {table_schema}.{table_name} alter column commercialdev set data type int[];
-alter table {table_schema}.{table_name} alter column jointdev set data type int[];
-alter table {table_schema}.{table_name} alter column offer_id set data type int;
---alter table {table_schema}.{table_name} alter column contract_deposit set data type double;
-alter table {table_schema}.{table_name} alter column legal_status set data type varchar;
-alter table {table_schema}.{table_name} alter column read_details set data type varchar;
-alter table {table_schema}.{table_name} alter column rollup_y_n set data type varchar;
-alter table {table_schema}.{table_name} alter column offer_lead_id set data type int;
-alter table {table_schema}.{table_name} add column if not exists unique_id varchar;
-alter table {table_schema}.{table_name} add column if not exists updated_at timestamp;
-update {table_schema}.{table_name} set unique_id = md5(full_path);
-update {table_schema}.{table_name} set updated_at = now();
+-- Normalizacion de las ofertas extraidas en una sola proyeccion.
+-- Cada CTE aplica las reglas que antes eran ALTER/UPDATE consecutivos, en el mismo orden,
+-- y la consulta final devuelve los tipos definitivos y las columnas unique_id/updated_at.
+with as_text as (
+    select * replace (
+        cast(commercialdev as varchar) as commercialdev,
+        cast(jointdev as varchar) as jointdev,
+        cast(offer_date as varchar) as offer_date,
+        cast(offer_price as varchar) as offer_price,
+        cast(appraisal_price as varchar) as appraisal_price,
+        cast(offer_id as varchar) as offer_id,
+        cast(web_price as varchar) as web_price,
+        cast(sap_price as varchar) as sap_price,
+        cast(contract_deposit as varchar) as contract_deposit,
+        cast(unique_urs as varchar) as unique_urs,
+        cast(client_description as varchar) as client_description
+    )
+    from {table_schema}.{table_name}
+),
+step_1 as (
+    select * replace (
+        case when regexp_matches(offer_date, '[\.\/]') then regexp_replace(trim(offer_date), '[\.\/]', '-', 'g') else offer_date end as offer_date,
+        case when regexp_matches(offer_price, '[a-zA-Z\s]') then nullif(regexp_extract(offer_price, '\d+\.?\d+'), '') else offer_price end as offer_price,
+        case when regexp_matches(appraisal_price, '[a-zA-Z\s]') then nullif(regexp_extract(appraisal_price, '\d+\.?\d+'), '') else appraisal_price end as appraisal_price,
+        case when regexp_matches(web_price, '\D') then NULL else web_price end as web_price,
+        case when regexp_matches(sap_price, '\D') then NULL else sap_price end as sap_price,
+        cast(string_to_array(regexp_replace(unique_urs,'[\[\]]', '', 'g'), ',') as varchar) as unique_urs,
+        cast(string_to_array(regexp_replace(commercialdev,'[\[\]]', '', 'g'), ',') as varchar) as commercialdev,
+        cast(string_to_array(regexp_replace(jointdev,'[\[\]]', '', 'g'), ',') as varchar) as jointdev,
+        case when regexp_matches(offer_id, '[\n\t\W]') then regexp_replace(trim(offer_id), '[\n\t\W]', '', 'g')[:7] else offer_id end as offer_id,
+        case when contract_deposit = '-' then '0' else contract_deposit end as contract_deposit,
+        case when client_description = 'NOMBRE' then NULL else client_description end as client_description
+    )
+    from as_text
+),
+step_2 as (
+    select * replace (
+        case when regexp_matches(offer_date, '^\d{2}-.') then cast(strptime(offer_date, '%d-%m-%Y') as varchar) else offer_date end as offer_date,
+        case when len(offer_id) < 6 or regexp_matches(offer_id, '[a-zA-Z]') then NULL else offer_id end as offer_id
+    )
+    from step_1
+),
+step_3 as (
+    -- commercialdev se copia de jointdev, igual que en la cadena anterior
+    select * replace (
+        case when regexp_matches(offer_date, '^[345789]') or offer_date is null then cast(strptime(regexp_extract(full_path, '(2\d{7})', 1), '%Y%m%d') as varchar) else offer_date end as offer_date,
+        regexp_replace(jointdev, '-', '') as commercialdev,
+        regexp_replace(jointdev, '-', '') as jointdev
+    )
+    from step_2
+),
+step_4 as (
+    -- Fechas posteriores al anio de la carpeta: se llevan a ese anio (columna year)
+    select * replace (
+        case when year(cast(offer_date as timestamp)) > year then cast(make_date(cast(year as bigint), month(cast(offer_date as timestamp)), least(day(cast(offer_date as timestamp)), day(last_day(make_date(cast(year as bigint), month(cast(offer_date as timestamp)), 1))))) as varchar) else offer_date end as offer_date
+    )
+    from step_3
+)
+select
+    * replace (
+        cast(offer_date as timestamp) as offer_date,
+        cast(offer_price as double) as offer_price,
+        cast(appraisal_price as double) as appraisal_price,
+        cast(web_price as double) as web_price,
+        cast(sap_price as double) as sap_price,
+        cast(unique_urs as int[]) as unique_urs,
+        cast(commercialdev as int[]) as commercialdev,
+        cast(jointdev as int[]) as jointdev,
+        cast(offer_id as int) as offer_id,
+        cast(legal_status as varchar) as legal_status,
+        cast(read_details as varchar) as read_details,
+        cast(rollup_y_n as varchar) as rollup_y_n,
+        cast(offer_lead_id as int) as offer_lead_id,
+        cast(year as smallint) as year
+    ),
+    md5(full_path) as unique_id,
+    cast(now() as timestamp) as updated_at
+from step_4;
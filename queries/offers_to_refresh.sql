@@ -0,0 +1,43 @@
+-- Ofertas cuyo unnested_data hay que recalcular:
+-- 1. Nuevas o con un updated_at distinto al del ultimo calculo (unnested_state)
+-- 2. Con alguna UR cuyas columnas en master_tape o allocation_new han cambiado desde
+--    el ultimo calculo (unnested_source_snapshot), ya sea propia o de la oferta en offers
+-- 3. Cuya oferta ha cambiado en offers (URs, promociones o estado)
+-- unnested_sources es la huella actual de esas tablas (ver unnested_sources.sql)
+with all_offers as (
+  select unique_id, offer_id, updated_at, unique_urs from ws.ws_offers
+),
+offer_versions as (
+  select unique_id, max(updated_at) as updated_at
+  from all_offers
+  group by unique_id
+),
+changed_sources as (
+  select coalesce(n.source, s.source) as source,
+         coalesce(n.ur, s.ur) as ur,
+         coalesce(n.offerid, s.offerid) as offerid
+  from unnested_sources n
+  full join unnested_source_snapshot s
+    on n.source = s.source
+   and n.ur is not distinct from s.ur
+   and n.offerid is not distinct from s.offerid
+   and n.row_hash = s.row_hash
+  where n.source is null or s.source is null
+),
+changed_urs as (
+  select distinct ur from changed_sources where source <> 'offers'
+)
+select v.unique_id
+from offer_versions v
+left join unnested_state s
+  on v.unique_id = s.unique_id
+where s.unique_id is null
+   or v.updated_at is distinct from s.updated_at
+union
+select a.unique_id
+from all_offers a
+where list_has_any(a.unique_urs, (select list(ur) from changed_urs))
+   or a.offer_id in (
+     select o.offerid from offers o where o.ur_current in (select ur from changed_urs)
+   )
+   or a.offer_id in (select offerid from changed_sources where source = 'offers');
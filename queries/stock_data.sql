@@ -1,21 +1,5 @@
-WITH rankings AS (
-    SELECT
-        m.ur_current,
-        m.city AS province_svh,
-        p.*,
-        jaro_similarity(p.province, m.city) score,
-        rank() over (puntuacion) AS rank
-    FROM
-        iso3166_provincias p,
-        master_tape m WINDOW puntuacion AS (
-            PARTITION by m.ur_current
-            ORDER BY
-                score DESC
-        )
-    ORDER BY
-        1,
-        4 DESC
-)
+-- La provincia y la region salen de city_province_map (ver city_province_map.sql)
+-- y el canal y las coordenadas de ur_channel_dim (ver ur_channel_dim.sql)
 SELECT
     lat.asset_id,
     CASE
@@ -130,73 +114,15 @@ SELECT
         WHERE
             m.updatedcategory = 'Remaining Stock'
     ) AS remaining_nbv,
-    MODE(r.code) AS province_code,
+    MODE(r.province_code) AS province_code,
     MODE(r.region_code) AS region_code,
-    AVG(CAST(ll.Y_GOOGLE AS DOUBLE)) AS latitude,
-    AVG(CAST(ll.X_GOOGLE AS DOUBLE)) AS longitude,
+    AVG(CAST(ch.Y_GOOGLE AS DOUBLE)) AS latitude,
+    AVG(CAST(ch.X_GOOGLE AS DOUBLE)) AS longitude,
     m.updated_at
 FROM
     master_tape AS m
-    LEFT JOIN rankings r ON r.ur_current = m.ur_current
-    LEFT JOIN (
-        SELECT
-            UNIDAD_REGISTRAL,
-            MODE(X_GOOGLE) AS X_GOOGLE,
-            MODE(Y_GOOGLE) AS Y_GOOGLE
-        FROM
-            (
-                SELECT
-                    *
-                FROM
-                    channels_historic
-                UNION
-                ALL
-                SELECT
-                    load_date,
-                    UNIDAD_REGISTRAL,
-                    X_GOOGLE,
-                    Y_GOOGLE,
-                    CHANNEL
-                FROM
-                    latest_operations
-            ) AS coordinates
-        WHERE
-            X_GOOGLE IS NOT NULL
-        GROUP BY
-            1
-    ) ll ON m.ur_current = ll.UNIDAD_REGISTRAL
-    LEFT JOIN (
-        SELECT
-            UNIDAD_REGISTRAL,
-            CHANNEL,
-            SNAPSHOT_DATE
-        FROM
-            (
-                SELECT
-                    *
-                FROM
-                    channels_historic
-                UNION
-                ALL
-                SELECT
-                    load_date,
-                    UNIDAD_REGISTRAL,
-                    X_GOOGLE,
-                    Y_GOOGLE,
-                    CHANNEL
-                FROM
-                    latest_operations
-            ) AS outie
-        WHERE
-            SNAPSHOT_DATE = (
-                SELECT
-                    MAX(SNAPSHOT_DATE)
-                FROM
-                    channels_historic AS innie
-                WHERE
-                    innie.UNIDAD_REGISTRAL = outie.UNIDAD_REGISTRAL
-            )
-    ) ch ON m.ur_current = ch.UNIDAD_REGISTRAL
+    LEFT JOIN city_province_map r ON r.city = m.city
+    LEFT JOIN ur_channel_dim ch ON m.ur_current = ch.UNIDAD_REGISTRAL
     LEFT JOIN disaggregated_assets AS w ON m.ur_current = w.unidad_registral,
     lateral(
         SELECT
@@ -236,7 +162,6 @@ FROM
 WHERE
     m.updatedcategory != 'Exclusions'
     AND lat.category = 'Wholesale'
-    AND r.rank = 1
 GROUP BY
     ALL
 ORDER BY
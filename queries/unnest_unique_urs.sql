@@ -1,7 +1,7 @@
+-- Solo se calculan las ofertas de offers_to_refresh (ver offers_to_refresh.sql)
 with all_offers as (
-  select * from ws.hist_offers w1
-  union all
-  select * from ws.current_offers w2
+  select * exclude (year) from ws.ws_offers w
+  where w.unique_id in (select unique_id from offers_to_refresh)
 ),
 enriched_offers as (
   select  a.*,
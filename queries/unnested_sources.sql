@@ -0,0 +1,17 @@
+-- Huella de todas las columnas que lee unnest_unique_urs.sql, por UR y por oferta.
+-- La suma de los hash no depende del orden de las filas y cuenta las repetidas
+select 'master_tape' as source, ur_current as ur, null as offerid,
+       sum(hash(ur_current, updatedcategory, offerid, commitmentprice, commitmentdate,
+                saleprice, saledate, lsev_dec19, ppa, bucketi_ha, city,
+                direccion_territorial)) as row_hash
+from master_tape
+group by all
+union all by name
+select 'allocation_new' as source, ur, sum(hash(ur, lsev_dec19)) as row_hash
+from allocation_new
+group by all
+union all by name
+select 'offers' as source, offerid,
+       sum(hash(offerid, ur_current, commercialdev, jointdev, offerstatus)) as row_hash
+from offers
+group by all
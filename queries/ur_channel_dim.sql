@@ -0,0 +1,94 @@
+-- Dimension por UR con el ultimo canal, su fecha y las coordenadas mas frecuentes.
+-- Solo se leen las instantaneas (source, snapshot_date) de channels_historic y
+-- latest_operations que aun no estan en ur_channel_ingested. Las coordenadas se
+-- mantienen como conteos por valor (ur_x_counts, ur_y_counts) para sacar la moda.
+begin transaction;
+
+create table if not exists ur_channel_ingested as
+select 'channels_historic' as source, SNAPSHOT_DATE as snapshot_date
+from channels_historic
+limit 0;
+
+create or replace temp table ur_channel_new as
+select 'channels_historic' as source, SNAPSHOT_DATE, UNIDAD_REGISTRAL, X_GOOGLE, Y_GOOGLE, CHANNEL
+from channels_historic c
+where not exists (
+    select 1 from ur_channel_ingested i
+    where i.source = 'channels_historic' and i.snapshot_date is not distinct from c.SNAPSHOT_DATE
+)
+union all
+select 'latest_operations' as source, load_date, UNIDAD_REGISTRAL, X_GOOGLE, Y_GOOGLE, CHANNEL
+from latest_operations o
+where not exists (
+    select 1 from ur_channel_ingested i
+    where i.source = 'latest_operations' and i.snapshot_date is not distinct from o.load_date
+);
+
+create table if not exists ur_x_counts as
+select UNIDAD_REGISTRAL, X_GOOGLE, cast(0 as bigint) as n from channels_historic limit 0;
+create unique index if not exists ur_x_counts_key on ur_x_counts (UNIDAD_REGISTRAL, X_GOOGLE);
+
+create table if not exists ur_y_counts as
+select UNIDAD_REGISTRAL, Y_GOOGLE, cast(0 as bigint) as n from channels_historic limit 0;
+create unique index if not exists ur_y_counts_key on ur_y_counts (UNIDAD_REGISTRAL, Y_GOOGLE);
+
+-- Igual que el MODE anterior: solo cuentan las filas con X_GOOGLE informado
+insert into ur_x_counts
+select UNIDAD_REGISTRAL, X_GOOGLE, count(*)
+from ur_channel_new
+where UNIDAD_REGISTRAL is not null and X_GOOGLE is not null
+group by all
+on conflict (UNIDAD_REGISTRAL, X_GOOGLE) do update set n = n + excluded.n;
+
+insert into ur_y_counts
+select UNIDAD_REGISTRAL, Y_GOOGLE, count(*)
+from ur_channel_new
+where UNIDAD_REGISTRAL is not null and X_GOOGLE is not null and Y_GOOGLE is not null
+group by all
+on conflict (UNIDAD_REGISTRAL, Y_GOOGLE) do update set n = n + excluded.n;
+
+create table if not exists ur_channel_dim as
+select UNIDAD_REGISTRAL, CHANNEL, SNAPSHOT_DATE, X_GOOGLE, Y_GOOGLE
+from channels_historic
+limit 0;
+create unique index if not exists ur_channel_dim_key on ur_channel_dim (UNIDAD_REGISTRAL);
+
+insert into ur_channel_dim
+with latest as (
+    select
+        UNIDAD_REGISTRAL,
+        arg_max(CHANNEL, SNAPSHOT_DATE) as CHANNEL,
+        max(SNAPSHOT_DATE) as SNAPSHOT_DATE
+    from ur_channel_new
+    where UNIDAD_REGISTRAL is not null
+    group by 1
+),
+x_mode as (
+    select UNIDAD_REGISTRAL, arg_max(X_GOOGLE, n) as X_GOOGLE
+    from ur_x_counts
+    where UNIDAD_REGISTRAL in (select UNIDAD_REGISTRAL from latest)
+    group by 1
+),
+y_mode as (
+    select UNIDAD_REGISTRAL, arg_max(Y_GOOGLE, n) as Y_GOOGLE
+    from ur_y_counts
+    where UNIDAD_REGISTRAL in (select UNIDAD_REGISTRAL from latest)
+    group by 1
+)
+select l.UNIDAD_REGISTRAL, l.CHANNEL, l.SNAPSHOT_DATE, x.X_GOOGLE, y.Y_GOOGLE
+from latest l
+left join x_mode x on l.UNIDAD_REGISTRAL = x.UNIDAD_REGISTRAL
+left join y_mode y on l.UNIDAD_REGISTRAL = y.UNIDAD_REGISTRAL
+on conflict (UNIDAD_REGISTRAL) do update set
+    CHANNEL = case
+        when SNAPSHOT_DATE is null or excluded.SNAPSHOT_DATE >= SNAPSHOT_DATE then excluded.CHANNEL
+        else CHANNEL
+    end,
+    SNAPSHOT_DATE = greatest(SNAPSHOT_DATE, excluded.SNAPSHOT_DATE),
+    X_GOOGLE = excluded.X_GOOGLE,
+    Y_GOOGLE = excluded.Y_GOOGLE;
+
+insert into ur_channel_ingested
+select distinct source, SNAPSHOT_DATE from ur_channel_new;
+
+commit;
@@ -1,15 +1,6 @@
+-- Todas las ofertas del almacen particionado por anio (ws.ws_offers)
 with all_offers as (
-  select * from ws.ws_offers_2024
-  union all 
-  select * from ws.ws_offers_2023
-  union all 
-  select * from ws.ws_offers_2022
-  union all 
-  select * from ws.ws_offers_2021
-  union all 
-  select * from ws.ws_offers_2020
-  union all 
-  select * from ws.ws_offers_2019 
+  select * exclude (year) from ws.ws_offers
 )
 select coalesce(f.offer_id, nullif(regexp_extract(f.full_path, '5\d{6}'), '')::int, m.offerid) as offer_id, 
        f.unique_id,
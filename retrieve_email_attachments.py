@@ -4,95 +4,94 @@ import datetime
 import argparse
 import re
 import glob
-import win32com.client
+
+from conf.mailbox import INDEX_FILE, MAIL_BACKENDS, AttachmentIndex, get_backend
 
 console = Console()
 
-def retrieve_attachments(file_type: str, top_level_dir: str, number_of_months: int = 1):
-    # Conseguir todos los ficheros del directorio
-    # Listar todos los ficheros del directorio de destino, y filtrar contra los encontrados
+def retrieve_attachments(
+    file_type: str,
+    top_level_dir: str,
+    number_of_months: int = 1,
+    backend: str = "outlook",
+    maildir: Path | None = None,
+):
+    # Los ficheros ya guardados se identifican por el hash de su contenido (indice persistente)
+    # La carpeta de destino solo se recorre la primera vez, para crear el indice
     console.print(f"Checking existing {file_type} files...")
     match top_level_dir, file_type:
         case "coralhudson", "pipe":
             base_dir = Path("N:/CoralHudson/1. AM/8. Wholesale Channel/")
-            ficheros_existentes = [Path(f).name for f in glob.glob("N:/CoralHudson/1. AM/8. Wholesale Channel/WS PIPE*/[!~$]*.*")]
+            ficheros_existentes = lambda: glob.glob("N:/CoralHudson/1. AM/8. Wholesale Channel/WS PIPE*/[!~$]*.*")
+            subject_filter = "Pipe 20"
             subject_pattern = r"\d{6,8} Pipe 20"
             filename_pattern = r"^\d{6,8} Pipe 20"
         case "currentdir", "pipe":
             base_dir = Path("./_attachments/pipe_files/") 
-            ficheros_existentes = [f.name for f in base_dir.rglob("*.*")]
+            ficheros_existentes = lambda: [f for f in base_dir.rglob("*.*") if f.name != INDEX_FILE]
+            subject_filter = "Pipe 20"
             subject_pattern = r"\d{6,8} Pipe 20"
             filename_pattern = r"^\d{6,8} Pipe 20"
         case "coralhudson", "offers":
             base_dir = Path("N:/CoralHudson/1. AM/8. Wholesale Channel/Ofertas recibidas SVH/")
-            ficheros_existentes = [Path(f).name for f in glob.glob(base_dir.as_posix() + "/2023/**/[!~$]*.*")]
+            ficheros_existentes = lambda: glob.glob(base_dir.as_posix() + "/20[0-9][0-9]/**/[!~$]*.*", recursive=True)
+            subject_filter = "OF CH "
             subject_pattern = r"OF CH "
             filename_pattern = r"^\d{6,8}[_ ]+OF_"
         case "currentdir", "offers":
             base_dir = Path("./_attachments/offer_files/") 
-            ficheros_existentes = [f.name for f in base_dir.rglob("*.*")]
+            ficheros_existentes = lambda: [f for f in base_dir.rglob("*.*") if f.name != INDEX_FILE]
+            subject_filter = "OF CH "
             subject_pattern = r"OF CH "
             filename_pattern = r"^\d{6,8}[_ ]+OF_"
+    index = AttachmentIndex(base_dir, ficheros_existentes)
 
-    # Filtrado por fecha
+    # Filtrado por fecha y asunto en el propio buzon
     time_range = datetime.date.today() - datetime.timedelta(days = 30 * int(number_of_months))
     time_string = time_range.strftime("%m/%d/%Y")
     console.print(f"Buscando mensajes recibidos desdes el {time_string}")
     extensions = [".xlsx", ".xls", ".xlsb", ".xlsm"]
 
-    outlook = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI")
-    inbox = outlook.GetDefaultFolder(6)  # "6" refers to the inbox
-    sFilter = f"[ReceivedTime] >= '{time_string}'"
-    messages = inbox.Items.Restrict(sFilter)
-
-    if messages.count == 0:
-        print("No messages found.")
-        return
-
+    mailbox = get_backend(backend, maildir)
     message_count = 0
     duplicados = 0
     guardados = 0
-    for message in messages:
-        if re.search(subject_pattern.lower(), message.Subject.lower()):
+    for message in mailbox.messages(time_range, subject_filter):
+        if re.search(subject_pattern.lower(), message.subject.lower()):
             message_count += 1
-            received_time = message.ReceivedTime
+            received_time = message.received
             console.print(
                 f"[{message_count}] Found email:",
-                message.Subject,
+                message.subject,
                 "received on",
                 received_time,
             )
-            attachments = message.Attachments
-            for attachment in attachments:
+            for attachment in message.attachments():
                 if re.search(
-                    filename_pattern.lower(), attachment.FileName.lower()
-                ) and any(attachment.FileName.endswith(ext) for ext in extensions):
-                    # Filtrar aquellos que ya estan encontrados
-                    if attachment.FileName in ficheros_existentes:
-                        console.print("\tAttachment ignored. Already in folder.")
-                        duplicados += 1
-                    else:
-                        console.print("\tAttachment found:", attachment.FileName, style="bold red")
-                        guardados += 1
-                        # Get the email's received time and format it as a directory path
-                        year_folder = received_time.strftime("%Y")
-                        day_folder = received_time.strftime("%Y%m%d")
-
-                        match file_type:
-                            case "pipe":
-                                full_dir = base_dir / f"WS PIPE {year_folder}"
-                            case "offers":
-                                full_dir = base_dir / year_folder / day_folder
-
+                    filename_pattern.lower(), attachment.filename.lower()
+                ) and any(attachment.filename.endswith(ext) for ext in extensions):
+                    # Get the email's received time and format it as a directory path
+                    year_folder = received_time.strftime("%Y")
+                    day_folder = received_time.strftime("%Y%m%d")
 
-                        # Create the directory if it doesn't exist
-                        full_dir.mkdir(parents=True, exist_ok=True)
+                    match file_type:
+                        case "pipe":
+                            full_dir = base_dir / f"WS PIPE {year_folder}"
+                        case "offers":
+                            full_dir = base_dir / year_folder / day_folder
 
-                        # Save the attachment in the directory
-                        console.print(
-                            f"\tAttempting to save down to {(full_dir / attachment.FileName).absolute()}"
-                        )
-                        attachment.SaveASFile(str((full_dir / attachment.FileName).absolute()))
+                    # Se guarda solo si su contenido no esta ya en el indice
+                    saved = index.save_attachment(attachment, full_dir / attachment.filename)
+                    if saved is not None:
+                        console.print("\tAttachment found:", attachment.filename, style="bold red")
+                        console.print(f"\tSaved down to {saved.absolute()}")
+                        guardados += 1
+                    else:
+                        console.print("\tAttachment ignored. Already in folder.")
+                        duplicados += 1
+    if message_count == 0:
+        print("No messages found.")
+    index.save()
     console.print(f"Guardados {guardados} ficheros en el directorio base: {base_dir}.")
     console.print(f"Omitidos {duplicados} ficheros por ya encontrarse en la carpeta.")
 
@@ -118,10 +117,23 @@ if __name__ == "__main__":
         choices=["coralhudson", "currentdir"],
         help="Where to save down the files to.",
     )
+    parser.add_argument(
+        "--backend",
+        default="outlook",
+        choices=MAIL_BACKENDS,
+        help="Mailbox to read: the Outlook inbox or a folder of Maildir/.eml messages. Default: outlook",
+    )
+    parser.add_argument(
+        "--maildir",
+        type=Path,
+        help="Folder with the messages, for the maildir backend",
+    )
     args = parser.parse_args()
 
     retrieve_attachments(
         args.file_type,
         args.path,
-        args.months
+        args.months,
+        args.backend,
+        args.maildir,
     )
@@ -3,6 +3,7 @@ import subprocess
 import sys
 
 from conf.functions import timing
+from worker import submit
 
 
 def display_menu(input_dict):
@@ -44,14 +45,31 @@ def display_menu(input_dict):
         print("Invalid input, please enter a valid option.")
 
 
-@timing
-def blank_runner(script: str, other_params: list = None):
+def run_script(script: str, other_params: list = None):
     if other_params:
         return subprocess.run([sys.executable, script, *other_params])
     else:
         return subprocess.run([sys.executable, script])
 
 
+@timing
+def blank_runner(script: str, other_params: list = None):
+    return run_script(script, other_params)
+
+
+@timing
+def job_runner(job: str, job_kwargs: dict, script: str, other_params: list = None):
+    # Con el worker arrancado el trabajo se ejecuta alli; si no, en un proceso nuevo
+    if not submit(job, **job_kwargs):
+        return run_script(script, other_params)
+
+
+def start_worker():
+    flags = getattr(subprocess, "CREATE_NEW_CONSOLE", 0)
+    subprocess.Popen([sys.executable, "./worker.py"], creationflags=flags)
+    print("Worker started, the next options will run on it.")
+
+
 # Define the menus
 
 current_year = datetime.datetime.now().year
@@ -59,16 +77,20 @@ current_year = datetime.datetime.now().year
 ws_menu = {
     1: (
         "Obtener ofertas desde el email",
-        blank_runner,
+        job_runner,
         {
+            "job": "mail",
+            "job_kwargs": {"file_type": "offers", "top_level_dir": "coralhudson", "number_of_months": 1},
             "script": "./retrieve_email_attachments.py",
             "other_params": ["--file_type", "offers", "--months", "1"],
         },
     ),
     2: (
         "Obtener pipeline desde el email",
-        blank_runner,
+        job_runner,
         {
+            "job": "mail",
+            "job_kwargs": {"file_type": "pipe", "top_level_dir": "coralhudson", "number_of_months": 1},
             "script": "./retrieve_email_attachments.py",
             "other_params": ["--file_type", "pipe", "--months", "1"],
         },
@@ -78,8 +100,10 @@ ws_menu = {
         {
             1: (
                 f"Escanear todas las ofertas de {current_year} y crear fichero",
-                blank_runner,
+                job_runner,
                 {
+                    "job": "offers",
+                    "job_kwargs": {"update_offers": True, "write_file": True, "year_to_scrape": current_year},
                     "script": "./update_offers.py",
                     "other_params": [
                         "--update",
@@ -90,8 +114,15 @@ ws_menu = {
             ),
             2: (
                 f"Escanear sólo las nuevas ofertas de {current_year} y crear fichero",
-                blank_runner,
+                job_runner,
                 {
+                    "job": "offers",
+                    "job_kwargs": {
+                        "update_offers": True,
+                        "refresh_data": True,
+                        "write_file": True,
+                        "year_to_scrape": current_year,
+                    },
                     "script": "./update_offers.py",
                     "other_params": [
                         "--update",
@@ -103,20 +134,45 @@ ws_menu = {
             ),
             3: (
                 "Crear nuevo fichero",
-                blank_runner,
-                {"script": "./update_offers.py", "other_params": ["--write"]},
+                job_runner,
+                {
+                    "job": "offers",
+                    "job_kwargs": {"write_file": True},
+                    "script": "./update_offers.py",
+                    "other_params": ["--write"],
+                },
             ),
         },
     ),
     4: (
         "Crear / Actualizar fichero pipeline",
-        blank_runner,
-        {"script": "./update_pipe.py"},
+        job_runner,
+        {"job": "pipe", "job_kwargs": {}, "script": "./update_pipe.py"},
     ),
     5: (
         "Crear / Actualizar fichero stock",
-        blank_runner,
-        {"script": "./update_stock.py"},
+        job_runner,
+        {"job": "stock", "job_kwargs": {}, "script": "./update_stock.py"},
+    ),
+    6: (
+        "Sincronizar tablas desde la carpeta Parquet",
+        job_runner,
+        {"job": "sync", "job_kwargs": {}, "script": "./sync_parquet.py"},
+    ),
+    7: (
+        "Construir todos los ficheros (solo lo que ha cambiado)",
+        job_runner,
+        {
+            "job": "build",
+            "job_kwargs": {"year": current_year},
+            "script": "./build.py",
+            "other_params": [f"--year={current_year}"],
+        },
+    ),
+    8: (
+        "Arrancar el worker en segundo plano",
+        start_worker,
+        {},
     ),
 }
 
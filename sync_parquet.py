@@ -0,0 +1,48 @@
+import argparse
+
+from rich.console import Console
+from rich.table import Table
+
+from conf.parquet_sync import sync_parquet
+from conf.settings import DIR_PARQUET, offersconf
+
+console = Console()
+
+
+def main(tables: list[str] | None = None, force: bool = False):
+    results = sync_parquet(DIR_PARQUET, offersconf.db_file, tables, force)
+    if not results:
+        console.print(f"No Parquet files found in {DIR_PARQUET}")
+        return
+
+    summary = Table(title="Parquet sync")
+    summary.add_column("Table")
+    summary.add_column("Action")
+    summary.add_column("Rows", justify="right")
+    summary.add_column("Seconds", justify="right")
+    for result in results:
+        summary.add_row(
+            result.table_name,
+            result.action,
+            "" if result.num_rows is None else f"{result.num_rows:,}",
+            f"{result.seconds:.2f}",
+        )
+    console.print(summary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        default=None,
+        help="Only sync these tables (Parquet file names without extension)",
+    )
+    parser.add_argument(
+        "--force",
+        default=False,
+        action="store_true",
+        help="Reload the tables even if their Parquet files did not change",
+    )
+    args = parser.parse_args()
+    main(tables=args.tables, force=args.force)
@@ -0,0 +1,93 @@
+from pathlib import Path
+
+import duckdb
+import pytest
+
+import update_offers
+from update_offers import conf, enrich_offers
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+
+# Columnas de tmp_enrich_df que pide enrich_offers, mas una nota editable
+INPUT_QUERY = """
+    select unique_id, offer_id, updated_at, note, offer_date,
+           array_to_string(unique_urs, '-') as unique_urs,
+           array_to_string(commercialdev, '-') as commercialdev,
+           array_to_string(jointdev, '-') as jointdev
+    from ws.ws_offers
+"""
+
+
+@pytest.fixture
+def offers_db(tmp_path, monkeypatch):
+    # Las consultas se leen con rutas relativas a la raiz del repositorio
+    monkeypatch.chdir(REPO_DIR)
+    db_file = tmp_path / "offers.db"
+    monkeypatch.setattr(conf, "db_file", db_file.as_posix())
+    monkeypatch.setattr(conf, "db_schema", "ws")
+    monkeypatch.setattr(update_offers.console, "quiet", True)
+    with duckdb.connect(db_file.as_posix()) as db:
+        db.execute("create schema ws")
+        db.execute(
+            """create table ws.ws_offers as
+               select 'u' || range as unique_id, 5000000 + range as offer_id,
+                      timestamp '2024-01-01' as updated_at, 'nota' as note,
+                      date '2024-01-01' + range::int as offer_date,
+                      [range + 1] as unique_urs, [1] as commercialdev, [2] as jointdev,
+                      2024::smallint as year
+               from range(4)"""
+        )
+        db.execute(
+            """create table master_tape as
+               select (range + 1)::bigint as ur_current, 'Sold Assets' as updatedcategory,
+                      5000000 + range as offerid, 1.0 as commitmentprice,
+                      current_date as commitmentdate, 2.0 as saleprice,
+                      current_date as saledate, 1.0 as lsev_dec19, 1.0 as ppa,
+                      'a' as bucketi_ha, 'c' as city, 'd' as direccion_territorial
+               from range(4)"""
+        )
+        db.execute(
+            """create table offers as
+               select 5000000 + range as offerid, (range + 1)::bigint as ur_current,
+                      1 as commercialdev, 2 as jointdev, 'x' as offerstatus
+               from range(4)"""
+        )
+        db.execute(
+            "create table allocation_new as select (range + 1)::bigint as ur, 1.0 as lsev_dec19 from range(4)"
+        )
+    return db_file
+
+
+def rebuilt_from_scratch(db_file: Path) -> list:
+    with duckdb.connect(db_file.as_posix()) as db:
+        for table in (
+            "offers_enriched_table",
+            "enrich_source_snapshot",
+            "unnested_data",
+            "unnested_state",
+            "unnested_source_snapshot",
+        ):
+            db.execute(f"drop table if exists {table}")
+    return sorted(enrich_offers(INPUT_QUERY).to_pylist(), key=str)
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        # Cambia el origen del enriquecido sin tocar updated_at
+        "update ws.ws_offers set note = 'editada' where unique_id = 'u1'",
+        "update master_tape set commitmentprice = 9, updatedcategory = 'Sale Agreed' where ur_current = 3",
+        "delete from ws.ws_offers where unique_id = 'u2'",
+        """insert into ws.ws_offers
+           select 'u9', 5000009, timestamp '2024-02-01', 'nueva', date '2024-02-01',
+                  [1, 4], [1], [2], 2024::smallint""",
+    ],
+)
+def test_incremental_enrichment_matches_a_full_rebuild(offers_db, change):
+    enrich_offers(INPUT_QUERY)
+    with duckdb.connect(offers_db.as_posix()) as db:
+        db.execute(change)
+
+    incremental = sorted(enrich_offers(INPUT_QUERY).to_pylist(), key=str)
+
+    assert incremental == rebuilt_from_scratch(offers_db)
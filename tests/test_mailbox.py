@@ -0,0 +1,107 @@
+import datetime
+import time
+from email.message import EmailMessage
+from email.utils import format_datetime
+from pathlib import Path
+
+import pytest
+
+from conf.mailbox import INDEX_FILE, AttachmentIndex, MaildirBackend, OutlookBackend
+
+XLSX_TYPE = ("application", "vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+
+def write_eml(
+    path: Path, subject: str, received: datetime.datetime, attachments: dict[str, bytes]
+):
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["Date"] = format_datetime(received)
+    message.set_content("Adjunto la oferta.")
+    for filename, content in attachments.items():
+        message.add_attachment(
+            content, maintype=XLSX_TYPE[0], subtype=XLSX_TYPE[1], filename=filename
+        )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(message.as_bytes())
+
+
+def test_maildir_filters_by_subject_and_date(tmp_path):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    write_eml(tmp_path / "a.eml", "RE: OF CH 5001234", now, {"20240105_OF_1.xlsx": b"one"})
+    write_eml(tmp_path / "b.eml", "Otro asunto", now, {"x.xlsx": b"two"})
+    write_eml(
+        tmp_path / "cur" / "c", "OF CH antigua", now - datetime.timedelta(days=90), {}
+    )
+    write_eml(tmp_path / "new" / "d", "of ch nueva", now, {})
+
+    since = (now - datetime.timedelta(days=30)).date()
+    messages = list(MaildirBackend(tmp_path).messages(since, "OF CH"))
+
+    assert sorted(m.subject for m in messages) == ["RE: OF CH 5001234", "of ch nueva"]
+    attachments = next(m for m in messages if "5001234" in m.subject).attachments()
+    assert [a.filename for a in attachments] == ["20240105_OF_1.xlsx"]
+    attachments[0].save(tmp_path / "saved.xlsx")
+    assert (tmp_path / "saved.xlsx").read_bytes() == b"one"
+
+
+def test_attachment_index_skips_duplicates_and_never_overwrites(tmp_path):
+    mail_dir = tmp_path / "mail"
+    now = datetime.datetime.now(datetime.timezone.utc)
+    write_eml(mail_dir / "1.eml", "OF CH 1", now, {"oferta.xlsx": b"first"})
+    write_eml(mail_dir / "2.eml", "OF CH 2", now, {"oferta.xlsx": b"first"})
+    write_eml(mail_dir / "3.eml", "OF CH 3", now, {"oferta.xlsx": b"second"})
+    attachments = [
+        m.attachments()[0]
+        for m in MaildirBackend(mail_dir).messages(now.date(), "OF CH")
+    ]
+
+    base_dir = tmp_path / "offers"
+    base_dir.mkdir()
+    index = AttachmentIndex(base_dir, lambda: [])
+    target = base_dir / "2024" / "oferta.xlsx"
+
+    assert index.save_attachment(attachments[0], target) == target
+    # Mismo contenido con otro correo: no se guarda otra vez
+    assert index.save_attachment(attachments[1], target) is None
+    # Mismo nombre y otro contenido: se guarda al lado, sin pisar el primero
+    saved = index.save_attachment(attachments[2], target)
+    assert saved is not None and saved != target
+    assert target.read_bytes() == b"first"
+    assert saved.read_bytes() == b"second"
+    assert sorted(index.hashes.values()) == sorted([target.as_posix(), saved.as_posix()])
+
+    # El indice guardado se vuelve a cargar sin recalcular nada
+    index.save()
+    reloaded = AttachmentIndex(base_dir, lambda: [])
+    assert reloaded.hashes == index.hashes
+    assert reloaded.save_attachment(attachments[2], target) is None
+
+
+def test_attachment_index_is_seeded_from_existing_files(tmp_path):
+    existing = tmp_path / "oferta.xlsx"
+    existing.write_bytes(b"first")
+    index = AttachmentIndex(tmp_path, lambda: [existing])
+    assert (tmp_path / INDEX_FILE).exists()
+
+    mail_dir = tmp_path / "mail"
+    now = datetime.datetime.now(datetime.timezone.utc)
+    write_eml(mail_dir / "1.eml", "OF CH 1", now, {"otro_nombre.xlsx": b"first"})
+    [message] = MaildirBackend(mail_dir).messages(now.date(), "OF CH")
+    assert index.save_attachment(message.attachments()[0], tmp_path / "otro.xlsx") is None
+
+
+@pytest.mark.skipif(not hasattr(time, "tzset"), reason="needs time.tzset")
+def test_outlook_filter_date_is_local_midnight_in_utc(monkeypatch):
+    monkeypatch.setenv("TZ", "Europe/Madrid")
+    time.tzset()
+    try:
+        winter = OutlookBackend.dasl_filter(datetime.date(2024, 1, 15), "OF CH")
+        summer = OutlookBackend.dasl_filter(datetime.date(2024, 7, 15), "O'F")
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    assert "datereceived\" >= '01/14/2024 11:00 PM'" in winter
+    assert "datereceived\" >= '07/14/2024 10:00 PM'" in summer
+    assert "LIKE '%O''F%'" in summer
+
@@ -0,0 +1,36 @@
+import openpyxl
+
+from conf.readers import open_workbook, sheet_rows, sheet_values
+
+
+def write_sap_workbook(path):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "SAP"
+    sheet.append(["UR", "PROMOCION", "TIPO", "SUPERFICIE"])
+    sheet.append(["00001234", "00042", "Suelo", 120.5])
+    # Filas en blanco en medio de la tabla y una fila mas corta que las demas
+    sheet.append([])
+    sheet.append([])
+    sheet.append(["00001235", "00042"])
+    sheet.cell(row=8, column=2, value="Total")
+    workbook.save(path)
+
+
+def test_stream_and_full_readers_return_the_same_rows(tmp_path):
+    path = tmp_path / "oferta.xlsx"
+    write_sap_workbook(path)
+
+    rows = {}
+    values = {}
+    for reader in ("stream", "full"):
+        workbook = open_workbook(path, reader)
+        rows[reader] = sheet_rows(workbook["SAP"])
+        values[reader] = sheet_values(workbook["SAP"])
+        workbook.close()
+
+    assert rows["stream"] == rows["full"]
+    assert values["stream"] == values["full"]
+    assert all(isinstance(row, tuple) and len(row) == 4 for row in rows["stream"])
+    assert rows["stream"][2] == (None, None, None, None)
+    assert rows["stream"][4] == ("00001235", "00042", None, None)
@@ -2,36 +2,64 @@ import argparse
 import datetime
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import duckdb
-import openpyxl
 import pandas as pd
-import pendulum as pdl
-from openpyxl.utils import get_column_letter
-from openpyxl.utils.dataframe import dataframe_to_rows
+import pyarrow as pa
 from rich.console import Console
 
 from conf.functions import (
-    apply_styles,
+    LabelMatcher,
     create_ddb_table,
     create_style,
     find_files_included,
     load_json_config,
     write_offers,
 )
-from conf.settings import cell_address_file
+from conf.manifest import config_fingerprint, plan_extraction, save_manifest
+from conf.offers_store import OFFERS_TABLE, ensure_offers_store, partition_key
+from conf.query_cache import (
+    bump_table_version,
+    query_fingerprint,
+    set_table_version,
+    table_version,
+)
+from conf.readers import (
+    READER_BACKENDS,
+    open_workbook,
+    sheet_has_images,
+    sheet_rows,
+    sheet_values,
+)
+from conf.settings import DEFAULT_WORKERS, READER_BACKEND, cell_address_file
 from conf.settings import offersconf as conf
 from conf.settings import sap_mapping_file, styles_file
+from conf.tracing import record_span, span, timed_call, trace_run
 
 # Instanciar la consola bonita
 console = Console()
 
-# Instanciar las variables de ficheros, carpetas y otros
-stylesheet = create_style(styles_file)
+
+def failed_read(file: str, error: Exception) -> dict:
+    """
+    Builds the record stored for a file that could not be opened.
+    """
+    data = {}
+    data["read_status"] = "Fail"
+    data["read_details"] = str(error)
+    data["full_path"] = Path(file).as_posix()
+    data["file_name"] = os.path.basename(file)
+    return data
 
 
-def extract_cell_values(file: str, search_strings: dict, columns_dict: dict):
+def extract_cell_values(
+    file: str,
+    search_strings: dict | LabelMatcher,
+    columns_dict: dict,
+    reader: str = READER_BACKEND,
+):
     """
     Opens an Excel file and converts the worksheet to a dictionary. It then looks for
     specific strings, moves to the relative cell addresses based on both x and y offsets,
@@ -40,17 +68,30 @@ def extract_cell_values(file: str, search_strings: dict, columns_dict: dict):
     Includes the file name in the returned data.
     """
     try:
-        workbook = openpyxl.load_workbook(file, data_only=True)
+        workbook = open_workbook(file, reader)
     except Exception as e:
         console.print(f"Error when loading file {file}. Details: {e}")
-        data = {}
-        data["read_status"] = "Fail"
-        data["read_details"] = str(e)
-        data["full_path"] = Path(file).as_posix()
-        data["file_name"] = os.path.basename(file)
-        return data
+        return failed_read(file, e)
+
+    try:
+        return read_offer_workbook(workbook, file, search_strings, columns_dict)
+    finally:
+        # En modo lectura el fichero queda abierto hasta cerrarlo
+        workbook.close()
 
-    data = {label: None for label in search_strings.keys()}
+
+def read_offer_workbook(
+    workbook, file: str, search_strings: dict | LabelMatcher, columns_dict: dict
+):
+    """
+    Extracts the FICHA labels and the SAP/Oferta table columns from an open workbook.
+    """
+    matcher = (
+        search_strings
+        if isinstance(search_strings, LabelMatcher)
+        else LabelMatcher.from_config(search_strings)
+    )
+    data = {label: None for label in matcher.labels}
     data["full_path"] = os.path.abspath(file)
     data["file_name"] = os.path.basename(file)
 
@@ -70,33 +111,9 @@ def extract_cell_values(file: str, search_strings: dict, columns_dict: dict):
         return data
 
     # Convert the worksheet to a dictionary for faster searching
-    sheet_dict = {
-        (cell.row, cell.column): cell.value
-        for row in sheet.iter_rows()
-        for cell in row
-        if cell.value is not None
-    }
+    sheet_dict = sheet_values(sheet)
 
-    for (cell_row, cell_col), cell_value in sheet_dict.items():
-        for label, [regex, offset_y, offset_x] in search_strings.items():
-            if re.match(
-                regex, str(cell_value), re.IGNORECASE
-            ):  # compare values using the regular expression
-                try:
-                    target_cell_address = (
-                        cell_row - offset_y,
-                        cell_col + offset_x,
-                    )
-                    target_cell_value = sheet_dict.get(target_cell_address)
-                    if target_cell_value is not None:
-                        data[label] = target_cell_value
-                        break
-                except IndexError:
-                    continue
-                else:
-                    break
-            else:
-                continue
+    data.update(matcher.scan(sheet_dict))
 
     # Load the JSON file for table columns and process table columns if specified
     if columns_dict:
@@ -104,19 +121,17 @@ def extract_cell_values(file: str, search_strings: dict, columns_dict: dict):
         posibles_hojas = list(filter(regex.search, workbook.sheetnames))
         hojas_sin_imagenes = []
         for sh in posibles_hojas:
-            if not workbook[sh]._images:
+            if not sheet_has_images(workbook, sh):
                 hojas_sin_imagenes.append(sh)
         try:
             hoja_detalle = hojas_sin_imagenes[0]
         except IndexError:
             hoja_detalle = posibles_hojas[0]
         try:
-            table_sheet = workbook[hoja_detalle]
+            # Read the table once; the first row contains the headers
+            table_rows = sheet_rows(workbook[hoja_detalle])
+            header_row = table_rows[0] if table_rows else ()
             for col in columns_dict:
-                # Assume the first row contains headers
-                header_row = next(
-                    table_sheet.iter_rows(min_row=1, max_row=1, values_only=True)
-                )
                 # Get index of the target column based on header
                 try:
                     col_idx = header_row.index(col)
@@ -130,7 +145,7 @@ def extract_cell_values(file: str, search_strings: dict, columns_dict: dict):
                     cell[col_idx]
                     if not isinstance(cell[col_idx], str) or not cell[col_idx].isdigit()
                     else int(cell[col_idx].lstrip("0"))
-                    for cell in table_sheet.iter_rows(min_row=2, values_only=True)
+                    for cell in table_rows[1:]
                 ]
                 # Remove duplicates by converting to a set, after filtering out the null values
                 unique_values = set(filter(None, column_values))
@@ -161,6 +176,9 @@ def extract_cell_values(file: str, search_strings: dict, columns_dict: dict):
         if data["offer_date"] is not None and not isinstance(
             data["offer_date"], datetime.datetime
         ):
+            # pendulum solo se carga cuando hay una fecha en texto que interpretar
+            import pendulum as pdl
+
             try:
                 data["offer_date"] = pdl.parse(
                     data["offer_date"], strict=False
@@ -174,43 +192,202 @@ def extract_cell_values(file: str, search_strings: dict, columns_dict: dict):
     return data
 
 
+def extract_files(
+    files: list[str],
+    search_strings: dict | LabelMatcher,
+    columns_dict: dict,
+    workers: int = 1,
+    status=None,
+    reader: str = READER_BACKEND,
+) -> list[dict]:
+    """
+    Runs extract_cell_values over every file, using a pool of processes when
+    workers > 1. Results are returned in the same order as the input files.
+    """
+    files_count = len(files)
+    if workers <= 1 or files_count <= 1:
+        data = []
+        for idx, file in enumerate(files, start=1):
+            if status is not None:
+                status.update(
+                    f"[{idx}/{files_count}] ~ Loading data from file: [bold green]{file}[/bold green]"
+                )
+            with span("extract_file", detail=file, files=1):
+                data.append(
+                    extract_cell_values(file, search_strings, columns_dict, reader)
+                )
+        return data
+
+    data = [None] * files_count
+    with ProcessPoolExecutor(max_workers=min(workers, files_count)) as pool:
+        futures = {
+            pool.submit(
+                timed_call,
+                extract_cell_values,
+                file,
+                search_strings,
+                columns_dict,
+                reader,
+            ): pos
+            for pos, file in enumerate(files)
+        }
+        for idx, future in enumerate(as_completed(futures), start=1):
+            pos = futures[future]
+            file = files[pos]
+            try:
+                data[pos], seconds = future.result()
+                # El tiempo se mide en el proceso hijo, el span se anota aqui
+                record_span("extract_file", seconds, detail=file, files=1)
+            except Exception as e:
+                # Un fallo en el proceso hijo se registra igual que un fichero ilegible
+                console.print(f"Error when loading file {file}. Details: {e}")
+                data[pos] = failed_read(file, e)
+            if status is not None:
+                status.update(
+                    f"[{idx}/{files_count}] ~ Loaded data from file: [bold green]{file}[/bold green]"
+                )
+    return data
+
+
 def load_previous_data(
     sheet: str = conf.sheet_name, start_row: int = conf.header_start
-) -> pd.DataFrame | bool:
+) -> pd.DataFrame | None:
     latest_file_name_pattern = conf.output_file
     matching_files = []
     for f in Path(conf.output_dir).glob("*.*"):
         if re.search(latest_file_name_pattern, f.name):
             matching_files.append(f)
 
-    sorted_files = sorted([f for f in matching_files], key=os.path.getmtime)
-    previous_file = sorted_files[-1]
-    if os.path.isfile(previous_file):
-        return pd.read_excel(
-            previous_file, sheet_name=sheet, skiprows=start_row - 1
-        )  # load the existing data
+    if not matching_files:
+        # return None for the case where no previous data exists
+        return None
+    previous_file = max(matching_files, key=os.path.getmtime)
+    return pd.read_excel(
+        previous_file, sheet_name=sheet, skiprows=start_row - 1
+    )  # load the existing data
+
+
+# Claves de todas las ofertas, para borrar las que ya no existen
+ALL_OFFER_KEYS = f"select unique_id from {conf.db_schema}.{OFFERS_TABLE}"
+
+# Tablas que escribe refresh_unnested_data: no cuentan como entradas de la consulta
+UNNESTED_TABLES = {
+    "unnested_data",
+    "unnested_state",
+    "unnested_source_snapshot",
+    "unnested_sources",
+    "offers_to_refresh",
+}
+
+
+def read_query(query_file: str) -> str:
+    with open(query_file, encoding="utf8") as sql_file:
+        return sql_file.read().strip().rstrip(";")
+
+
+def table_exists(db, table_name: str, schema: str = "main") -> bool:
+    return bool(
+        db.execute(
+            "select count(*) from duckdb_tables() where schema_name = ? and table_name = ?",
+            [schema, table_name],
+        ).fetchone()[0]
+    )
+
+
+def refresh_unnested_data(db) -> int:
+    """
+    Keeps unnested_data up to date, keyed by unique_id. Only the offers listed by
+    offers_to_refresh.sql (new, with a different updated_at, or whose rows in
+    master_tape, allocation_new or offers changed since the last run, compared by a
+    hash of every column the query reads) are recomputed and removed offers are deleted.
+    Leaves the offers_to_refresh temp table behind and returns how many offers it holds.
+    When none of the input tables changed since the last run nothing is recomputed.
+    """
+    db.execute(
+        "create table if not exists unnested_state (unique_id varchar primary key, updated_at timestamp)"
+    )
+    unnested_exists = table_exists(db, "unnested_data")
+    refresh_query = read_query("./queries/offers_to_refresh.sql")
+    query = read_query("./queries/unnest_unique_urs.sql")
+    # Version de las entradas; las tablas de estado las mantiene esta misma funcion
+    inputs_version = query_fingerprint(
+        db, f"{refresh_query}\n{query}", exclude=UNNESTED_TABLES
+    )
+    if (
+        unnested_exists
+        and inputs_version is not None
+        and table_version(db, "main", "unnested_data") == inputs_version
+    ):
+        db.execute(
+            "create or replace temp table offers_to_refresh as select unique_id from unnested_state limit 0"
+        )
+        return 0
+
+    db.execute(
+        f"create or replace temp table unnested_sources as {read_query('./queries/unnested_sources.sql')}"
+    )
+    # La huella anterior solo guardaba categoria y oferta: se sustituye por la nueva
+    db.execute("drop table if exists unnested_ur_snapshot")
+    db.execute(
+        "create table if not exists unnested_source_snapshot as select * from unnested_sources limit 0"
+    )
+
+    db.execute("begin transaction")
+    if not unnested_exists:
+        # Sin tabla previa el estado no sirve: se calculan todas las ofertas
+        db.execute("delete from unnested_state")
+    db.execute(f"create or replace temp table offers_to_refresh as {refresh_query}")
+    to_refresh = db.execute("select count(*) from offers_to_refresh").fetchone()[0]
+
+    if not unnested_exists:
+        db.execute(f"create table unnested_data as {query}")
     else:
-        # return False for the case where no previous data exists
-        return False
+        db.execute(
+            f"""delete from unnested_data
+                where unique_id in (select unique_id from offers_to_refresh)
+                   or unique_id not in ({ALL_OFFER_KEYS})"""
+        )
+        if to_refresh:
+            db.execute(f"insert into unnested_data by name {query}")
 
+    db.execute(
+        f"""delete from unnested_state
+            where unique_id in (select unique_id from offers_to_refresh)
+               or unique_id not in ({ALL_OFFER_KEYS})"""
+    )
+    db.execute(
+        f"""insert into unnested_state
+            select unique_id, max(updated_at)
+            from {conf.db_schema}.{OFFERS_TABLE}
+            where unique_id in (select unique_id from offers_to_refresh)
+            group by unique_id"""
+    )
+    db.execute(
+        "create or replace table unnested_source_snapshot as select * from unnested_sources"
+    )
+    if inputs_version is not None:
+        set_table_version(db, "main", "unnested_data", inputs_version)
+    else:
+        bump_table_version(db, "main", "unnested_data")
+    db.execute("commit")
+    return to_refresh
 
-def enrich_offers(input_query: str, reuse_latest_file: bool = False):
-    console.print("Getting data from portfolio management...")
-    with open("./queries/unnest_unique_urs.sql", encoding="utf8") as sql_file:
-        query = sql_file.read()
-        improved_query = f"CREATE TEMP TABLE unnested_data AS {query}"
 
+def enrich_offers(input_query: str, reuse_latest_file: bool = False) -> pa.Table:
+    console.print("Getting data from portfolio management...")
+    ensure_offers_store(conf.db_file, conf.db_schema)
     with duckdb.connect(conf.db_file) as db:
         # Ingest previous data
         db.execute("""set global pandas_analyze_sample=10000""")
-        db.execute(improved_query)
+        refreshed = refresh_unnested_data(db)
+        console.print(f"{refreshed} offer(s) recomputed in unnested_data.")
 
         if reuse_latest_file:
             console.print(
                 "Opening latest offers file and retrieving additional columns..."
             )
             previous_data = load_previous_data(conf.sheet_name)
-            if previous_data:
+            if previous_data is not None:
                 db.register("tmp_enrich_df", previous_data)
                 excluded_columns_from_origin = [
                     "unique_urs",
@@ -235,145 +412,238 @@ def enrich_offers(input_query: str, reuse_latest_file: bool = False):
                 "offer_id",
             ]
 
-        # Create enriched table, for later usage
-        db.execute(
-            f"""
-            create or replace table offers_enriched_table as (
+        def enriched_query(row_filter: str = "") -> str:
+            return f"""
             with all_data as (
-            select  t.* exclude({",".join(excluded_columns_from_origin) if len(excluded_columns_from_origin) > 1 else excluded_columns_from_origin.pop()}),
+            select  t.* exclude({",".join(excluded_columns_from_origin)}),
                     u.* exclude(unique_id)
             from tmp_enrich_df t
             left join unnested_data u
             on t.unique_id = u.unique_id
+            {row_filter}
             ),
             filtered_columns as (
             select columns(x -> x not similar to '.+:1')
             from all_data)
-            select * from filtered_columns);
+            select * from filtered_columns
+            """
+
+        # Huella de cada fila de tmp_enrich_df: las filas cuyo origen cambia se reescriben
+        # aunque su oferta no se haya recalculado en unnested_data
+        db.execute(
+            """create or replace temp table enrich_sources as
+               select unique_id, sum(hash(t)) as row_hash
+               from tmp_enrich_df t
+               group by unique_id"""
+        )
+
+        # Update the enriched table, for later usage: only the recomputed offers, the
+        # rows whose source changed and the rows missing from it are rewritten
+        full_rebuild = not table_exists(db, "offers_enriched_table") or not table_exists(
+            db, "enrich_source_snapshot"
+        )
+        if not full_rebuild:
+            row_filter = """
+            where t.unique_id in (select unique_id from offers_to_refresh)
+               or t.unique_id not in (select unique_id from offers_enriched_table)
+               or t.unique_id in (
+                 select n.unique_id
+                 from enrich_sources n
+                 left join enrich_source_snapshot s
+                   on n.unique_id = s.unique_id
+                 where s.row_hash is distinct from n.row_hash
+               )
             """
+            db.execute(
+                f"create or replace temp table enriched_refresh as {enriched_query(row_filter)}"
+            )
+            # A different set of columns (e.g. reusing the latest file) needs a rebuild
+            full_rebuild = (
+                db.sql("select * from enriched_refresh").columns
+                != db.sql("select * from offers_enriched_table").columns
+            )
+
+        db.execute("begin transaction")
+        if full_rebuild:
+            db.execute(
+                f"create or replace table offers_enriched_table as ({enriched_query()})"
+            )
+        else:
+            db.execute(
+                """delete from offers_enriched_table
+                   where unique_id in (select unique_id from enriched_refresh)
+                      or unique_id not in (select unique_id from tmp_enrich_df)"""
+            )
+            db.execute(
+                "insert into offers_enriched_table by name select * from enriched_refresh"
+            )
+        db.execute(
+            "create or replace table enrich_source_snapshot as select * from enrich_sources"
         )
+        db.execute("commit")
 
-        expanded_df = db.execute(
+        expanded = db.sql(
             """select unique_id, offer_id, * exclude(unique_id, offer_id) from offers_enriched_table order by offer_date desc"""
-        ).df()
+        ).to_arrow_table()
 
-    return expanded_df
+    return expanded
 
 
-def write_output(
-    output_file: Path,
-    data: dict[str, pd.DataFrame],
-    style_specs: dict,
-    style_ranges: dict,
-    start_row: int,
-    title: str,
-    **kwargs,
-):
+def update_offer_table(
+    year_to_scrape: int,
+    refresh_data: bool = False,
+    rebuild: bool = False,
+    workers: int = DEFAULT_WORKERS,
+    reader: str = READER_BACKEND,
+) -> bool:
     """
-    Writes the data to an output Excel workbook.
+    Scans the offer folders of a year and loads the new or changed files into its
+    partition of the ws_offers store. Returns False when the run has to be aborted.
     """
-    workbook = openpyxl.Workbook()
-    # Remove the default sheet created and add new sheets as per data keys
-    default_sheet = workbook.active
-    workbook.remove(default_sheet)
-    for sheet_name, dataframe in data.items():
-        sheet = workbook.create_sheet(sheet_name)
-        total_rows, total_columns = dataframe.shape
-        last_column_as_letter = get_column_letter(total_columns)
-
-        # Writing workbook creation date, title and description
-        sheet.cell(column=1, row=1, value=title)
-        sheet.cell(column=1, row=2, value="Created on:")
-        sheet.cell(column=2, row=2, value=datetime.datetime.now())
-        sheet.cell(column=1, row=3, value="Created by:")
-        sheet.cell(column=2, row=3, value=os.environ.get("USERNAME"))
-        sheet.cell(
-            column=1,
-            row=(start_row - 1),
-            value=f"=COUNTA(A{start_row + 1}:A{start_row + total_rows})",
+    if refresh_data and rebuild:
+        # Con --refresh solo se ven los ficheros nuevos: reconstruir borraria del
+        # manifiesto todos los demas
+        console.print(
+            "--rebuild reads every file again and cannot be combined with --refresh. Aborting..."
         )
+        return False
 
-        # Writing data from dataframe to sheet starting from start_row
-        for i, row in enumerate(
-            dataframe_to_rows(dataframe, index=False, header=True), 1
-        ):
-            for j, cell in enumerate(row, 1):
-                cell = str(tuple(cell)) if isinstance(cell, list) else cell
-                sheet.cell(row=i + start_row - 1, column=j, value=cell)
-
-        autofit_check = kwargs.get("autofit", True)
-        apply_styles(sheet, style_specs, style_ranges, autofit_check)
-        filters = sheet.auto_filter
-        filters.ref = f"A{start_row}:{last_column_as_letter}{total_rows}"
-        sheet.freeze_panes = f"B{start_row + 1}"
+    # Create the output directory if not exists
+    console.print(f"Creating path to files: {conf.output_dir}")
+    Path(conf.output_dir).mkdir(exist_ok=True)
 
-    console.print("Saving output file")
-    workbook.save(output_file)
-    console.print(f"File saved in: {output_file}")
+    year_to_scrape = int(year_to_scrape)
+    manifest_key = partition_key(year_to_scrape)
+    ensure_offers_store(conf.db_file, conf.db_schema)
 
+    # Extract the workbooks information one by one, then append the dictionary records to a 'data' variable
+    cell_addresses = LabelMatcher.from_config(load_json_config(cell_address_file))
+    sap_columns_mapping = load_json_config(sap_mapping_file)
+    result_version = config_fingerprint(cell_address_file, sap_mapping_file)
 
-def main(
-    update_offers: bool = False,
-    write_file: bool = False,
-    refresh_data: bool = False,
-    year_to_scrape: int = datetime.datetime.now().year,
-):
-    if update_offers:
-        # Create the output directory if not exists
-        console.print(f"Creating path to files: {conf.output_dir}")
-        Path(conf.output_dir).mkdir(exist_ok=True)
-
-        table_name_to_use = "ws_offers_"
-        ddb_table_name = table_name_to_use + str(year_to_scrape)
-
-        # Extract the workbooks information one by one, then append the dictionary records to a 'data' variable
-        cell_addresses = load_json_config(cell_address_file)
-        sap_columns_mapping = load_json_config(sap_mapping_file)
-
-        folder_pattern = rf"{year_to_scrape}"
+    folder_pattern = rf"{year_to_scrape}"
+    with span("discovery") as discovery:
         files, total_files = find_files_included(
             conf.directory, folder_pattern, conf.db_file, only_new_files=refresh_data
         )
-        files_count = len(files)
-        if files_count == 0:
-            console.print("No files (new or old) found. Aborting...")
-            return
+        discovery.files = total_files
+    files_count = len(files)
+    if files_count == 0:
+        console.print("No files (new or old) found. Aborting...")
+        return False
 
-        if files_count == total_files:
-            console.print(
-                "The source files are the same, rerun the script without --refresh."
+    if refresh_data and files_count == total_files:
+        console.print(
+            "The source files are the same, rerun the script without --refresh."
+        )
+        return False
+
+    with span("manifest", files=files_count):
+        with console.status("Comparing files against the manifest..."):
+            plan = plan_extraction(
+                conf.db_file,
+                conf.db_schema,
+                manifest_key,
+                files,
+                result_version,
+                rebuild=rebuild,
+                detect_removed=not refresh_data,
+                target_table=OFFERS_TABLE,
             )
-            return
+    console.print(
+        f"{len(plan.to_extract)} new or changed file(s), {len(plan.unchanged)} unchanged, {len(plan.removed)} removed."
+    )
 
-        with console.status("Extracting cell values from files...") as status:
-            data = []
-            for idx, file in enumerate(files, start=1):
-                status.update(
-                    f"[{idx}/{files_count}] ~ Loading data from file: [bold green]{file}[/bold green]"
+    if not plan.to_extract:
+        if plan.removed:
+            with duckdb.connect(conf.db_file) as db:
+                db.execute(
+                    f"delete from {conf.db_schema}.{OFFERS_TABLE} where list_contains(?, unique_id)",
+                    [plan.stale_keys()],
                 )
-                data.append(
-                    extract_cell_values(file, cell_addresses, sap_columns_mapping)
-                )
-        # Use the 'data' variable to create a DataFrame structure which will be manipulated/modified
-        console.print("Assembling offer data into a DataFrame...")
-        df = pd.DataFrame(data)
+                bump_table_version(db, conf.db_schema, OFFERS_TABLE)
+        save_manifest(conf.db_file, conf.db_schema, manifest_key, plan, result_version)
+        return True
+
+    with span("extraction", files=len(plan.to_extract)):
+        with console.status(
+            f"Extracting cell values from files using {workers} worker(s)..."
+        ) as status:
+            data = extract_files(
+                plan.to_extract,
+                cell_addresses,
+                sap_columns_mapping,
+                workers,
+                status,
+                reader,
+            )
+    # Use the 'data' variable to create a DataFrame structure which will be manipulated/modified
+    console.print("Assembling offer data into a DataFrame...")
+    df = pd.DataFrame(data)
+    df["year"] = year_to_scrape
+    if not plan.full_rebuild:
+        replace_keys = ("unique_id", plan.stale_keys())
+    elif not refresh_data:
+        # Una reconstruccion solo sustituye la particion de su anio
+        replace_keys = ("year", [year_to_scrape])
+    else:
+        replace_keys = None
+    with span("load", OFFERS_TABLE, rows=len(df)):
         create_ddb_table(
             df,
             conf.db_file,
             query_file="./queries/fix_offers.sql",
-            table_name=ddb_table_name,
+            table_name=OFFERS_TABLE,
             table_schema=conf.db_schema,
-            insert_instead=refresh_data,
+            insert_instead=True,
+            replace_keys=replace_keys,
+            order_by="year, offer_date",
         )
 
-    if write_file:
-        write_offers(
-            conf.get_output_path(),
-            conf,
-            stylesheet,
-            # reuse_latest_file=True,
-            autofit=False,
-        )
+    failed = {
+        file
+        for file, record in zip(plan.to_extract, data)
+        if record.get("read_status") == "Fail"
+    }
+    save_manifest(
+        conf.db_file, conf.db_schema, manifest_key, plan, result_version, failed
+    )
+    return True
+
+
+def main(
+    update_offers: bool = False,
+    write_file: bool = False,
+    refresh_data: bool = False,
+    year_to_scrape: int = datetime.datetime.now().year,
+    workers: int = DEFAULT_WORKERS,
+    reader: str = READER_BACKEND,
+    rebuild: bool = False,
+    enrich: bool = False,
+    reuse_latest_file: bool = False,
+):
+    with trace_run("offers", conf.db_file):
+        if update_offers:
+            updated = update_offer_table(
+                year_to_scrape, refresh_data, rebuild, workers, reader
+            )
+            if not updated:
+                return
+
+        if write_file:
+            # El fichero enriquecido suma a cada oferta los datos de sus URs (unnested_data)
+            enriched = None
+            if enrich or reuse_latest_file:
+                with span("enrich"):
+                    enriched = enrich_offers(
+                        read_query("./queries/write_offers.sql"), reuse_latest_file
+                    )
+            write_offers(
+                conf.get_output_path(),
+                conf,
+                create_style(styles_file),
+                dataframe=enriched,
+            )
 
 
 if __name__ == "__main__":
@@ -386,6 +656,7 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--year",
+        type=int,
         default=datetime.datetime.now().year,
         help="Year for the offers to scan",
     )
@@ -393,7 +664,13 @@ if __name__ == "__main__":
         "--fix",
         default=False,
         action="store_true",
-        help="Use the latest offers file as base and bring any custom data columns that may have been added",
+        help="Use the latest offers file as base and bring any custom data columns that may have been added. Implies --enrich",
+    )
+    parser.add_argument(
+        "--enrich",
+        default=False,
+        action="store_true",
+        help="Add the data of the offer URs (master_tape, allocation_new and offers) to the Excel file",
     )
     parser.add_argument(
         "--write",
@@ -407,10 +684,33 @@ if __name__ == "__main__":
         action="store_true",
         help="Only insert new files",
     )
+    parser.add_argument(
+        "--rebuild",
+        default=False,
+        action="store_true",
+        help="Ignore the file manifest and read every file again. Not compatible with --refresh",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Number of processes used to read the offer files. Default: {DEFAULT_WORKERS}",
+    )
+    parser.add_argument(
+        "--reader",
+        default=READER_BACKEND,
+        choices=READER_BACKENDS,
+        help=f"Workbook reader: 'stream' reads cell values only, 'full' loads the whole workbook. Default: {READER_BACKEND}",
+    )
     args = parser.parse_args()
     main(
         update_offers=args.update,
         write_file=args.write,
         year_to_scrape=args.year,
         refresh_data=args.refresh,
+        workers=args.workers,
+        reader=args.reader,
+        rebuild=args.rebuild,
+        enrich=args.enrich,
+        reuse_latest_file=args.fix,
     )
@@ -1,120 +1,358 @@
+import argparse
+import datetime
+import multiprocessing
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
 
 import duckdb
 import polars as pl
+import pyarrow as pa
 from rich.console import Console
 
 from conf.functions import create_ddb_table, create_style
+from conf.query_cache import cached_query
+from conf.settings import DEFAULT_WORKERS
 from conf.settings import pipeconf as conf
 from conf.settings import styles_file
-from update_offers import write_output
+from conf.staging import stage_file
+from conf.tracing import record_span, span, timed_call, trace_run
+from conf.writers import write_output
 
 console = Console()
 
 # Instanciar las variables de ficheros, carpetas y otros
 strat_sheet = "Strats"
-stylesheet = create_style(styles_file)
-
-files = [
-    p
-    for p in conf.directory.rglob("*")
-    if p.suffix in [".xlsx", ".xls"] and not p.name.startswith("~")
-]
-sorted_files = sorted([f for f in files], key=os.path.getmtime)
-latest_pipe_file = sorted_files[-1]
-
-console.print("Obteniendo datos externos...")
-
-
-console.print(f"Cargando fichero de pipe: {latest_pipe_file}")
-pipe_data = (
-    pl.read_excel(
-        latest_pipe_file,
-        sheet_name="PIPE",
-        engine="calamine",
-        read_options={
-            "header_row": 2,
-            "skip_rows": 0,
-            "use_columns": "A:AF",
-        },
+
+# Datos del pipe para el Excel: las URs de cada oferta unidas con guiones
+PIPE_REPORT_QUERY = f"""
+    select * replace (array_to_string(promo__ur, '-') as promo__ur)
+    from {conf.db_schema}.pipeline
+"""
+
+
+HISTORY_TABLE = "pipeline_history"
+LATEST_VIEW = "pipeline_latest"
+# Columnas que identifican cada foto del pipe en el historico
+SNAPSHOT_COLUMNS = ["snapshot_date", "source_file", "file_mtime"]
+# Columnas propias de cada fichero, en su orden: el historico tiene las de todos
+SOURCE_COLUMNS = "source_columns"
+# Fecha en el nombre del fichero: 20240115, 2024-01-15, 2024_01_15...
+FILE_DATE_PATTERN = re.compile(r"(20\d{2})[-_.]?(\d{2})[-_.]?(\d{2})")
+
+
+def pipe_files() -> list[Path]:
+    """
+    Pipe workbooks of the pipe folder, oldest first.
+    """
+    files = [
+        p
+        for p in conf.directory.rglob("*")
+        if p.suffix in [".xlsx", ".xls"] and not p.name.startswith("~")
+    ]
+    return sorted([f for f in files], key=os.path.getmtime)
+
+
+def latest_pipe_file() -> Path:
+    return pipe_files()[-1]
+
+
+def pipe_file_date(pipe_file: Path) -> datetime.date:
+    """
+    Date of a pipe snapshot: the one in the file name, or its modification date.
+    """
+    match = FILE_DATE_PATTERN.search(pipe_file.stem)
+    if match:
+        try:
+            return datetime.date(*map(int, match.groups()))
+        except ValueError:
+            pass
+    return datetime.date.fromtimestamp(os.path.getmtime(pipe_file))
+
+
+def read_pipe_file(pipe_file: Path) -> pl.DataFrame:
+    console.print(f"Cargando fichero de pipe: {pipe_file}")
+    return (
+        pl.read_excel(
+            stage_file(pipe_file),
+            sheet_name="PIPE",
+            engine="calamine",
+            read_options={
+                "header_row": 2,
+                "skip_rows": 0,
+                "use_columns": "A:AF",
+            },
+        )
+        .rename(
+            lambda c: re.sub(r"[^A-Za-z0-9\s]", "", c).strip().replace(" ", "_").lower()
+        )
+        .with_columns(
+            pl.col("promo__ur")
+            .str.split("/")
+            .list.eval(pl.element().str.strip_chars().cast(pl.UInt32)),
+            pl.col("id_offer").cast(pl.Int32),
+        )
     )
-    .rename(
-        lambda c: re.sub(r"[^A-Za-z0-9\s]", "", c).strip().replace(" ", "_").lower()
+
+
+def read_snapshot(pipe_file: Path) -> pl.DataFrame:
+    stat = pipe_file.stat()
+    pipe_data = read_pipe_file(pipe_file)
+    return pipe_data.with_columns(
+        pl.lit(pipe_file_date(pipe_file)).alias("snapshot_date"),
+        pl.lit(pipe_file.as_posix()).alias("source_file"),
+        pl.lit(stat.st_mtime).alias("file_mtime"),
+        pl.lit(pipe_data.columns, dtype=pl.List(pl.String)).alias(SOURCE_COLUMNS),
+    )
+
+
+def update_pipe_history(workers: int = DEFAULT_WORKERS) -> int:
+    """
+    Parses the pipe files not in the history yet (or modified since they were loaded),
+    in parallel, and appends them to the pipeline_history table. The pipeline_latest
+    view always shows the most recent snapshot. Returns the number of files loaded.
+    """
+    with duckdb.connect(conf.db_file) as db:
+        db.execute(f"create schema if not exists {conf.db_schema}")
+        history_exists = db.execute(
+            "select count(*) from duckdb_tables() where schema_name = ? and table_name = ?",
+            [conf.db_schema, HISTORY_TABLE],
+        ).fetchone()[0]
+        seen = (
+            dict(
+                db.execute(
+                    f"select distinct source_file, file_mtime from {conf.db_schema}.{HISTORY_TABLE}"
+                ).fetchall()
+            )
+            if history_exists
+            else {}
+        )
+
+    new_files = [
+        f for f in pipe_files() if seen.get(f.as_posix()) != os.path.getmtime(f)
+    ]
+    console.print(f"{len(new_files)} new or modified pipe file(s) to load into the history.")
+    if not new_files:
+        return 0
+
+    snapshots = []
+    # Polars no admite fork: los procesos hijos se arrancan desde cero
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(workers, len(new_files))),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as pool:
+        futures = {pool.submit(timed_call, read_snapshot, f): f for f in new_files}
+        for future in as_completed(futures):
+            try:
+                snapshot, seconds = future.result()
+                snapshots.append(snapshot)
+                record_span(
+                    "read_pipe_file",
+                    seconds,
+                    detail=futures[future].name,
+                    rows=snapshot.height,
+                    files=1,
+                )
+            except Exception as e:
+                # Se reintenta en la siguiente ejecucion
+                console.print(f"Error when loading pipe file {futures[future]}. Details: {e}")
+    if not snapshots:
+        return 0
+
+    # Orden fijo, y no el de llegada, para que las columnas no dependan de los procesos
+    snapshots.sort(
+        key=lambda snapshot: (
+            snapshot["snapshot_date"][0],
+            snapshot["file_mtime"][0],
+            snapshot["source_file"][0],
+        )
+    )
+    history = pl.concat(snapshots, how="diagonal_relaxed")
+    if history_exists:
+        # Los pipes nuevos pueden traer columnas que no tenian los anteriores
+        with duckdb.connect(conf.db_file) as db:
+            db.register("new_snapshots", history.head(0).to_arrow())
+            known = {
+                row[0]
+                for row in db.execute(
+                    "select column_name from duckdb_columns() where schema_name = ? and table_name = ?",
+                    [conf.db_schema, HISTORY_TABLE],
+                ).fetchall()
+            }
+            for name, data_type, *_ in db.execute("describe new_snapshots").fetchall():
+                if name not in known:
+                    db.execute(
+                        f'alter table {conf.db_schema}.{HISTORY_TABLE} add column "{name}" {data_type}'
+                    )
+
+    create_ddb_table(
+        history.to_arrow(),
+        conf.db_file,
+        table_name=HISTORY_TABLE,
+        table_schema=conf.db_schema,
+        insert_instead=True,
+        replace_keys=("source_file", history["source_file"].unique().to_list()),
+        order_by="snapshot_date",
+    )
+    with duckdb.connect(conf.db_file) as db:
+        db.execute(
+            f"""create or replace view {conf.db_schema}.{LATEST_VIEW} as
+            select * from {conf.db_schema}.{HISTORY_TABLE}
+            where source_file = (
+                select source_file from {conf.db_schema}.{HISTORY_TABLE}
+                order by snapshot_date desc, file_mtime desc
+                limit 1
+            )"""
+        )
+    return len(snapshots)
+
+
+def latest_snapshot() -> pl.DataFrame:
+    """
+    The most recent pipe of the history, with the columns of its own file in their
+    order, as read_pipe_file returns it: the report styles go by column letter.
+    Empty when no pipe file has been loaded into the history yet.
+    """
+    with duckdb.connect(conf.db_file) as db:
+        view_exists = db.execute(
+            "select count(*) from duckdb_views() where schema_name = ? and view_name = ?",
+            [conf.db_schema, LATEST_VIEW],
+        ).fetchone()[0]
+        if not view_exists:
+            console.print(
+                f"No pipe snapshots in {conf.db_schema}.{HISTORY_TABLE} yet: check the pipe folder {conf.directory}."
+            )
+            return pl.DataFrame()
+        snapshot = db.sql(f"select * from {conf.db_schema}.{LATEST_VIEW}").pl()
+    columns = None
+    if SOURCE_COLUMNS in snapshot.columns and snapshot.height:
+        columns = snapshot[SOURCE_COLUMNS][0]
+    if columns is None:
+        # Fotos cargadas antes de guardar sus columnas: se quitan las de otros ficheros
+        columns = [
+            c
+            for c in snapshot.columns
+            if c not in [*SNAPSHOT_COLUMNS, SOURCE_COLUMNS]
+            and snapshot[c].null_count() < snapshot.height
+        ]
+    return snapshot.select(list(columns))
+
+
+def build_pipe_table(pipe_data: pl.DataFrame) -> pl.DataFrame:
+    """
+    Joins the pipe with the offer aggregates and saves it as the pipeline table.
+    """
+    console.print("Guardando tabla de pipe en base de datos...")
+
+    with open("./queries/pipe_aggregates.sql", encoding="utf8") as sql_file:
+        query = sql_file.read()
+
+    with duckdb.connect(conf.db_file) as db:
+        with span("query", detail="pipe_aggregates.sql") as measured:
+            # Sin cambios en offers ni en master_tape se reutiliza el resultado anterior
+            agg_data_offers = pl.from_arrow(
+                cached_query(db, query, "pipe_aggregates.sql")
+            )
+            measured.rows = agg_data_offers.height
+
+    to_output = pipe_data.join(agg_data_offers, left_on="id_offer", right_on="offerid")
+
+    # Arrow comparte los buffers de Polars: DuckDB y los writers los leen sin pasar por pandas
+    with span("load", "pipeline", rows=to_output.height):
+        create_ddb_table(
+            to_output.to_arrow(),
+            conf.db_file,
+            table_name="pipeline",
+            table_schema=conf.db_schema,
+        )
+    return to_output
+
+
+def pipe_report_table() -> pa.Table:
+    console.print("Agregando datos y completando pipe con datos externos...")
+    # La misma consulta que usa build.py para el informe del pipe
+    with duckdb.connect(conf.db_file) as db:
+        return db.sql(PIPE_REPORT_QUERY).to_arrow_table()
+
+
+def pipe_styles(rows: int) -> dict:
+    return {
+        "default": [
+            f"A{conf.header_start}:AQ{conf.header_start + rows}",
+        ],
+        "header": [
+            f"A{conf.header_start}:AQ{conf.header_start}",
+        ],
+        "percents": [
+            f"AP{conf.header_start + 1}:AQ{conf.header_start + rows}",
+        ],
+        "dates": [
+            "B2",
+            f"N{conf.header_start + 1}:N{conf.header_start + rows}",
+            f"Q{conf.header_start + 1}:R{conf.header_start + rows}",
+            f"V{conf.header_start + 1}:V{conf.header_start + rows}",
+            f"Y{conf.header_start + 1}:Y{conf.header_start + rows}",
+            f"AC{conf.header_start + 1}:AC{conf.header_start + rows}",
+            f"AF{conf.header_start + 1}:AF{conf.header_start + rows}",
+            f"AH{conf.header_start + 1}:AH{conf.header_start + rows}",
+        ],
+        "data": [
+            f"H{conf.header_start + 1}:M{conf.header_start + rows}",
+            f"AK{conf.header_start + 1}:AN{conf.header_start + rows}",
+        ],
+        "input": ["B3"],
+        "title": ["A1"],
+        "subtitle": ["A2:A3"],
+    }
+
+
+def write_pipe_report(output_file: Path, table: pa.Table):
+    console.print("Creando strats...")
+    main_styles = create_style(styles_file)
+    # Create a Pandas Excel writer using openpyxl as the engine
+    write_output(
+        output_file,
+        {conf.sheet_name: table},
+        main_styles,
+        pipe_styles(table.num_rows),
+        conf.header_start,
+        conf.sheet_name,
+        writer=conf.writer,
+    )
+
+
+def main(history: bool = False, workers: int = DEFAULT_WORKERS):
+    with trace_run("pipe", conf.db_file):
+        console.print("Obteniendo datos externos...")
+        if history:
+            with span("history"):
+                update_pipe_history(workers)
+            pipe_data = latest_snapshot()
+            if pipe_data.is_empty():
+                return
+        else:
+            pipe_file = latest_pipe_file()
+            with span("read_pipe_file", detail=pipe_file.name, files=1) as measured:
+                pipe_data = read_pipe_file(pipe_file)
+                measured.rows = pipe_data.height
+        build_pipe_table(pipe_data)
+        write_pipe_report(conf.get_output_path(), pipe_report_table())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--history",
+        default=False,
+        action="store_true",
+        help="Load every pipe file not seen before into the pipeline_history table and use the latest snapshot",
     )
-    .with_columns(
-        pl.col("promo__ur")
-        .str.split("/")
-        .list.eval(pl.element().str.strip_chars().cast(pl.UInt32)),
-        pl.col("id_offer").cast(pl.Int32),
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Number of processes used to read the pipe files. Default: {DEFAULT_WORKERS}",
     )
-)
-
-console.print("Guardando tabla de pipe en base de datos...")
-
-with open("./queries/pipe_aggregates.sql", encoding="utf8") as sql_file:
-    query = sql_file.read()
-
-with duckdb.connect(conf.db_file) as db:
-    agg_data_offers = db.execute(query).pl()
-
-to_output = pipe_data.join(agg_data_offers, left_on="id_offer", right_on="offerid")
-
-create_ddb_table(
-    to_output.to_pandas(),
-    conf.db_file,
-    table_name="pipeline",
-    table_schema=conf.db_schema,
-)
-
-
-console.print("Agregando datos y completando pipe con datos externos...")
-
-data = {
-    conf.sheet_name: to_output.with_columns(
-        pl.col("promo__ur").list.eval(pl.element().cast(pl.Utf8)).list.join("-")
-    ).to_pandas()
-}
-
-console.print("Creando strats...")
-
-rows = to_output.shape[0]
-main_styles = create_style("./conf/styles.json")
-custom_styles = {
-    "default": [
-        f"A{conf.header_start}:AQ{conf.header_start + rows}",
-    ],
-    "header": [
-        f"A{conf.header_start}:AQ{conf.header_start}",
-    ],
-    "percents": [
-        f"AP{conf.header_start + 1}:AQ{conf.header_start + rows}",
-    ],
-    "dates": [
-        "B2",
-        f"N{conf.header_start + 1}:N{conf.header_start + rows}",
-        f"Q{conf.header_start + 1}:R{conf.header_start + rows}",
-        f"V{conf.header_start + 1}:V{conf.header_start + rows}",
-        f"Y{conf.header_start + 1}:Y{conf.header_start + rows}",
-        f"AC{conf.header_start + 1}:AC{conf.header_start + rows}",
-        f"AF{conf.header_start + 1}:AF{conf.header_start + rows}",
-        f"AH{conf.header_start + 1}:AH{conf.header_start + rows}",
-    ],
-    "data": [
-        f"H{conf.header_start + 1}:M{conf.header_start + rows}",
-        f"AK{conf.header_start + 1}:AN{conf.header_start + rows}",
-    ],
-    "input": ["B3"],
-    "title": ["A1"],
-    "subtitle": ["A2:A3"],
-}
-
-# Create a Pandas Excel writer using openpyxl as the engine
-write_output(
-    conf.get_output_path(),
-    data,
-    main_styles,
-    custom_styles,
-    conf.header_start,
-    conf.sheet_name,
-)
+    args = parser.parse_args()
+    main(history=args.history, workers=args.workers)
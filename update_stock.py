@@ -1,87 +1,158 @@
+import argparse
+from pathlib import Path
+
 import duckdb
+import pyarrow as pa
 from rich.console import Console
 
-from conf.functions import create_style
+from conf.functions import create_style, execute_sql_file, stream_query
+from conf.parquet_sync import stale_tables
+from conf.query_cache import (
+    forget_table_version,
+    materialize_query,
+    query_fingerprint,
+    set_table_version,
+)
+from conf.settings import DIR_PARQUET, EXPORT_BATCH_ROWS
 from conf.settings import stockconf as conf
 from conf.settings import styles_file
-from update_offers import write_output
+from conf.tracing import span, trace_run
+from conf.writers import StreamedTable, write_output
 
 con = Console()
 
-# Instanciar las variables de ficheros, carpetas y otros
-stylesheet = create_style(styles_file)
-
-con.print("Accessing data...")
-
-lote_queries = []
-datos = {}
-
-with duckdb.connect(conf.db_file) as db:
-    # for tipo_agregacion in ["Wholesale", "Wholesale - from Retail", "No longer in Wholesale"]:
-    # # Iterate over each query
-    #     with open("./queries/stock_query.sql", encoding="utf8") as sql_file:
-    #         query = sql_file.read()
-    #         if not query.strip():
-    #             continue
-    #
-    #     # Replace placeholders with parameters
-    #     query = query.replace("{{placeholder}}", "'" + tipo_agregacion + "'")
-    #
-    #     # Execute query
-    #     print(f"Filtering for channel: {tipo_agregacion}")
-    #     query_as_df = db.execute(query).df()
-    #     lote_queries.append(query_as_df)
-    #     sheet_data = {tipo_agregacion: query_as_df}
-    #     datos |= sheet_data
+# Tablas de origen que se cargan desde la carpeta Parquet
+STOCK_SOURCES = [
+    "master_tape",
+    "channels_historic",
+    "latest_operations",
+    "disaggregated_assets",
+    "iso3166_provincias",
+]
+
+# La zona horaria se quita en SQL: el Excel no admite fechas con zona horaria
+STOCK_EXPORT_QUERY = """
+    select * replace (cast(updated_at as timestamp) as updated_at)
+    from stock
+"""
+
+
+def check_sources():
+    con.print("Checking source tables...")
+    stale = stale_tables(DIR_PARQUET, conf.db_file, STOCK_SOURCES)
+    if stale:
+        con.print(
+            f"[yellow]{', '.join(stale)} changed since the last Parquet sync, run sync_parquet.py to reload them."
+        )
 
+
+def stamp_derived_tables(
+    db, query_file: str, tables: list[str], temp_tables: list[str] = ()
+):
+    """
+    Versions the tables a SQL file maintains by the versions of the tables it reads,
+    so the queries built on them (stock_data.sql) can be cached. The file's own
+    tables, temporary ones included, are not inputs.
+    """
+    with open(query_file, encoding="utf8") as f:
+        version = query_fingerprint(db, f.read(), exclude={*tables, *temp_tables})
+    for table_name in tables:
+        if version is None:
+            # Alguna entrada sin version: se quita la anterior para no reutilizar nada
+            forget_table_version(db, "main", table_name)
+        else:
+            set_table_version(db, "main", table_name, version)
+
+
+def build_stock_table(db):
+    con.print("Updating city to province mapping...")
+    with span("sql", detail="city_province_map.sql"):
+        execute_sql_file(db, "./queries/city_province_map.sql")
+        stamp_derived_tables(
+            db, "./queries/city_province_map.sql", ["city_province_map"]
+        )
+    con.print("Updating channel and coordinates per UR...")
+    with span("sql", detail="ur_channel_dim.sql"):
+        execute_sql_file(db, "./queries/ur_channel_dim.sql")
+        stamp_derived_tables(
+            db,
+            "./queries/ur_channel_dim.sql",
+            ["ur_channel_ingested", "ur_x_counts", "ur_y_counts", "ur_channel_dim"],
+            temp_tables=["ur_channel_new"],
+        )
     con.print("Creating/updating stock table in database...")
     with open("./queries/stock_data.sql", encoding="utf8") as stock_table_query:
         query = stock_table_query.read()
-    db.execute(f"CREATE OR REPLACE TABLE stock AS {query}")
+    with span("sql", detail="stock_data.sql") as measured:
+        # Sin cambios en las tablas de origen la tabla stock ya esta al dia
+        materialize_query(db, query, "stock", name="stock_data.sql")
+        measured.rows = db.execute("select count(*) from stock").fetchone()[0]
     con.print("✅ Done!")
-    # Añadido hasta que podamos partir el perimetro correctamente (ex-WS, etc.)
-    query_as_df = db.sql("select * from stock").df()
-    query_as_df.updated_at = query_as_df.updated_at.dt.tz_localize(None)
-    sheet_data = {"Wholesale": query_as_df}
-    datos |= sheet_data
-
-rows = datos["Wholesale"].shape[0]
-
-
-custom_styles = {
-    "default": [
-        f"A{conf.header_start}:AQ{conf.header_start + rows}",
-    ],
-    "header": [
-        f"A{conf.header_start}:AQ{conf.header_start}",
-    ],
-    "percents": [
-        f"F{conf.header_start + 1}:H{conf.header_start + rows}",
-    ],
-    "dates": [
-        f"R{conf.header_start + 1}:T{conf.header_start + rows}",
-        f"AQ{conf.header_start + 1}:AQ{conf.header_start + rows}",
-    ],
-    "data": [
-        f"U{conf.header_start + 1}:W{conf.header_start + rows}",
-        f"Z{conf.header_start + 1}:AC{conf.header_start + rows}",
-        f"AE{conf.header_start + 1}:AH{conf.header_start + rows}",
-        f"AJ{conf.header_start + 1}:AL{conf.header_start + rows}",
-    ],
-    "input": ["B3"],
-    "title": ["A1"],
-    "subtitle": ["A2:A3"],
-}
-
-con.print("Creating Excel output file...")
-
-write_output(
-    conf.get_output_path(),
-    datos,
-    stylesheet,
-    custom_styles,
-    conf.header_start,
-    conf.sheet_name,
-    # reuse_latest_file=True,
-    # autofit=False
-)
+
+
+def stock_styles(rows: int) -> dict:
+    return {
+        "default": [
+            f"A{conf.header_start}:AQ{conf.header_start + rows}",
+        ],
+        "header": [
+            f"A{conf.header_start}:AQ{conf.header_start}",
+        ],
+        "percents": [
+            f"F{conf.header_start + 1}:H{conf.header_start + rows}",
+        ],
+        "dates": [
+            f"R{conf.header_start + 1}:T{conf.header_start + rows}",
+            f"AQ{conf.header_start + 1}:AQ{conf.header_start + rows}",
+        ],
+        "data": [
+            f"U{conf.header_start + 1}:W{conf.header_start + rows}",
+            f"Z{conf.header_start + 1}:AC{conf.header_start + rows}",
+            f"AE{conf.header_start + 1}:AH{conf.header_start + rows}",
+            f"AJ{conf.header_start + 1}:AL{conf.header_start + rows}",
+        ],
+        "input": ["B3"],
+        "title": ["A1"],
+        "subtitle": ["A2:A3"],
+    }
+
+
+def write_stock_report(output_file: Path, stock: pa.Table | StreamedTable):
+    con.print("Creating Excel output file...")
+    write_output(
+        output_file,
+        {"Wholesale": stock},
+        create_style(styles_file),
+        stock_styles(stock.num_rows),
+        conf.header_start,
+        conf.sheet_name,
+        writer=conf.writer,
+        # reuse_latest_file=True,
+        # autofit=False
+    )
+
+
+def main(batch_size: int = EXPORT_BATCH_ROWS):
+    with trace_run("stock", conf.db_file):
+        check_sources()
+
+        con.print("Accessing data...")
+        with duckdb.connect(conf.db_file) as db:
+            build_stock_table(db)
+
+            # Añadido hasta que podamos partir el perimetro correctamente (ex-WS, etc.)
+            # Las filas se leen por lotes mientras se escribe el Excel
+            stock = stream_query(db, STOCK_EXPORT_QUERY, batch_size)
+            write_stock_report(conf.get_output_path(), stock)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=EXPORT_BATCH_ROWS,
+        help=f"Rows per batch read from the stock table while writing the file. Default: {EXPORT_BATCH_ROWS}",
+    )
+    args = parser.parse_args()
+    main(batch_size=args.batch_size)
@@ -0,0 +1,305 @@
+import argparse
+import datetime
+import itertools
+import os
+import secrets
+import stat
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+from conf.settings import WORKER_ADDRESS, WORKER_KEY_FILE
+
+
+def run_offers(**kwargs):
+    from update_offers import main
+
+    main(**kwargs)
+
+
+def run_pipe(**kwargs):
+    from update_pipe import main
+
+    main(**kwargs)
+
+
+def run_stock(**kwargs):
+    from update_stock import main
+
+    main(**kwargs)
+
+
+def run_mail(**kwargs):
+    from retrieve_email_attachments import retrieve_attachments
+
+    retrieve_attachments(**kwargs)
+
+
+def run_sync(**kwargs):
+    from sync_parquet import main
+
+    main(**kwargs)
+
+
+def run_build(**kwargs):
+    from build import main
+
+    main(**kwargs)
+
+
+# Trabajos que acepta el worker: funcion y recursos que no pueden compartirse.
+# Los que escriben en la base de datos ("db") se ejecutan de uno en uno
+JOBS = {
+    "offers": (run_offers, {"db"}),
+    "pipe": (run_pipe, {"db"}),
+    "stock": (run_stock, {"db"}),
+    "mail": (run_mail, {"mailbox"}),
+    "sync": (run_sync, {"db"}),
+    "build": (run_build, {"db"}),
+}
+
+
+@dataclass
+class Ticket:
+    job_id: int
+    job: str
+    resources: set = field(default_factory=set)
+
+
+class Scheduler:
+    """
+    Starts each job as soon as no running job holds one of its resources and no job
+    queued before it needs them. Jobs that share nothing run at the same time.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.busy = set()
+        self.waiting: list[Ticket] = []
+        self.running: list[Ticket] = []
+
+    def can_start(self, ticket: Ticket) -> bool:
+        if ticket.resources & self.busy:
+            return False
+        earlier = self.waiting[: self.waiting.index(ticket)]
+        return not any(t.resources & ticket.resources for t in earlier)
+
+    def acquire(self, ticket: Ticket, on_wait):
+        with self.condition:
+            self.waiting.append(ticket)
+            if not self.can_start(ticket):
+                on_wait([t.job for t in self.running])
+            while not self.can_start(ticket):
+                self.condition.wait()
+            self.waiting.remove(ticket)
+            self.running.append(ticket)
+            self.busy |= ticket.resources
+
+    def release(self, ticket: Ticket):
+        with self.condition:
+            self.running.remove(ticket)
+            self.busy -= ticket.resources
+            self.condition.notify_all()
+
+    def status(self) -> dict:
+        with self.condition:
+            return {
+                "running": [t.job for t in self.running],
+                "waiting": [t.job for t in self.waiting],
+            }
+
+
+class RoutedStream:
+    """
+    Replacement for sys.stdout: what a job thread prints is sent to the client that
+    submitted it, everything else goes to the worker console.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.sinks = threading.local()
+
+    def write(self, text):
+        send = getattr(self.sinks, "send", None)
+        if send is None:
+            return self.stream.write(text)
+        if text:
+            send(("log", text))
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self):
+        return False
+
+    @property
+    def encoding(self):
+        return getattr(self.stream, "encoding", "utf-8")
+
+
+def worker_authkey(create: bool = False, key_file: Path = WORKER_KEY_FILE) -> bytes | None:
+    """
+    Key shared by the worker and its clients: random, per user, kept in a file only
+    the user can read. The worker creates it on first start; clients only read it and
+    get None if there is none, i.e. no worker was ever started by this user.
+    """
+    key_file = Path(key_file)
+    if not key_file.exists():
+        if not create:
+            return None
+        try:
+            # O_EXCL: si dos workers arrancan a la vez, el segundo lee la clave del primero
+            handle = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(handle, "wb") as f:
+                f.write(secrets.token_hex(32).encode())
+    if os.name == "posix" and key_file.stat().st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        # En Windows la carpeta del usuario ya esta protegida por sus permisos
+        os.chmod(key_file, 0o600)
+    return key_file.read_bytes().strip()
+
+
+def serve(warm: bool = True):
+    # Los scripts usan rutas relativas (./queries, ./conf): el worker trabaja desde el repo
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    scheduler = Scheduler()
+    job_ids = itertools.count(1)
+    stdout = RoutedStream(sys.stdout)
+    sys.stdout = stdout
+
+    # Se importan ya las librerias de los trabajos para que el primero no pague el coste.
+    # La base de datos no se deja abierta: bloquearia el fichero a los scripts sueltos
+    if warm:
+        for module in ("update_offers", "update_pipe", "update_stock", "build"):
+            try:
+                __import__(module)
+            except Exception as e:
+                print(f"Could not preload {module}: {e}")
+
+    def handle(conn):
+        with conn:
+            try:
+                request = conn.recv()
+            except EOFError:
+                return
+            job = request.get("job")
+            if job == "status":
+                conn.send(("status", scheduler.status()))
+                return
+            if job not in JOBS:
+                conn.send(("failed", f"Unknown job {job}, use one of {sorted(JOBS)}"))
+                return
+
+            function, resources = JOBS[job]
+            ticket = Ticket(next(job_ids), job, resources)
+            conn.send(("queued", ticket.job_id))
+            scheduler.acquire(ticket, lambda running: conn.send(("waiting", running)))
+            conn.send(("started", ticket.job_id))
+            print(f"[{datetime.datetime.now():%H:%M:%S}] Job {ticket.job_id} ({job}) started")
+            start = time.perf_counter()
+            lock = threading.Lock()
+
+            def send(event):
+                with lock:
+                    try:
+                        conn.send(event)
+                    except OSError:
+                        # El cliente se ha ido: el trabajo sigue y la salida se pierde
+                        pass
+
+            stdout.sinks.send = send
+            try:
+                function(**request.get("kwargs", {}))
+                result = ("done", time.perf_counter() - start)
+            except BaseException as e:
+                send(("log", traceback.format_exc()))
+                result = ("failed", f"{type(e).__name__}: {e}")
+            finally:
+                stdout.sinks.send = None
+                print(f"[{datetime.datetime.now():%H:%M:%S}] Job {ticket.job_id} ({job}) {result[0]}")
+                scheduler.release(ticket)
+            send(result)
+
+    with Listener(WORKER_ADDRESS, authkey=worker_authkey(create=True)) as listener:
+        print(f"Worker listening on {WORKER_ADDRESS[0]}:{WORKER_ADDRESS[1]}")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except AuthenticationError:
+                    # Conexion sin la clave del usuario: se descarta sin leer nada
+                    print("Rejected a connection without the worker key")
+                    continue
+                threading.Thread(target=handle, args=(conn,), daemon=True).start()
+        except KeyboardInterrupt:
+            print("Worker stopped")
+
+
+def submit(job: str, **kwargs) -> bool:
+    """
+    Sends a job to the worker and prints its output as it arrives.
+    Returns False when no worker is running, so the caller can run the job itself.
+    """
+    authkey = worker_authkey()
+    if authkey is None:
+        return False
+    try:
+        conn = Client(WORKER_ADDRESS, authkey=authkey)
+    except (ConnectionRefusedError, OSError):
+        return False
+    except AuthenticationError:
+        print(f"The process listening on {WORKER_ADDRESS[1]} did not accept the key in {WORKER_KEY_FILE}")
+        return False
+    with conn:
+        conn.send({"job": job, "kwargs": kwargs})
+        while True:
+            try:
+                event, payload = conn.recv()
+            except EOFError:
+                print("The worker closed the connection")
+                return True
+            if event == "log":
+                print(payload, end="")
+            elif event == "queued":
+                print(f"Job {payload} ({job}) sent to the worker")
+            elif event == "waiting":
+                print(f"Waiting for the running jobs to finish: {', '.join(payload)}")
+            elif event == "done":
+                print(f"Job {job} finished in {payload:.1f} s")
+                return True
+            elif event == "failed":
+                print(f"Job {job} failed: {payload}")
+                return True
+            elif event == "status":
+                print(payload)
+                return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--no-warm",
+        default=False,
+        action="store_true",
+        help="Do not preload the job modules at start-up",
+    )
+    parser.add_argument(
+        "--status",
+        default=False,
+        action="store_true",
+        help="Show the running and queued jobs of the worker and exit",
+    )
+    args = parser.parse_args()
+    if args.status:
+        if not submit("status"):
+            print("No worker running")
+    else:
+        serve(warm=not args.no_warm)
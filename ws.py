@@ -0,0 +1,295 @@
+import argparse
+import datetime
+import re
+import subprocess
+import sys
+import time
+
+from conf.settings import (
+    DEFAULT_WORKERS,
+    EXPORT_BATCH_ROWS,
+    MAIL_BACKENDS,
+    READER_BACKEND,
+    READER_BACKENDS,
+)
+
+# Aqui solo se importan la libreria estandar y conf.settings: cada subcomando carga
+# sus modulos (pandas, polars, duckdb, openpyxl...) cuando se ejecuta
+
+# Modulo que carga cada subcomando, para el informe de arranque
+COMMAND_MODULES = {
+    "offers": "update_offers",
+    "pipe": "update_pipe",
+    "stock": "update_stock",
+    "mail": "retrieve_email_attachments",
+    "build": "build",
+    "sync": "sync_parquet",
+}
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def run_offers(args):
+    from update_offers import main
+
+    main(
+        update_offers=args.update,
+        write_file=args.write,
+        year_to_scrape=args.year,
+        refresh_data=args.refresh,
+        workers=args.workers,
+        reader=args.reader,
+        rebuild=args.rebuild,
+        enrich=args.enrich,
+        reuse_latest_file=args.fix,
+    )
+
+
+def run_pipe(args):
+    from update_pipe import main
+
+    main(history=args.history, workers=args.workers)
+
+
+def run_stock(args):
+    from update_stock import main
+
+    main(batch_size=args.batch_size)
+
+
+def run_mail(args):
+    from retrieve_email_attachments import retrieve_attachments
+
+    retrieve_attachments(
+        args.file_type, args.path, args.months, args.backend, args.maildir
+    )
+
+
+def run_build(args):
+    from build import main
+
+    main(args.year, args.workers, args.force)
+
+
+def run_sync(args):
+    from sync_parquet import main
+
+    main(tables=args.tables, force=args.force)
+
+
+def import_profile(module: str) -> tuple[float, list[tuple[float, str]]]:
+    """
+    Imports module in a fresh interpreter with -X importtime. Returns the total import
+    time in seconds and the cost of the packages it imports directly.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    # Cada modulo aparece despues de los que importa, con dos espacios mas de sangria
+    total, direct, pending = 0.0, [], []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, name = match.groups()
+        seconds = int(cumulative) / 1e6
+        if not indent:
+            if name == module:
+                total, direct = seconds, pending
+            pending = []
+        elif len(indent) == 2:
+            pending.append((seconds, name))
+    return total, sorted(direct, reverse=True)
+
+
+def startup_report(top: int = 5):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, __file__, "--help"], capture_output=True)
+    print(f"{'ws.py --help':<36}{time.perf_counter() - start:>8.2f} s")
+    for command, module in COMMAND_MODULES.items():
+        total, direct = import_profile(module)
+        heaviest = ", ".join(f"{name} {seconds:.2f}" for seconds, name in direct[:top])
+        print(f"{command + ' (' + module + ')':<36}{total:>8.2f} s   {heaviest}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    current_year = datetime.datetime.now().year
+    parser = argparse.ArgumentParser(
+        description="Wholesale channel files: offers, pipe, stock, mail and build"
+    )
+    parser.add_argument(
+        "--startup-report",
+        default=False,
+        action="store_true",
+        help="Show how long each subcommand takes to import its modules and exit",
+    )
+    parser.add_argument(
+        "--local-db",
+        default=False,
+        action="store_true",
+        help="Work on a local copy of the database and publish it back at the end",
+    )
+    commands = parser.add_subparsers(dest="command")
+
+    offers = commands.add_parser(
+        "offers", help="Scan the offer files and write the offers file"
+    )
+    offers.add_argument(
+        "--update",
+        default=False,
+        action="store_true",
+        help="Scan the offer folders and update the offer data",
+    )
+    offers.add_argument(
+        "--year", type=int, default=current_year, help="Year for the offers to scan"
+    )
+    offers.add_argument(
+        "--write", default=False, action="store_true", help="Create the Excel file"
+    )
+    offers.add_argument(
+        "--refresh", default=False, action="store_true", help="Only insert new files"
+    )
+    offers.add_argument(
+        "--rebuild",
+        default=False,
+        action="store_true",
+        help="Ignore the file manifest and read every file again. Not with --refresh",
+    )
+    offers.add_argument(
+        "--enrich",
+        default=False,
+        action="store_true",
+        help="Add the data of the offer URs to the Excel file",
+    )
+    offers.add_argument(
+        "--fix",
+        default=False,
+        action="store_true",
+        help="Bring the custom columns of the latest offers file. Implies --enrich",
+    )
+    offers.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Processes used to read the offer files. Default: {DEFAULT_WORKERS}",
+    )
+    offers.add_argument(
+        "--reader",
+        default=READER_BACKEND,
+        choices=READER_BACKENDS,
+        help=f"Workbook reader. Default: {READER_BACKEND}",
+    )
+    offers.set_defaults(run=run_offers)
+
+    pipe = commands.add_parser(
+        "pipe", help="Load the latest pipe and write the pipeline file"
+    )
+    pipe.add_argument(
+        "--history",
+        default=False,
+        action="store_true",
+        help="Load every pipe file not seen before into pipeline_history",
+    )
+    pipe.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Processes used to read the pipe files. Default: {DEFAULT_WORKERS}",
+    )
+    pipe.set_defaults(run=run_pipe)
+
+    stock = commands.add_parser(
+        "stock", help="Build the stock table and write the stock file"
+    )
+    stock.add_argument(
+        "--batch-size",
+        type=int,
+        default=EXPORT_BATCH_ROWS,
+        help=f"Rows per batch read while writing the file. Default: {EXPORT_BATCH_ROWS}",
+    )
+    stock.set_defaults(run=run_stock)
+
+    mail = commands.add_parser(
+        "mail", help="Save the offer or pipe attachments received by email"
+    )
+    mail.add_argument(
+        "--file_type",
+        required=True,
+        choices=["pipe", "offers"],
+        help="Type of file to search: pipeline or offers",
+    )
+    mail.add_argument(
+        "--months",
+        type=int,
+        default=1,
+        choices=range(1, 12),
+        help="Number of months to look back to. Default: 1",
+    )
+    mail.add_argument(
+        "--path",
+        default="coralhudson",
+        choices=["coralhudson", "currentdir"],
+        help="Where to save down the files to",
+    )
+    mail.add_argument(
+        "--backend",
+        default="outlook",
+        choices=MAIL_BACKENDS,
+        help="Mailbox to read. Default: outlook",
+    )
+    mail.add_argument(
+        "--maildir", help="Folder with the messages, for the maildir backend"
+    )
+    mail.set_defaults(run=run_mail)
+
+    build = commands.add_parser(
+        "build", help="Run every stage whose inputs changed and write the files"
+    )
+    build.add_argument(
+        "--year", type=int, default=current_year, help="Year of the offers to scan"
+    )
+    build.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Processes used to read the offer files. Default: {DEFAULT_WORKERS}",
+    )
+    build.add_argument(
+        "--force",
+        default=False,
+        action="store_true",
+        help="Run every stage even if its inputs did not change",
+    )
+    build.set_defaults(run=run_build)
+
+    sync = commands.add_parser(
+        "sync", help="Load the changed Parquet snapshots into the database"
+    )
+    sync.add_argument(
+        "--tables", nargs="+", default=None, help="Only sync these tables"
+    )
+    sync.add_argument(
+        "--force",
+        default=False,
+        action="store_true",
+        help="Reload the tables even if their files did not change",
+    )
+    sync.set_defaults(run=run_sync)
+    return parser
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.startup_report:
+        startup_report()
+    elif args.command is None:
+        parser.print_help()
+    elif args.local_db:
+        from conf.staging import local_replica
+
+        with local_replica():
+            args.run(args)
+    else:
+        args.run(args)